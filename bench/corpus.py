@@ -0,0 +1,149 @@
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List
+
+from docx import Document
+from openpyxl import Workbook
+from pptx import Presentation
+from pptx.util import Inches
+
+# Words the regex rules in config/regex.yml react to, so heuristics label
+# part of the corpus with confidence and the rest needs review.
+DOC_TYPES = ("SOP", "PCN", "Release Note", "Troubleshooting Guide", "Manual", "Specification", "Checklist")
+MODELS = ("S50", "V40", "Scrubber 75", "Phantas", "Workstation")
+SUBSYSTEMS = ("laser", "firmware", "battery", "drive motor", "pump", "touch screen", "wifi")
+FILLER = ("the", "robot", "cleaning", "check", "replace", "verify", "unit", "before", "after", "with",
+          "service", "step", "torque", "connector", "cable", "panel", "route", "map", "sensor", "and")
+SUFFIXES = (".pdf", ".docx", ".xlsx", ".pptx")
+SUFFIX_WEIGHTS = (5, 3, 1, 1)
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(FILLER) for _ in range(rng.randint(8, 16))]
+    words.insert(rng.randrange(len(words)), rng.choice(SUBSYSTEMS))
+    if rng.random() < 0.3:
+        words.append(f"HW {rng.choice(('1.4', '3.6', '4.2'))} AIO{rng.randint(1, 4)}")
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraphs(rng: random.Random, title: str, count: int) -> List[str]:
+    return [title] + [" ".join(_sentence(rng) for _ in range(rng.randint(2, 5))) for _ in range(count)]
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _write_pdf(path: Path, paragraphs: List[str]) -> None:
+    # A plain text PDF (Helvetica, 40 lines a page) with a correct xref table.
+    lines: List[str] = []
+    for paragraph in paragraphs:
+        words = paragraph.split()
+        while words:
+            lines.append(" ".join(words[:12]))
+            words = words[12:]
+    pages = [lines[start:start + 40] for start in range(0, len(lines), 40)] or [[]]
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in pages:
+        text = "".join(f"({_pdf_escape(line)}) Tj T* " for line in page)
+        stream = f"BT /F1 10 Tf 14 TL 50 780 Td {text}ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    body = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(body))
+        body += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1", "replace")
+    xref = len(body)
+    body += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    body += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    body += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    path.write_bytes(bytes(body))
+
+
+def _write_docx(path: Path, paragraphs: List[str]) -> None:
+    document = Document()
+    document.add_heading(paragraphs[0], level=1)
+    for paragraph in paragraphs[1:]:
+        document.add_paragraph(paragraph)
+    document.save(path)
+
+
+def _write_xlsx(path: Path, paragraphs: List[str]) -> None:
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(["step", "description", "owner"])
+    for index, paragraph in enumerate(paragraphs, start=1):
+        sheet.append([index, paragraph, "technician"])
+    workbook.save(path)
+
+
+def _write_pptx(path: Path, paragraphs: List[str]) -> None:
+    presentation = Presentation()
+    for paragraph in paragraphs:
+        slide = presentation.slides.add_slide(presentation.slide_layouts[6])
+        box = slide.shapes.add_textbox(Inches(0.5), Inches(0.5), Inches(9), Inches(6))
+        box.text_frame.text = paragraph
+    presentation.save(path)
+
+
+_WRITERS = {".pdf": _write_pdf, ".docx": _write_docx, ".xlsx": _write_xlsx, ".pptx": _write_pptx}
+
+
+def generate_corpus(out_dir: str, files: int = 1000, depth: int = 3, fanout: int = 4,
+                    duplicate_ratio: float = 0.1, seed: int = 7) -> Dict:
+    # Writes out_dir/blobs/* and out_dir/manifest.json describing a team
+    # folder tree of `depth` levels with `fanout` subfolders each. File sizes
+    # are skewed (most small, a few dozen-page documents); duplicate_ratio of
+    # the files reuse another file's content under a new name and folder.
+    rng = random.Random(seed)
+    root = Path(out_dir)
+    blobs = root / "blobs"
+    blobs.mkdir(parents=True, exist_ok=True)
+    modified = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    folders: Dict[str, Dict] = {}
+    frontier = ["teamfolder"]
+    for level in range(depth):
+        next_frontier = []
+        for parent in frontier:
+            for index in range(fanout):
+                folder_id = f"fo{len(folders):05d}"
+                folders[folder_id] = {"name": f"{rng.choice(MODELS)} {rng.choice(DOC_TYPES)}s {level}-{index}",
+                                      "parent": parent}
+                next_frontier.append(folder_id)
+        frontier = next_frontier
+    parents = ["teamfolder", *folders]
+
+    documents: Dict[str, Dict] = {}
+    originals: List[str] = []
+    for index in range(files):
+        file_id = f"fi{index:06d}"
+        if originals and rng.random() < duplicate_ratio:
+            source = documents[rng.choice(originals)]
+            blob, suffix, size = source["blob"], source["suffix"], source["size"]
+        else:
+            suffix = rng.choices(SUFFIXES, SUFFIX_WEIGHTS)[0]
+            blob = f"{file_id}{suffix}"
+            paragraphs = _paragraphs(rng, f"{rng.choice(MODELS)} {rng.choice(DOC_TYPES)}",
+                                     int(rng.paretovariate(1.2) * 4))
+            _WRITERS[suffix](blobs / blob, paragraphs)
+            size = (blobs / blob).stat().st_size
+            originals.append(file_id)
+        stamp = (modified + timedelta(minutes=index)).isoformat()
+        documents[file_id] = {
+            "name": f"{rng.choice(MODELS)} {rng.choice(SUBSYSTEMS)} {rng.choice(DOC_TYPES)} {index:05d}{suffix}",
+            "parent": rng.choice(parents), "blob": blob, "suffix": suffix, "size": size, "modified_at": stamp,
+        }
+    manifest = {"root": "teamfolder", "folders": folders, "files": documents, "seed": seed}
+    (root / "manifest.json").write_text(json.dumps(manifest, indent=1))
+    return manifest
+
+
+def load_manifest(corpus_dir: str) -> Dict:
+    return json.loads((Path(corpus_dir) / "manifest.json").read_text())
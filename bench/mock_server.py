@@ -0,0 +1,244 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List
+from urllib.parse import parse_qs, urlsplit
+
+from bench.corpus import load_manifest
+
+# A stand-in for the slice of the WorkDrive API the pipeline uses: folder
+# listings with page[offset]/page[limit], file metadata, downloads and data
+# template create/attach/PATCH, plus a bulk PATCH of many files' values
+# (unless `bulk` is off). Values can only be set on files the template is
+# attached to. Every API response waits `latency` seconds (± jitter) and a
+# `throttle_rate` share of them is a 429 with Retry-After.
+PREFIX = "/api/v1"
+_ROUTES = (
+    ("list", "GET", re.compile(r"/(?:teamfolders|files)/([^/]+)/files")),
+    ("download", "GET", re.compile(r"/(?:download/([^/]+)|files/([^/]+)/content)")),
+    ("metadata", "GET", re.compile(r"/files/([^/]+)")),
+    ("create_template", "POST", re.compile(r"/data/templates")),
+    ("attach", "POST", re.compile(r"/files/([^/]+)/data/templates")),
+    ("update_values", "PATCH", re.compile(r"/files/([^/]+)/data/templates/([^/]+)")),
+    ("bulk_update", "PATCH", re.compile(r"/data/templates/([^/]+)/values")),
+)
+
+
+class MockWorkDrive(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, corpus_dir: str, port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: float = 1.0, seed: int = 7, bulk: bool = True):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.blobs = Path(corpus_dir) / "blobs"
+        manifest = load_manifest(corpus_dir)
+        self.root = manifest["root"]
+        self.folders = manifest["folders"]
+        self.files = manifest["files"]
+        self.children: Dict[str, List[str]] = {}
+        for item_id, item in [*self.folders.items(), *self.files.items()]:
+            self.children.setdefault(item["parent"], []).append(item_id)
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats: Dict[str, int] = {"requests": 0, "throttled": 0}
+        self.bulk = bulk
+        self.attached: Dict[str, set] = {}  # file_id -> template ids
+        self.template_values: Dict[str, Dict] = {}
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}{PREFIX}"
+
+    def count(self, key: str) -> None:
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def throttle(self) -> bool:
+        with self.lock:
+            delay = max(self.latency + self.rng.uniform(-self.jitter, self.jitter), 0.0)
+            throttled = self.rng.random() < self.throttle_rate
+        time.sleep(delay)
+        return throttled
+
+    def item(self, item_id: str) -> Dict:
+        if item_id in self.folders:
+            folder = self.folders[item_id]
+            kids = self.children.get(item_id, [])
+            subfolders = sum(1 for kid in kids if kid in self.folders)
+            attributes = {
+                "name": folder["name"], "type": "folder", "modified_at": "2025-01-01T00:00:00+00:00",
+                "storage_info": {"files_count": len(kids) - subfolders, "folders_count": subfolders},
+            }
+        else:
+            document = self.files[item_id]
+            attributes = {
+                "name": document["name"], "type": document["suffix"].lstrip("."),
+                "content_size": document["size"], "created_at": document["modified_at"],
+                "modified_at": document["modified_at"], "permalink": f"/file/{item_id}",
+                "download_url": f"{self.url}/download/{item_id}",
+            }
+        return {"id": item_id, "type": "files", "attributes": attributes}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: MockWorkDrive
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, delayed ACKs
+    # add ~40 ms to every keep-alive response.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send_json(self, status: int, body: Dict, headers: Dict[str, str] | None = None) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_body(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+    def _dispatch(self, method: str) -> None:
+        url = urlsplit(self.path)
+        body = self._read_body() if method in ("POST", "PATCH") else {}
+        if url.path == "/_bench/stats":
+            with self.server.lock:
+                return self._send_json(200, dict(self.server.stats))
+        path = url.path[len(PREFIX):] if url.path.startswith(PREFIX) else None
+        route = next(
+            ((name, match) for name, verb, pattern in _ROUTES
+             if verb == method and path is not None and (match := pattern.fullmatch(path))),
+            None,
+        )
+        if route is None:
+            return self._send_json(404, {"errors": [{"title": f"no route for {method} {url.path}"}]})
+        name, match = route
+        if name == "bulk_update" and not self.server.bulk:
+            return self._send_json(404, {"errors": [{"title": f"no route for {method} {url.path}"}]})
+        self.server.count("requests")
+        if self.server.throttle():
+            self.server.count("throttled")
+            return self._send_json(429, {"errors": [{"title": "rate limited"}]},
+                                   {"Retry-After": str(self.server.retry_after)})
+        self.server.count(name)
+        getattr(self, f"_{name}")(match, parse_qs(url.query), body)
+
+    def do_GET(self) -> None:
+        self._dispatch("GET")
+
+    def do_POST(self) -> None:
+        self._dispatch("POST")
+
+    def do_PATCH(self) -> None:
+        self._dispatch("PATCH")
+
+    def _list(self, match, query, body) -> None:
+        container = match.group(1)
+        if container not in self.server.folders and container != self.server.root:
+            return self._send_json(404, {"errors": [{"title": "no such folder"}]})
+        offset = int(query.get("page[offset]", ["0"])[0])
+        limit = int(query.get("page[limit]", ["50"])[0])
+        kids = self.server.children.get(container, [])[offset:offset + limit]
+        self._send_json(200, {"data": [self.server.item(kid) for kid in kids]})
+
+    def _metadata(self, match, query, body) -> None:
+        item_id = match.group(1)
+        if item_id == self.server.root:
+            return self._send_json(200, {"data": {"id": item_id, "attributes": {"name": "Bench"}}})
+        if item_id not in self.server.folders and item_id not in self.server.files:
+            return self._send_json(404, {"errors": [{"title": "no such file"}]})
+        self._send_json(200, {"data": self.server.item(item_id)})
+
+    def _download(self, match, query, body) -> None:
+        document = self.server.files.get(match.group(1) or match.group(2))
+        if document is None:
+            return self._send_json(404, {"errors": [{"title": "no such file"}]})
+        path = self.server.blobs / document["blob"]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(path.stat().st_size))
+        self.end_headers()
+        with open(path, "rb") as handle:
+            while chunk := handle.read(256 * 1024):
+                self.wfile.write(chunk)
+
+    def _create_template(self, match, query, body) -> None:
+        self._send_json(200, {"data": {"id": "bench-template", "attributes": {"name": body.get("name")}}})
+
+    def _attach(self, match, query, body) -> None:
+        file_id, template_id = match.group(1), body.get("template_id")
+        if file_id not in self.server.files:
+            return self._send_json(404, {"errors": [{"title": "no such file"}]})
+        with self.server.lock:
+            templates = self.server.attached.setdefault(file_id, set())
+            already = template_id in templates
+            templates.add(template_id)
+        if already:
+            return self._send_json(409, {"errors": [{"title": "template already attached"}]})
+        self._send_json(200, {"data": {"id": file_id, "template_id": template_id}})
+
+    def _set_values(self, file_id: str, template_id: str, fields: List[Dict]) -> str | None:
+        # Returns an error message, or None once the values are stored.
+        if file_id not in self.server.files:
+            return "no such file"
+        with self.server.lock:
+            if template_id not in self.server.attached.get(file_id, ()):
+                return "template not attached"
+            self.server.template_values[file_id] = {field["label"]: field["value"] for field in fields}
+        return None
+
+    def _update_values(self, match, query, body) -> None:
+        file_id, template_id = match.groups()
+        error = self._set_values(file_id, template_id, body.get("fields", []))
+        if error:
+            return self._send_json(404 if error == "no such file" else 400, {"errors": [{"title": error}]})
+        self._send_json(200, {"data": {"id": file_id, "template_id": template_id}})
+
+    def _bulk_update(self, match, query, body) -> None:
+        template_id = match.group(1)
+        results = []
+        for item in body.get("data", []):
+            error = self._set_values(item.get("id"), template_id, item.get("fields", []))
+            results.append({"id": item.get("id"), "status": "error" if error else "ok", "message": error})
+        self._send_json(200, {"data": results})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve a generated corpus as a local WorkDrive API.")
+    parser.add_argument("--corpus", required=True, help="Directory written by bench.corpus")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every API response")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--no-bulk", action="store_true", help="Answer the bulk values endpoint with 404")
+    args = parser.parse_args()
+    server = MockWorkDrive(args.corpus, args.port, args.latency, args.jitter, args.throttle_rate, args.retry_after,
+                           bulk=not args.no_bulk)
+    # The first line tells a parent process where to connect.
+    print(server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
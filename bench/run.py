@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import requests
+
+from bench.corpus import generate_corpus, load_manifest
+from src.metrics import quantile, reset, snapshot
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+# Stage -> the timer whose latency is reported for it.
+STAGE_OPS = {"crawl": "api.get", "extract": "api.download", "heuristic": "classify.heuristic", "sync": "api.patch"}
+
+
+def _peak_rss_mb(who: int) -> float:
+    # ru_maxrss is in KiB on Linux and bytes on macOS. For RUSAGE_CHILDREN it
+    # is the largest single child (the parser processes) reaped so far.
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _start_server(corpus_dir: str, args) -> Tuple[subprocess.Popen, str]:
+    # Its own process, so serving the corpus does not compete with the code
+    # under test for the GIL.
+    process = subprocess.Popen(
+        [sys.executable, "-m", "bench.mock_server", "--corpus", corpus_dir,
+         "--latency", str(args.latency), "--jitter", str(args.jitter),
+         "--throttle-rate", str(args.throttle_rate), "--retry-after", str(args.retry_after),
+         *(["--no-bulk"] if args.no_bulk else [])],
+        cwd=REPO_ROOT, stdout=subprocess.PIPE, text=True,
+    )
+    url = process.stdout.readline().strip()
+    if not url:
+        process.kill()
+        raise RuntimeError("mock WorkDrive server did not start")
+    return process, url
+
+
+def _configure(workdir: Path, url: str, root: str, rate_limit: float, bulk_size: int) -> None:
+    # Module settings are read from the environment at import time, so this
+    # runs before the pipeline modules are imported. Everything the pipeline
+    # writes (database, token, template id, spool files, blob cache) stays in
+    # workdir.
+    token = workdir / "token.json"
+    token.write_text(json.dumps({"access_token": "bench", "expires_at": time.time() + 86400}))
+    (workdir / "spool").mkdir(exist_ok=True)
+    os.environ.update({
+        "WORKDRIVE_API_BASE": url,
+        "WORKDRIVE_APP_BASE": url[: -len("/api/v1")],
+        "TEAMFOLDER_ID": root,
+        "WORKDRIVE_ROOT_FOLDER_ID": "",
+        "WORKDRIVE_RATE_LIMIT": str(rate_limit),
+        "DB_PATH": str(workdir / "bench.db"),
+        "TOKEN_CACHE": str(token),
+        "WORKDRIVE_TEMPLATE_META": str(workdir / "template.json"),
+        "EXTRACT_SPOOL_DIR": str(workdir / "spool"),
+        "EXTRACT_BLOB_CACHE_DIR": str(workdir / "blobs"),
+        "ENABLE_LLM": "false",
+        # 0 = one PATCH per file.
+        "WORKDRIVE_BULK_UPDATE_PATH": "/data/templates/{template_id}/values" if bulk_size else "",
+        "WORKDRIVE_BULK_UPDATE_SIZE": str(bulk_size),
+    })
+
+
+def _stages(args, files: int, results: Dict) -> List[Tuple[str, Callable[[], int]]]:
+    from src.classify.heuristic import run_heuristics
+    from src.db import apply_label_corrections, init_db, iter_for_csv
+    from src.extraction.extract import run_extraction
+    from src.sync.sync_templates import plan_sync, push_to_workdrive
+    from src.workdrive.inventory import crawl_incremental
+
+    init_db()
+
+    def crawl() -> int:
+        crawl_incremental(args.crawl_workers, full=True)
+        return files
+
+    def sync() -> int:
+        return push_to_workdrive(args.sync_workers)["pushed"]
+
+    def approve() -> None:
+        # Sync only pushes reviewed labels; this untimed step approves them
+        # all and records the requests sync expects to make (its dry run).
+        file_ids = [row[0] for row in iter_for_csv(["file_id"])]
+        apply_label_corrections(({"file_id": file_id} for file_id in file_ids), actor="reviewer:bench")
+        results["sync_plan"] = plan_sync()
+
+    return [
+        ("crawl", crawl),
+        ("extract", lambda: run_extraction(args.extract_workers, args.download_concurrency)),
+        ("heuristic", run_heuristics),
+        ("approve", approve),
+        ("sync", sync),
+    ]
+
+
+def _timer_summary(timer: Dict) -> Dict:
+    return {
+        "count": timer["count"], "errors": timer["errors"], "bytes": timer["bytes"],
+        "p50_ms": round(quantile(timer, 0.5) * 1000, 2), "p99_ms": round(quantile(timer, 0.99) * 1000, 2),
+    }
+
+
+def run_benchmark(args) -> Dict:
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="workdrive-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    corpus_dir = Path(args.corpus or workdir / "corpus")
+    if not (corpus_dir / "manifest.json").exists():
+        print(f"Generating {args.files} files in {corpus_dir} ...", file=sys.stderr)
+        generate_corpus(str(corpus_dir), args.files, args.depth, args.fanout, args.duplicates, args.seed)
+    manifest = load_manifest(str(corpus_dir))
+    server, url = _start_server(str(corpus_dir), args)
+    try:
+        _configure(workdir, url, manifest["root"], args.rate_limit, args.sync_bulk_size)
+        results = {
+            "corpus": {"files": len(manifest["files"]), "folders": len(manifest["folders"]),
+                       "bytes": sum(document["size"] for document in manifest["files"].values())},
+            "server": {"latency": args.latency, "jitter": args.jitter, "throttle_rate": args.throttle_rate,
+                       "bulk": not args.no_bulk, "sync_bulk_size": args.sync_bulk_size},
+            "stages": {},
+        }
+        for name, stage in _stages(args, len(manifest["files"]), results):
+            reset()
+            started = time.perf_counter()
+            items = stage()
+            seconds = time.perf_counter() - started
+            if name not in STAGE_OPS:
+                continue
+            timers = snapshot()["timers"]
+            op = timers.get(STAGE_OPS[name], {"count": 0, "errors": 0, "bytes": 0, "buckets": []})
+            results["stages"][name] = {
+                "items": items,
+                "seconds": round(seconds, 3),
+                "throughput": round(items / seconds, 1) if seconds > 0 else 0.0,
+                "op": STAGE_OPS[name],
+                **_timer_summary(op),
+                "rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+                "children_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+                "timers": {timer_name: _timer_summary(timer) for timer_name, timer in timers.items()},
+            }
+        results["server_stats"] = requests.get(url[: -len("/api/v1")] + "/_bench/stats", timeout=10).json()
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    # Lower throughput or higher p99/peak RSS than the baseline by more than
+    # `tolerance` (a fraction) is a regression.
+    regressions = []
+    for name, stage in results["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if not base:
+            continue
+        if base["throughput"] and stage["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {stage['throughput']}/s vs {base['throughput']}/s")
+        if base["p99_ms"] and stage["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {stage['p99_ms']} ms vs {base['p99_ms']} ms")
+        if base["rss_mb"] and stage["rss_mb"] > base["rss_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {stage['rss_mb']} MB vs {base['rss_mb']} MB")
+    return regressions
+
+
+def _report(results: Dict) -> None:
+    corpus = results["corpus"]
+    print(f"Corpus: {corpus['files']} files in {corpus['folders']} folders, {corpus['bytes'] / 1e6:.1f} MB; "
+          f"server: {results['server']}; {results['server_stats']}")
+    print(f"{'stage':<10}{'items':>8}{'seconds':>10}{'items/s':>10}  {'op':<20}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'errors':>8}{'RSS MB':>9}{'child MB':>10}")
+    for name, stage in results["stages"].items():
+        print(f"{name:<10}{stage['items']:>8}{stage['seconds']:>10}{stage['throughput']:>10}  {stage['op']:<20}"
+              f"{stage['p50_ms']:>9}{stage['p99_ms']:>9}{stage['errors']:>8}{stage['rss_mb']:>9}"
+              f"{stage['children_rss_mb']:>10}")
+    if "sync_plan" in results:
+        print(f"Sync dry run: {results['sync_plan']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark crawl, extract, heuristics and sync offline.")
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=4)
+    parser.add_argument("--duplicates", type=float, default=0.1, help="Share of files duplicating another")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--corpus", help="Reuse (or create) the corpus in this directory")
+    parser.add_argument("--workdir", help="Keep database and spool files here instead of a temp dir")
+    parser.add_argument("--keep", action="store_true", help="Do not delete the temp workdir")
+    parser.add_argument("--latency", type=float, default=0.01, help="Seconds the server adds to each response")
+    parser.add_argument("--jitter", type=float, default=0.005)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    parser.add_argument("--rate-limit", type=float, default=0, help="Client requests/second (0 = unlimited)")
+    parser.add_argument("--crawl-workers", type=int)
+    parser.add_argument("--extract-workers", type=int)
+    parser.add_argument("--download-concurrency", type=int)
+    parser.add_argument("--sync-workers", type=int)
+    parser.add_argument("--sync-bulk-size", type=int, default=50, help="Files per bulk values PATCH (0 = per file)")
+    parser.add_argument("--no-bulk", action="store_true", help="Server has no bulk endpoint (tests the fallback)")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Fail when worse than the results in this file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    _report(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
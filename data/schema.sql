@@ -11,10 +11,87 @@ CREATE TABLE IF NOT EXISTS documents (
   permalink TEXT,
   download_url TEXT,
   sha256 TEXT,
-  excerpt TEXT,
-  last_seen TEXT DEFAULT (datetime('now'))
+  excerpt_chars INTEGER, -- length of the excerpt; NULL until extracted, 0 when empty
+  excerpt_version TEXT,  -- extractor fingerprint the excerpt was made with
+  excerpt_strategy TEXT, -- what produced it, e.g. pdfium, pdfminer+sampled, docx, skipped
+  parent_id TEXT,
+  last_seen TEXT DEFAULT (datetime('now')),
+  deleted_at TEXT     -- set when a completed crawl no longer sees the file
+);
+
+CREATE INDEX IF NOT EXISTS idx_documents_fingerprint ON documents(name, size, modified_time);
+CREATE INDEX IF NOT EXISTS idx_documents_parent ON documents(parent_id);
+-- Keyset pagination and path-prefix filters in the review app.
+CREATE INDEX IF NOT EXISTS idx_documents_path ON documents(path, file_id);
+
+-- Work selection: live files with no (or an empty) excerpt yet.
+CREATE INDEX IF NOT EXISTS idx_documents_pending_extract ON documents(file_id, name, suffix, sha256, size)
+WHERE deleted_at IS NULL AND COALESCE(excerpt_chars, 0)=0;
+
+-- Excerpts live apart from documents so scans over documents only read
+-- narrow rows; the text is fetched by primary key when it is needed.
+CREATE TABLE IF NOT EXISTS excerpts (
+  file_id TEXT PRIMARY KEY,
+  excerpt TEXT
+);
+
+-- What the search index covers: name and path from documents, the excerpt
+-- from excerpts.
+CREATE VIEW IF NOT EXISTS documents_search AS
+SELECT d.rowid AS doc_rowid, d.name AS name, d.path AS path, e.excerpt AS excerpt
+FROM documents d LEFT JOIN excerpts e ON e.file_id=d.file_id;
+
+-- Full-text index over documents (external content, so text is stored once).
+-- Triggers keep it in step with documents and excerpts; rebuild_search_index
+-- refills it.
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+  name, path, excerpt,
+  content='documents_search', content_rowid='doc_rowid',
+  tokenize='unicode61 remove_diacritics 2'
 );
 
+CREATE TRIGGER IF NOT EXISTS documents_fts_insert AFTER INSERT ON documents BEGIN
+  INSERT INTO documents_fts(rowid, name, path, excerpt)
+  VALUES (new.rowid, new.name, new.path, (SELECT excerpt FROM excerpts WHERE file_id=new.file_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS documents_fts_delete AFTER DELETE ON documents BEGIN
+  INSERT INTO documents_fts(documents_fts, rowid, name, path, excerpt)
+  VALUES ('delete', old.rowid, old.name, old.path, (SELECT excerpt FROM excerpts WHERE file_id=old.file_id));
+  DELETE FROM excerpts WHERE file_id=old.file_id;
+END;
+
+-- Crawls rewrite every row; only reindex when the indexed text changed. A
+-- changed modified_time/size also drops the excerpt (the upsert resets
+-- excerpt_chars), all in this one trigger so the index sees each step.
+CREATE TRIGGER IF NOT EXISTS documents_fts_update AFTER UPDATE OF name, path, modified_time, size ON documents
+WHEN old.name IS NOT new.name OR old.path IS NOT new.path
+  OR old.modified_time IS NOT new.modified_time OR old.size IS NOT new.size BEGIN
+  INSERT INTO documents_fts(documents_fts, rowid, name, path, excerpt)
+  VALUES ('delete', old.rowid, old.name, old.path, (SELECT excerpt FROM excerpts WHERE file_id=old.file_id));
+  DELETE FROM excerpts
+  WHERE file_id=new.file_id AND (old.modified_time IS NOT new.modified_time OR old.size IS NOT new.size);
+  INSERT INTO documents_fts(rowid, name, path, excerpt)
+  VALUES (new.rowid, new.name, new.path, (SELECT excerpt FROM excerpts WHERE file_id=new.file_id));
+END;
+
+-- Excerpt rows are only removed by the documents triggers above, which
+-- handle the index themselves.
+CREATE TRIGGER IF NOT EXISTS excerpts_fts_insert AFTER INSERT ON excerpts BEGIN
+  INSERT INTO documents_fts(documents_fts, rowid, name, path, excerpt)
+  SELECT 'delete', d.rowid, d.name, d.path, NULL FROM documents d WHERE d.file_id=new.file_id;
+  INSERT INTO documents_fts(rowid, name, path, excerpt)
+  SELECT d.rowid, d.name, d.path, new.excerpt FROM documents d WHERE d.file_id=new.file_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS excerpts_fts_update AFTER UPDATE OF excerpt ON excerpts
+WHEN old.excerpt IS NOT new.excerpt BEGIN
+  INSERT INTO documents_fts(documents_fts, rowid, name, path, excerpt)
+  SELECT 'delete', d.rowid, d.name, d.path, old.excerpt FROM documents d WHERE d.file_id=new.file_id;
+  INSERT INTO documents_fts(rowid, name, path, excerpt)
+  SELECT d.rowid, d.name, d.path, new.excerpt FROM documents d WHERE d.file_id=new.file_id;
+END;
+
 CREATE TABLE IF NOT EXISTS labels (
   file_id TEXT PRIMARY KEY,
   doc_type TEXT,
@@ -28,9 +105,27 @@ CREATE TABLE IF NOT EXISTS labels (
   source TEXT,        -- heuristic | llm | human
   confidence REAL,    -- 0..1
   needs_review INTEGER DEFAULT 1,
+  rules_version TEXT, -- rule_sets.version of the rules/settings a machine label came from
   FOREIGN KEY(file_id) REFERENCES documents(file_id)
 );
 
+-- Sync (needs_review=0) and the review app's queue/source/confidence filters.
+CREATE INDEX IF NOT EXISTS idx_labels_review ON labels(needs_review, source, confidence);
+-- The LLM pass (source='heuristic', low confidence) and label_sources.
+CREATE INDEX IF NOT EXISTS idx_labels_source ON labels(source, confidence);
+-- classify --stale pages through one source in file_id order.
+CREATE INDEX IF NOT EXISTS idx_labels_stale ON labels(source, file_id, rules_version);
+
+-- Fingerprints of the heuristic rules and LLM settings labels were made
+-- with, and a hash per field, so a rules edit only rescores the fields it
+-- touched.
+CREATE TABLE IF NOT EXISTS rule_sets (
+  version TEXT PRIMARY KEY,
+  stage TEXT,         -- heuristic | llm
+  fields TEXT,        -- JSON: field -> hash of its rules
+  created_at TEXT DEFAULT (datetime('now'))
+);
+
 CREATE TABLE IF NOT EXISTS audit (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   file_id TEXT,
@@ -46,3 +141,76 @@ CREATE TABLE IF NOT EXISTS templates (
   name TEXT,
   attached_count INTEGER DEFAULT 0
 );
+
+CREATE TABLE IF NOT EXISTS folders (
+  folder_id TEXT PRIMARY KEY,
+  parent_id TEXT,
+  path TEXT,
+  modified_at TEXT,
+  child_count INTEGER,
+  last_listed TEXT,   -- NULL until the folder's first page has been listed
+  last_seen TEXT DEFAULT (datetime('now'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_folders_parent ON folders(parent_id);
+
+-- Pending folder pages of an unfinished crawl; resumed on the next run.
+CREATE TABLE IF NOT EXISTS crawl_frontier (
+  container_id TEXT,
+  container_kind TEXT,
+  prefix TEXT,
+  page_offset INTEGER,
+  page_limit INTEGER,
+  stride INTEGER,
+  PRIMARY KEY (container_id, page_offset)
+);
+
+CREATE TABLE IF NOT EXISTS crawl_state (
+  key TEXT PRIMARY KEY,
+  value TEXT
+);
+
+-- Per-content results shared by every copy of a file (keyed by sha256).
+CREATE TABLE IF NOT EXISTS content_cache (
+  sha256 TEXT PRIMARY KEY,
+  excerpt TEXT,
+  excerpt_strategy TEXT,
+  parser_version TEXT,
+  heuristic_key TEXT,       -- hash of the rules + file name the labels came from
+  heuristic_labels TEXT,    -- JSON
+  heuristic_confidence REAL,
+  llm_key TEXT,             -- hash of model + prompt
+  llm_labels TEXT,          -- JSON
+  llm_confidence REAL,
+  updated_at TEXT DEFAULT (datetime('now'))
+);
+
+-- Last payload successfully pushed to each file's data template; sync only
+-- pushes rows whose payload hash changed. Failures are kept for the next run.
+CREATE TABLE IF NOT EXISTS sync_state (
+  file_id TEXT PRIMARY KEY,
+  template_id TEXT,
+  payload_hash TEXT,
+  pushed_at TEXT,
+  last_error TEXT,
+  failures INTEGER DEFAULT 0,
+  failed_at TEXT
+);
+
+-- Hash of each row as of the last Parquet snapshot; incremental snapshots
+-- only write rows whose hash changed.
+CREATE TABLE IF NOT EXISTS export_state (
+  file_id TEXT PRIMARY KEY,
+  row_hash TEXT,
+  snapshot TEXT
+);
+
+-- One row per CLI command, with the metrics it collected (JSON).
+CREATE TABLE IF NOT EXISTS runs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  command TEXT,
+  started_at TEXT,
+  seconds REAL,
+  status TEXT,        -- ok | error | interrupted
+  metrics TEXT
+);
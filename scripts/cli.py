@@ -1,6 +1,12 @@
+import cProfile
+import sys
+import time
+from datetime import datetime, timezone
+
 import typer
 from rich import print
 
+from src.workdrive.api import rate_limit_stats
 from src.workdrive.auth import token_status
 from src.workdrive.inventory import crawl_incremental
 from src.extraction.extract import run_extraction
@@ -8,53 +14,225 @@ from src.classify.heuristic import run_heuristics
 from src.classify.llm import run_llm_pass
 from src.sync.sync_templates import push_to_workdrive
 from src.utils import write_csv, read_settings
+from src.db import get_run, record_run
+from src.metrics import snapshot, to_prometheus
 
 app = typer.Typer(add_completion=False)
+db_app = typer.Typer(help="Inspect the local database")
+app.add_typer(db_app, name="db")
+
+
+def _print_api_stats():
+    stats = rate_limit_stats()
+    print(f"[dim]WorkDrive API: {stats['requests']} requests, {stats['throttled']} throttled (429), "
+          f"{stats['wait_seconds'] + stats['paused_seconds']:.1f}s waiting on the rate limiter, "
+          f"final rate {stats['rate']} req/s[/dim]")
+
+def _print_llm_stats(stats):
+    print(f"[dim]LLM: {stats['documents']} documents, {stats['cache_hits']} from cache, "
+          f"{stats['api_calls']} API calls, {stats['prompt_tokens'] + stats['completion_tokens']} tokens "
+          f"({stats['tokens_per_second']} tok/s), est. cost ${stats['cost']:.4f}[/dim]")
+
+@app.callback()
+def main(ctx: typer.Context,
+         profile: str = typer.Option(None, "--profile", help="Run the command under cProfile and write the stats to this file")):
+    # Every command except auth/metrics/db is recorded in the runs table with
+    # the metrics it collected.
+    if ctx.invoked_subcommand in ("auth", "metrics", "db"):
+        return
+    started_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    clock = time.monotonic()
+    profiler = cProfile.Profile() if profile else None
+    if profiler:
+        # Profiles the command's main thread; pipelined stages run on their
+        # own threads, so profile those through their single-stage commands.
+        profiler.enable()
+
+    def finish():
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile)
+            print(f"[dim]Profile written to {profile} (python -m pstats {profile}).[/dim]")
+        error = sys.exc_info()[1]
+        status = "ok" if error is None else "interrupted" if isinstance(error, KeyboardInterrupt) else "error"
+        metrics = snapshot()
+        metrics["rate_limiter"] = rate_limit_stats()
+        record_run(ctx.invoked_subcommand, started_at, round(time.monotonic() - clock, 3), status, metrics)
+
+    ctx.call_on_close(finish)
 
 @app.command("auth")
 def auth_status():
     print(token_status())
 
 @app.command("crawl")
-def crawl_run():
-    crawl_incremental()
+def crawl_run(workers: int = typer.Option(None, help="Concurrent folder listings (default WORKDRIVE_CRAWL_WORKERS)"),
+              full: bool = typer.Option(False, "--full", help="Relist every folder and drop any saved checkpoint")):
+    tombstoned = crawl_incremental(workers=workers, full=full)
+    print(f"Crawl complete; {tombstoned} deleted file(s) tombstoned.")
+    _print_api_stats()
 
 @app.command("extract")
-def extract_run():
-    run_extraction()
+def extract_run(workers: int = typer.Option(None, help="Parser processes (default EXTRACT_WORKERS or CPU count)"),
+                download_concurrency: int = typer.Option(None, help="Concurrent downloads (default EXTRACT_DOWNLOAD_CONCURRENCY)"),
+                reextract: bool = typer.Option(False, "--reextract", help="Redo excerpts made by an older parser or other settings, from cached blobs where possible")):
+    count = run_extraction(workers=workers, download_concurrency=download_concurrency, reextract=reextract)
+    if reextract:
+        print(f"Re-extracted {count} stale file(s).")
+    _print_api_stats()
+
+def _print_relabel_stats(stats, top: int):
+    print(f"Reclassified {stats['checked']} stale label(s) to {stats['version']}: {stats['changed']} changed "
+          f"({stats['changes']} field change(s), sent back to review), {stats['unchanged']} unchanged, "
+          f"{stats['skipped']} skipped (now human-labeled).")
+    for (field, old, new), count in stats["transitions"].most_common(top):
+        print(f"  {count:>6}  {field}: {old or '-'} -> {new or '-'}")
+    if len(stats["transitions"]) > top:
+        print(f"[dim]  ... {len(stats['transitions']) - top} more; every change is in the audit table "
+              f"(actor pipeline:stale).[/dim]")
 
 @app.command("classify")
-def classify(stage: str = typer.Argument(..., help="heuristic|llm")):
+def classify(stage: str = typer.Argument(..., help="heuristic|llm"),
+             stale: bool = typer.Option(False, "--stale", help="Reclassify machine labels made with older rules/settings (never human ones)"),
+             top: int = typer.Option(20, help="Label changes to list with --stale")):
     if stage == "heuristic":
-        run_heuristics()
+        if stale:
+            from src.classify.heuristic import run_stale_heuristics
+            _print_relabel_stats(run_stale_heuristics(), top)
+        else:
+            run_heuristics()
     elif stage == "llm":
-        run_llm_pass()
+        if stale:
+            from src.classify.llm import run_stale_llm
+            relabels, llm_stats = run_stale_llm()
+            _print_relabel_stats(relabels, top)
+            _print_llm_stats(llm_stats)
+        else:
+            _print_llm_stats(run_llm_pass())
     else:
         raise typer.BadParameter("Use 'heuristic' or 'llm'.")
 
 @app.command("review")
 def review(action: str = typer.Argument(..., help="export|import"),
-           path: str = typer.Argument("data/inventory_labeled.csv")):
+           path: str = typer.Argument("data/inventory_labeled.csv", help="CSV path; a .gz suffix means gzip"),
+           columns: str = typer.Option(None, help="Comma-separated columns to export (default all)"),
+           no_excerpt: bool = typer.Option(False, "--no-excerpt", help="Leave the excerpt column out of the export")):
     if action == "export":
-        write_csv(path)
+        from src.db import CSV_COLUMNS
+        selected = [column.strip() for column in columns.split(",")] if columns else list(CSV_COLUMNS)
+        if no_excerpt:
+            selected = [column for column in selected if column != "excerpt"]
+        print(f"Exported {write_csv(path, selected)} row(s) to {path}.")
     elif action == "import":
         from src.utils import import_corrected_csv
-        import_corrected_csv(path)
+        stats = import_corrected_csv(path)
+        print(f"Imported {stats['rows']} row(s): {stats['updated']} updated ({stats['changes']} field change(s)), "
+              f"{stats['unchanged']} unchanged, {stats['missing']} unknown file(s), {stats['rejected']} rejected.")
+        for error in stats["errors"][:20]:
+            print(f"[yellow]{error}[/yellow]")
     else:
         raise typer.BadParameter("Use 'export' or 'import'.")
 
+@app.command("export")
+def export(format: str = typer.Option("parquet", "--format", help="parquet|csv"),
+           out: str = typer.Option(None, help="Output directory (parquet) or file (csv)"),
+           partition_by: str = typer.Option("doc_type", help="Parquet partition column: doc_type|top_folder|none"),
+           incremental: bool = typer.Option(False, "--incremental", help="Only rows changed since the last Parquet snapshot")):
+    if format == "parquet":
+        from src.export.parquet import export_parquet
+        stats = export_parquet(out or "data/snapshots", None if partition_by == "none" else partition_by,
+                               incremental=incremental)
+        print(f"Wrote {stats['written']} of {stats['rows']} row(s) to {stats['path']}.")
+    elif format == "csv":
+        path = out or "data/inventory_labeled.csv"
+        print(f"Exported {write_csv(path)} row(s) to {path}.")
+    else:
+        raise typer.BadParameter("Use 'parquet' or 'csv'.")
+
+@app.command("search")
+def search(query: str = typer.Argument("", help="Words to find; end a word with * to match prefixes"),
+           limit: int = typer.Option(20, help="Maximum results"),
+           rebuild: bool = typer.Option(False, "--rebuild", help="Reindex every document (in batches) before searching")):
+    from src.db import rebuild_search_index, search_documents
+    if rebuild:
+        print(f"Indexed {rebuild_search_index()} document(s).")
+    if not query:
+        return
+    for row in search_documents(query, limit=limit):
+        print(f"[bold]{row['path'] or row['name']}[/bold] [dim]({row['doc_type'] or '-'}, {row['file_id']})[/dim]")
+        if row["snippet"]:
+            print(f"  {row['snippet']}")
+
 @app.command("sync")
-def sync_templates():
-    push_to_workdrive()
+def sync_templates(workers: int = typer.Option(None, help="Requests in flight (default WORKDRIVE_SYNC_WORKERS)"),
+                   dry_run: bool = typer.Option(False, "--dry-run", help="Report the requests a sync would make, send none")):
+    if dry_run:
+        from src.sync.sync_templates import plan_sync
+        plan = plan_sync()
+        print(f"Dry run: {plan['changed']} of {plan['checked']} row(s) to push ({plan['unchanged']} unchanged), "
+              f"{plan['calls']} request(s): {plan['create_template_calls']} template create, "
+              f"{plan['attach_calls']} attach, {plan['update_calls']} update.")
+        return
+    stats = push_to_workdrive(workers=workers)
+    print(f"Sync complete; {stats['pushed']} pushed ({stats['attached']} newly attached), {stats['unchanged']} unchanged, "
+          f"{stats['failed']} failed (failed rows are retried on the next sync).")
+    _print_api_stats()
 
 @app.command("run")
-def run_all(stage: str = typer.Argument("all")):
-    crawl_incremental()
-    run_extraction()
-    run_heuristics()
-    run_llm_pass()
-    write_csv("data/inventory_labeled.csv")
-    print("[green]Pipeline complete.[/green]")
+def run_all(stage: str = typer.Argument("all", help="all, classify, or a comma-separated subset of crawl,extract,heuristic,llm,export"),
+            crawl_workers: int = typer.Option(None, help="Concurrent folder listings (default WORKDRIVE_CRAWL_WORKERS)"),
+            full: bool = typer.Option(False, "--full", help="Relist every folder and drop any saved checkpoint"),
+            extract_workers: int = typer.Option(None, help="Parser processes (default EXTRACT_WORKERS or CPU count)"),
+            download_concurrency: int = typer.Option(None, help="Concurrent downloads (default EXTRACT_DOWNLOAD_CONCURRENCY)")):
+    from src.pipeline import parse_stages, run_pipeline
+    try:
+        stages = parse_stages(stage)
+    except ValueError as exc:
+        raise typer.BadParameter(str(exc))
+    results = run_pipeline(stages, crawl_workers=crawl_workers, full=full,
+                           extract_workers=extract_workers, download_concurrency=download_concurrency)
+    for name in stages:
+        if name in results:
+            print(f"[dim]{name}: {results[name]}[/dim]")
+    _print_api_stats()
+    if results["interrupted"]:
+        print("[yellow]Pipeline interrupted; run it again to resume.[/yellow]")
+    else:
+        print("[green]Pipeline complete.[/green]")
+
+@app.command("metrics")
+def metrics_show(run_id: int = typer.Option(None, "--run", help="Run id (default: the latest run)"),
+                 format: str = typer.Option("json", "--format", help="json|prometheus")):
+    import json
+    run = get_run(run_id)
+    if run is None:
+        raise typer.BadParameter("No such run; runs are recorded as commands finish.")
+    if format == "json":
+        typer.echo(json.dumps(run, indent=2))
+    elif format == "prometheus":
+        typer.echo(to_prometheus(run["metrics"]), nl=False)
+    else:
+        raise typer.BadParameter("Use 'json' or 'prometheus'.")
+
+@db_app.command("migrate")
+def db_migrate():
+    from src.db import init_db, schema_versions
+    applied = init_db()
+    print(f"Applied migration(s) {', '.join(map(str, applied))}." if applied else "Schema is up to date.")
+    for version, name, applied_at in schema_versions():
+        print(f"[dim]{version:>4}  {name:<20}{applied_at}[/dim]")
+
+@db_app.command("explain")
+def db_explain(name: str = typer.Argument(None, help="Only queries whose name starts with this, e.g. extract")):
+    from src.db import explain_queries
+    for query, plan in explain_queries().items():
+        if name and not query.startswith(name):
+            continue
+        print(f"[bold]{query}[/bold]")
+        depth = {0: 0}
+        for step, parent, detail in plan:
+            depth[step] = depth.get(parent, 0) + 1
+            print(f"{'  ' * depth[step]}{detail}")
 
 if __name__ == "__main__":
     app()
@@ -1,30 +1,27 @@
 import math
+import tempfile
+from pathlib import Path
 
-import pandas as pd
 import streamlit as st
 
-from src.db import all_for_csv, update_from_csv_row
+from src.db import CSV_COLUMNS, get_excerpt, label_sources, review_page, search_documents, update_from_csv_row
+from src.utils import load_settings, write_csv
+
+PAGE_SIZE = 50
 
 st.set_page_config(page_title="WorkDrive Classification Review", layout="wide")
 st.title("Document Classification Review")
 
-rows = all_for_csv()
-dataframe = pd.DataFrame(rows).fillna("")
 
-if dataframe.empty:
-    st.info("No data yet. Run crawl/extract/classify first.")
-    st.stop()
+@st.cache_data
+def _options() -> dict[str, list[str]]:
+    candidates = load_settings()["classification"]["candidate_values"]
+    return {field: [""] + [value for value in values if value] for field, values in candidates.items()}
 
-st.caption("Filter and correct labels. Click 'Save Row' to persist; 'Export CSV' for bulk ops.")
 
-doc_type_options = ["", "SOP", "PCN", "Release Note", "Troubleshooting Guide", "Manual", "Specification", "Checklist"]
-model_options = ["", "S50", "V40", "Scrubber75", "S1", "Workstation", "S50 & V40", "(Beetle) SW", "Genric"]
-subsystem_options = ["", "Laser", "Software", "Battery", "Drive", "Pump", "UI", "Network", "Other"]
-language_options = ["", "English", "Chinese", "Spanish", "Other"]
-hardware_options = ["", "4.2", "4.1", "3.7", "3.6", "1.6", "1.5", "1.4.5", "1.4", "1.3", "1.2", "1.1", "1.0", "2.2.3"]
-software_options = ["", "AIO1", "AIO2", "AIO3", "AIO4", "AIO5", "M Series"]
-priority_options = ["", "high", "normal", "low"]
-audience_options = ["", "intro", "operator", "technician", "engineer", "admin"]
+@st.cache_data(ttl=60)
+def _sources() -> list[str]:
+    return label_sources()
 
 
 def _normalize(value):
@@ -44,12 +41,66 @@ def _safe_index(options: list[str], value) -> int:
     return 0
 
 
-for index, row in dataframe.iterrows():
-    with st.expander(row["path"], expanded=False):
+def _export_csv() -> bytes:
+    # Streamed to a temp file by write_csv, without the excerpt column; only
+    # the finished CSV is held in memory for the download.
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "inventory_labeled.csv"
+        write_csv(str(path), [column for column in CSV_COLUMNS if column != "excerpt"])
+        return path.read_bytes()
+
+
+options = _options()
+
+with st.sidebar:
+    search_text = st.text_input("Search content", help="Words are ANDed; end a word with * to match prefixes")
+    st.header("Filters")
+    review_choice = st.radio("Needs review", ["Any", "Yes", "No"], horizontal=True)
+    source = st.selectbox("Source", ["", *_sources()])
+    doc_type_filter = st.selectbox("Document Type", ["Any", *options["doc_type"]],
+                                   format_func=lambda value: value or "(empty)")
+    min_confidence, max_confidence = st.slider("Confidence", 0.0, 1.0, (0.0, 1.0), step=0.05)
+    path_prefix = st.text_input("Path prefix")
+
+filters = {
+    "needs_review": {"Any": None, "Yes": 1, "No": 0}[review_choice],
+    "source": source or None,
+    "doc_type": None if doc_type_filter == "Any" else doc_type_filter,
+    "min_confidence": min_confidence if min_confidence > 0 else None,
+    "max_confidence": max_confidence if max_confidence < 1 else None,
+    "path_prefix": path_prefix.strip() or None,
+}
+
+# Keyset pagination: the stack holds the (path, file_id) each visited page
+# started after; changing a filter starts again from the first page.
+if st.session_state.get("filters") != (filters, search_text):
+    st.session_state["filters"] = (filters, search_text)
+    st.session_state["cursors"] = [None]
+cursors = st.session_state["cursors"]
+
+if search_text.strip():
+    # Search results are ranked (BM25), so they are shown as one page.
+    rows = search_documents(search_text, filters, limit=PAGE_SIZE)
+    has_next = False
+else:
+    # One extra row tells us whether there is a next page.
+    rows = review_page(filters, after=cursors[-1], limit=PAGE_SIZE + 1)
+    has_next = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+
+if not rows and len(cursors) == 1:
+    st.info("No matching documents. Adjust the search or filters, or run crawl/extract/classify first.")
+    st.stop()
+
+st.caption(f"Page {len(cursors)}. Correct labels and click 'Save Row' to persist; 'Export CSV' for bulk ops.")
+
+for row in rows:
+    file_id = row["file_id"]
+    with st.expander(row["path"] or row["name"], expanded=False):
         column1, column2, column3, column4, column5 = st.columns([2, 1, 1, 1, 1])
         with column1:
             st.write(row["name"])
-            st.caption(row["path"])
+            st.caption(f"{row['path']} · {row['source'] or 'unlabeled'} · confidence {row['confidence'] or 0:.2f}")
             links = []
             permalink = _normalize(row.get("permalink"))
             download_url = _normalize(row.get("download_url"))
@@ -59,67 +110,71 @@ for index, row in dataframe.iterrows():
                 links.append(f"[Download]({download_url})")
             if links:
                 st.markdown(" • ".join(links))
+            if row.get("snippet"):
+                st.caption(row["snippet"])
         doc_type = column2.selectbox(
             "Document Type",
-            doc_type_options,
-            index=_safe_index(doc_type_options, row.get("doc_type")),
-            key=f"doc_type_{row['file_id']}",
+            options["doc_type"],
+            index=_safe_index(options["doc_type"], row.get("doc_type")),
+            key=f"doc_type_{file_id}",
         )
         model = column3.selectbox(
             "Model",
-            model_options,
-            index=_safe_index(model_options, row.get("model_type")),
-            key=f"model_{row['file_id']}",
+            options["model_type"],
+            index=_safe_index(options["model_type"], row.get("model_type")),
+            key=f"model_{file_id}",
         )
         subsystem = column4.selectbox(
             "Subsystem",
-            subsystem_options,
-            index=_safe_index(subsystem_options, row.get("subsystem")),
-            key=f"subsystem_{row['file_id']}",
+            options["subsystem"],
+            index=_safe_index(options["subsystem"], row.get("subsystem")),
+            key=f"subsystem_{file_id}",
         )
         language = column5.selectbox(
             "Language",
-            language_options,
-            index=_safe_index(language_options, row.get("language")),
-            key=f"language_{row['file_id']}",
+            options["language"],
+            index=_safe_index(options["language"], row.get("language")),
+            key=f"language_{file_id}",
         )
 
         col_hw, col_sw, col_priority, col_audience = st.columns(4)
         hardware_version = col_hw.selectbox(
             "Hardware Version",
-            hardware_options,
-            index=_safe_index(hardware_options, row.get("hardware_version")),
-            key=f"hardware_{row['file_id']}",
+            options["hardware_version"],
+            index=_safe_index(options["hardware_version"], row.get("hardware_version")),
+            key=f"hardware_{file_id}",
         )
         software_version = col_sw.selectbox(
             "Software Version",
-            software_options,
-            index=_safe_index(software_options, row.get("software_version")),
-            key=f"software_{row['file_id']}",
+            options["software_version"],
+            index=_safe_index(options["software_version"], row.get("software_version")),
+            key=f"software_{file_id}",
         )
         priority = col_priority.selectbox(
             "Priority",
-            priority_options,
-            index=_safe_index(priority_options, row.get("priority")),
-            key=f"priority_{row['file_id']}",
+            options["priority"],
+            index=_safe_index(options["priority"], row.get("priority")),
+            key=f"priority_{file_id}",
         )
         audience_level = col_audience.selectbox(
             "Audience Level",
-            audience_options,
-            index=_safe_index(audience_options, row.get("audience_level")),
-            key=f"audience_{row['file_id']}",
+            options["audience_level"],
+            index=_safe_index(options["audience_level"], row.get("audience_level")),
+            key=f"audience_{file_id}",
         )
 
-        st.text_area(
-            "Excerpt",
-            _normalize(row.get("excerpt")),
-            height=120,
-            key=f"excerpt_{row['file_id']}",
-        )
-        if st.button("Save Row", key=f"save_{index}"):
+        # Excerpts are fetched only for the rows a reviewer asks to see.
+        if st.toggle("Show excerpt", key=f"show_excerpt_{file_id}"):
+            st.text_area(
+                "Excerpt",
+                get_excerpt(file_id),
+                height=120,
+                key=f"excerpt_{file_id}",
+            )
+        if st.button("Save Row", key=f"save_{file_id}"):
             update_from_csv_row(
                 {
-                    "file_id": row["file_id"],
+                    "file_id": file_id,
                     "doc_type": doc_type,
                     "model_type": model,
                     "subsystem": subsystem,
@@ -132,9 +187,19 @@ for index, row in dataframe.iterrows():
             )
             st.success("Saved.")
 
-st.download_button(
-    "Export CSV",
-    data=dataframe.to_csv(index=False).encode("utf-8"),
-    file_name="inventory_labeled.csv",
-    mime="text/csv",
-)
+previous_column, next_column, _ = st.columns([1, 1, 6])
+if previous_column.button("← Previous", disabled=len(cursors) == 1):
+    cursors.pop()
+    st.rerun()
+if next_column.button("Next →", disabled=not has_next):
+    cursors.append((rows[-1]["path"], rows[-1]["file_id"]))
+    st.rerun()
+
+# The full export reads the whole inventory, so build it only on request.
+if st.button("Prepare CSV export"):
+    st.download_button(
+        "Export CSV",
+        data=_export_csv(),
+        file_name="inventory_labeled.csv",
+        mime="text/csv",
+    )
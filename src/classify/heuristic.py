@@ -1,34 +1,239 @@
+import hashlib
+import json
 import re
+from typing import Dict, Iterable, List, Pattern, Tuple
 
 import yaml
 
-from src.db import iter_documents_for_heuristics, upsert_labels
+from src.db import (DB_BATCH_SIZE, apply_relabels, cache_labels_many, get_cached_labels, get_rule_sets,
+                    iter_documents_for_heuristics, iter_stale_labels, record_rule_set, upsert_labels_many)
+from src.metrics import timed
 
 REGEX_PATH = "config/regex.yml"
+# Bump when a scoring change should make every heuristic label stale.
+HEURISTIC_VERSION = "1"
 
+FIELDS = (
+    "doc_type",
+    "model_type",
+    "subsystem",
+    "language",
+    "hardware_version",
+    "software_version",
+    "priority",
+    "audience_level",
+)
+# Fields the LLM pass looks at; the document confidence is the weakest of them.
+PRIMARY_FIELDS = ("doc_type", "model_type")
+# A hit in the file name counts as much as this many hits in the excerpt.
+NAME_WEIGHT = 3
 
-def _match_first(patterns, text):
-    for label, pattern in patterns.items():
-        if re.search(pattern, text, re.IGNORECASE):
-            return label
-    return ""
-
-
-def run_heuristics() -> None:
-    config = yaml.safe_load(open(REGEX_PATH))
-    for document in iter_documents_for_heuristics():
-        text = f"{document['name']} {document.get('excerpt', '')}"
-        doc_type = _match_first(config.get("doc_type", {}), text)
-        model_type = _match_first(config.get("model_type", {}), text)
-        labels = dict(
-            doc_type=doc_type,
-            model_type=model_type,
-            subsystem="",
-            language="",
-            hardware_version="",
-            software_version="",
-            priority="",
-            audience_level="",
-        )
-        upsert_labels(document["file_id"], labels, source="heuristic", confidence=0.6, needs_review=1)
+Matcher = Tuple[Pattern, List[str]]
 
+
+# Inside the combined alternation group numbers shift and global flags are
+# no longer at the start, so patterns must not use either.
+_NUMBERED_REFERENCE = re.compile(r"\\[1-9]|\(\?\(\d")
+_GLOBAL_FLAGS = re.compile(r"\(\?[aiLmsux]+\)")
+
+
+def _check_pattern(pattern: str, seen_groups: Dict[str, str]) -> List[str]:
+    # Reasons the pattern can't join the alternation. seen_groups maps the
+    # group names earlier labels defined to those labels.
+    problems = []
+    # Escaped backslashes can't start a reference; drop them first.
+    unescaped = pattern.replace("\\\\", "")
+    if _NUMBERED_REFERENCE.search(unescaped):
+        problems.append("numbered backreference (use (?P<name>...) and (?P=name))")
+    if _GLOBAL_FLAGS.search(unescaped):
+        problems.append("global inline flag (use a scoped (?i:...) group)")
+    for group in re.compile(pattern).groupindex:
+        if group.startswith("_h"):
+            problems.append(f"group name {group!r} is reserved")
+        elif group in seen_groups:
+            problems.append(f"group name {group!r} is also used by {seen_groups[group]}")
+    return problems
+
+
+def _compile_field(field: str, patterns: Dict[str, str]) -> Matcher | None:
+    # All labels of a field become one alternation of named groups, so a
+    # single finditer pass finds every label's hits. Earlier labels win when
+    # two patterns match at the same position, as the old first-match rule did.
+    labels = list(patterns)
+    if not labels:
+        return None
+    seen_groups: Dict[str, str] = {}
+    for label in labels:
+        try:
+            problems = _check_pattern(patterns[label], seen_groups)
+        except re.error as exc:
+            raise ValueError(f"Invalid pattern for {field}/{label}: {exc}") from exc
+        if problems:
+            raise ValueError(f"Invalid pattern for {field}/{label}: {'; '.join(problems)}")
+        seen_groups.update((group, label) for group in re.compile(patterns[label]).groupindex)
+    alternation = "|".join(f"(?P<_h{index}>{patterns[label]})" for index, label in enumerate(labels))
+    try:
+        return re.compile(alternation, re.IGNORECASE), labels
+    except re.error as exc:
+        raise ValueError(f"Invalid patterns for {field}: {exc}") from exc
+
+
+def compile_rules(config: Dict) -> Dict[str, Matcher]:
+    matchers = {}
+    for field in FIELDS:
+        matcher = _compile_field(field, config.get(field) or {})
+        if matcher:
+            matchers[field] = matcher
+    return matchers
+
+
+def _label_index(match: re.Match) -> int:
+    name = match.lastgroup
+    if name and name.startswith("_h"):
+        return int(name[2:])
+    # A user pattern ended with its own named group; find ours.
+    for name, value in match.groupdict().items():
+        if value is not None and name.startswith("_h"):
+            return int(name[2:])
+    raise ValueError("match without a label group")
+
+
+def _score_field(matcher: Matcher, text: str, name_length: int) -> Tuple[str, float]:
+    regex, labels = matcher
+    counts = [0] * len(labels)
+    in_name = [False] * len(labels)
+    for match in regex.finditer(text):
+        index = _label_index(match)
+        counts[index] += 1
+        if match.start() < name_length:
+            in_name[index] = True
+    scores = [count + (NAME_WEIGHT if named else 0) for count, named in zip(counts, in_name)]
+    total = sum(scores)
+    if not total:
+        return "", 0.0
+    best = max(range(len(labels)), key=lambda index: (scores[index], -index))
+    dominance = scores[best] / total
+    confidence = 0.4 + 0.3 * dominance + 0.1 * min(counts[best], 5) / 5
+    if in_name[best]:
+        confidence += 0.2
+    return labels[best], round(min(confidence, 0.95), 3)
+
+
+def classify_text(matchers: Dict[str, Matcher], name: str, excerpt: str) -> Tuple[Dict[str, str], float]:
+    text = f"{name} {excerpt}"
+    labels = {field: "" for field in FIELDS}
+    confidences = {field: 0.0 for field in FIELDS}
+    for field, matcher in matchers.items():
+        labels[field], confidences[field] = _score_field(matcher, text, len(name))
+    return labels, min(confidences[field] for field in PRIMARY_FIELDS)
+
+
+def rules_fingerprint(config: Dict) -> Tuple[str, Dict[str, str]]:
+    # (version, field -> hash of that field's rules). Labels carry the
+    # version they were made with; the field hashes tell which fields an
+    # edit touched. Label order matters (earlier labels win), so it is kept.
+    fields = {
+        field: hashlib.sha256(
+            json.dumps([HEURISTIC_VERSION, list((config.get(field) or {}).items())]).encode("utf-8")
+        ).hexdigest()[:16]
+        for field in FIELDS
+    }
+    digest = hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"{HEURISTIC_VERSION}-{digest[:12]}", fields
+
+
+def _load_rules() -> Tuple[Dict, str, Dict[str, str]]:
+    config = yaml.safe_load(open(REGEX_PATH)) or {}
+    version, fields = rules_fingerprint(config)
+    record_rule_set(version, "heuristic", fields)
+    return config, version, fields
+
+
+def _cache_key(rules: str, name: str) -> str:
+    return hashlib.sha256(f"{rules}\0{name}".encode("utf-8")).hexdigest()
+
+
+def _classify_cached(matchers: Dict[str, Matcher], version: str, document: Dict, misses: List) -> Tuple[Dict, float]:
+    key = _cache_key(version, document["name"])
+    cached = get_cached_labels("heuristic", document.get("sha256"), key)
+    if cached:
+        return cached
+    with timed("classify.heuristic"):
+        labels, confidence = classify_text(matchers, document["name"] or "", document.get("excerpt") or "")
+    misses.append((document.get("sha256"), key, labels, confidence))
+    if len(misses) >= DB_BATCH_SIZE:
+        cache_labels_many("heuristic", misses)
+        misses.clear()
+    return labels, confidence
+
+
+def _label_documents(config, version: str, documents: Iterable[Dict]):
+    matchers = compile_rules(config)
+    misses: List = []
+    for document in documents:
+        labels, confidence = _classify_cached(matchers, version, document, misses)
+        yield document["file_id"], labels, "heuristic", confidence, 1, version
+    cache_labels_many("heuristic", misses)
+
+
+def run_heuristics(documents: Iterable[Dict] | None = None) -> int:
+    config, version, _ = _load_rules()
+    if documents is None:
+        documents = iter_documents_for_heuristics()
+    return upsert_labels_many(_label_documents(config, version, documents))
+
+
+def _stale_fields(old: Dict[str, str] | None, new: Dict[str, str]) -> List[str]:
+    # Fields whose rules changed since a label's version; all of them when
+    # that version is unknown. The document confidence comes from the
+    # primary fields, so they are rescored together.
+    if old is None:
+        return list(FIELDS)
+    fields = [field for field in FIELDS if old.get(field) != new[field]]
+    if any(field in PRIMARY_FIELDS for field in fields):
+        fields = list(dict.fromkeys([*fields, *PRIMARY_FIELDS]))
+    return fields
+
+
+def _rescore(matchers: Dict[str, Matcher], document: Dict, fields: List[str]) -> Tuple[Dict, float]:
+    # Scores only `fields`; the other labels are what the unchanged rules
+    # gave before.
+    name = document["name"] or ""
+    text = f"{name} {document.get('excerpt') or ''}"
+    labels = dict(document["labels"])
+    confidences = {}
+    with timed("classify.heuristic"):
+        for field in fields:
+            labels[field], confidences[field] = (
+                _score_field(matchers[field], text, len(name)) if field in matchers else ("", 0.0)
+            )
+    if PRIMARY_FIELDS[0] in confidences:
+        return labels, min(confidences[field] for field in PRIMARY_FIELDS)
+    return labels, document["confidence"]
+
+
+def _relabel_stale(matchers: Dict[str, Matcher], version: str, fields: Dict[str, str], misses: List):
+    # Keyset pages are read one at a time, so each is fetched after the
+    # previous one has been written.
+    for batch in iter_stale_labels("heuristic", version):
+        previous = get_rule_sets(document["rules_version"] for document in batch)
+        for document in batch:
+            stale = _stale_fields(previous.get(document["rules_version"]), fields)
+            if len(stale) == len(FIELDS):
+                labels, confidence = _classify_cached(matchers, version, document, misses)
+            elif stale:
+                labels, confidence = _rescore(matchers, document, stale)
+            else:
+                labels, confidence = document["labels"], document["confidence"]
+            yield document["file_id"], labels, "heuristic", confidence, version
+
+
+def run_stale_heuristics() -> Dict:
+    # Reclassifies heuristic labels made with other rules than config/regex.yml
+    # now holds, rescoring only the fields whose rules changed. Human labels
+    # are never touched. Returns apply_relabels' stats.
+    config, version, fields = _load_rules()
+    misses: List = []
+    stats = apply_relabels(_relabel_stale(compile_rules(config), version, fields, misses), {"version": version})
+    cache_labels_many("heuristic", misses)
+    return stats
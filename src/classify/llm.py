@@ -1,28 +1,24 @@
+import asyncio
+import hashlib
 import json
+import logging
 import os
-from typing import Dict
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
 
-from src.db import iter_needs_llm, upsert_labels
+from src.db import (DB_BATCH_SIZE, apply_relabels, cache_labels_many, get_cached_labels, iter_needs_llm,
+                    iter_stale_labels, record_rule_set, upsert_labels_many)
+from src.metrics import increment, timed
 from src.utils import load_settings
 
+log = logging.getLogger(__name__)
 
-def _call_llm(filename: str, excerpt: str, candidates: Dict[str, list]) -> Dict[str, str]:
-    if os.getenv("ENABLE_LLM", "false").lower() != "true":
-        return {}
+LLM_CONFIDENCE = 0.9
 
-    try:
-        from openai import OpenAI
-    except ImportError:  # library not installed
-        return {}
+Pack = List[Tuple[Dict, str]]  # (document, cache key)
 
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        return {}
-
-    client = OpenAI(api_key=api_key)
-    settings = load_settings()
-    llm_settings = settings["classification"]["llm"]
 
+def _build_prompts(filename: str, excerpt: str, candidates: Dict[str, list]) -> Tuple[str, str]:
     fields = ", ".join(candidates.keys())
     system_prompt = (
         "You classify documents. Given a filename and excerpt, choose exactly one value "
@@ -33,36 +29,254 @@ def _call_llm(filename: str, excerpt: str, candidates: Dict[str, list]) -> Dict[
         f"Filename: {filename}\n\nExcerpt:\n\"\"\"\n{excerpt[:5000]}\n\"\"\"\n\n"
         f"candidate_values:\n{json.dumps(candidates)}"
     )
+    return system_prompt, user_prompt
+
 
-    response = client.chat.completions.create(
-        model=llm_settings["model"],
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-        temperature=llm_settings.get("temperature", 0),
-        max_tokens=llm_settings.get("max_tokens", 120),
+def _build_pack_prompts(documents: List[Dict], candidates: Dict[str, list]) -> Tuple[str, str]:
+    fields = ", ".join(candidates.keys())
+    system_prompt = (
+        "You classify documents. For each numbered document (filename and excerpt), choose "
+        f"exactly one value for each field ({fields}) using only candidate_values. "
+        "Return strict JSON mapping each document number to an object with those keys."
     )
+    parts = [
+        f"Document {number}\nFilename: {document['name']}\n\n"
+        f"Excerpt:\n\"\"\"\n{(document.get('excerpt') or '')[:5000]}\n\"\"\""
+        for number, document in enumerate(documents, start=1)
+    ]
+    user_prompt = "\n\n".join(parts) + f"\n\ncandidate_values:\n{json.dumps(candidates)}"
+    return system_prompt, user_prompt
+
+
+def _cache_key(model: str, system_prompt: str, user_prompt: str) -> str:
+    return hashlib.sha256(f"{model}\0{system_prompt}\0{user_prompt}".encode("utf-8")).hexdigest()
+
+
+def settings_fingerprint(candidates: Dict[str, list], llm_settings: Dict) -> Tuple[str, Dict[str, str]]:
+    # What an LLM label depends on besides the document: model, temperature
+    # and the prompt, candidate values included. Same shape as the heuristic
+    # rules fingerprint.
+    prompts = _build_prompts("", "", candidates)
+    digest = hashlib.sha256(
+        json.dumps([llm_settings["model"], llm_settings.get("temperature", 0), *prompts]).encode("utf-8")
+    ).hexdigest()
+    fields = {
+        field: hashlib.sha256(json.dumps(values).encode("utf-8")).hexdigest()[:16]
+        for field, values in candidates.items()
+    }
+    return f"llm-{digest[:12]}", fields
+
+
+def _make_client():
+    # Returns None when the LLM pass is disabled or unavailable; cached
+    # answers are still applied. OPENAI_BASE_URL can point at a local stub.
+    if os.getenv("ENABLE_LLM", "false").lower() != "true":
+        return None
+
+    try:
+        from openai import AsyncOpenAI
+    except ImportError:  # library not installed
+        return None
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return None
+
+    return AsyncOpenAI(api_key=api_key, base_url=os.getenv("OPENAI_BASE_URL") or None)
+
+
+def _parse_json(content: str | None) -> Dict:
+    if not content:
+        return {}
+    try:
+        parsed = json.loads(content)
+    except json.JSONDecodeError:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+async def _complete(client, system_prompt: str, user_prompt: str, llm_settings: Dict,
+                    max_tokens: int, stats: Dict) -> Dict:
+    with timed("llm.request"):
+        response = await client.chat.completions.create(
+            model=llm_settings["model"],
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            temperature=llm_settings.get("temperature", 0),
+            max_tokens=max_tokens,
+        )
+    stats["api_calls"] += 1
+    usage = getattr(response, "usage", None)
+    if usage:
+        stats["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+        stats["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+        increment("llm.prompt_tokens", getattr(usage, "prompt_tokens", 0) or 0)
+        increment("llm.completion_tokens", getattr(usage, "completion_tokens", 0) or 0)
 
     content = None
     if response.choices:
         message = response.choices[0].message
         if message:
             content = getattr(message, "content", None)
+    return _parse_json(content)
 
-    if not content:
-        return {}
+
+async def _classify_pack(client, pack: Pack, candidates: Dict[str, list], llm_settings: Dict,
+                         stats: Dict) -> List[Dict]:
+    # One output per document in the pack; {} where the model gave none.
+    max_tokens = llm_settings.get("max_tokens", 120)
+    if len(pack) == 1:
+        document = pack[0][0]
+        prompts = _build_prompts(document["name"], document.get("excerpt") or "", candidates)
+        return [await _complete(client, *prompts, llm_settings, max_tokens, stats)]
+    prompts = _build_pack_prompts([document for document, _ in pack], candidates)
+    output = await _complete(client, *prompts, llm_settings, max_tokens * len(pack), stats)
+    return [output.get(str(number)) or {} for number in range(1, len(pack) + 1)]
+
+
+def _packs(misses: Iterable[Tuple[Dict, str]], pack_size: int, pack_max_chars: int) -> Iterator[Pack]:
+    # Short documents share a prompt; long ones are sent alone.
+    pack: Pack = []
+    for document, key in misses:
+        if pack_size <= 1 or len(document.get("excerpt") or "") > pack_max_chars:
+            yield [(document, key)]
+            continue
+        pack.append((document, key))
+        if len(pack) >= pack_size:
+            yield pack
+            pack = []
+    if pack:
+        yield pack
+
+
+async def _classify_documents(documents: Iterable[Dict], candidates: Dict[str, list], llm_settings: Dict,
+                              stats: Dict, version: str, write: Callable[[List[Tuple]], object]) -> None:
+    # Requests run concurrently, at most llm.concurrency in flight; results are
+    # written from this (the loop's) thread in DB_BATCH_SIZE batches. Every
+    # document is cached under its single-document prompt key, packed or not,
+    # so reruns and duplicate excerpts never reach the API again.
+    client = _make_client()
+    model = llm_settings["model"]
+    concurrency = max(int(llm_settings.get("concurrency", 4)), 1)
+    labels: List[Tuple] = []
+    answers: List[Tuple] = []
+    answered: Dict[str, Dict] = {}  # this run's answers, before they reach the cache
+    waiting: Dict[str, List[Dict]] = {}  # documents sharing an in-flight prompt
+
+    def flush() -> None:
+        write(labels)
+        cache_labels_many("llm", answers)
+        labels.clear()
+        answers.clear()
+
+    def emit(document: Dict, output: Dict, confidence: float, key: str | None = None) -> None:
+        labels.append((document["file_id"], output, "llm", confidence, 1, version))
+        if key:
+            answers.append((document.get("sha256"), key, output, confidence))
+        if len(labels) >= DB_BATCH_SIZE:
+            flush()
+
+    def misses() -> Iterator[Tuple[Dict, str]]:
+        for document in documents:
+            stats["documents"] += 1
+            key = _cache_key(model, *_build_prompts(document["name"], document.get("excerpt") or "", candidates))
+            cached = get_cached_labels("llm", document.get("sha256"), key)
+            if cached:
+                stats["cache_hits"] += 1
+                increment("llm.cache_hits")
+                emit(document, *cached)
+            elif key in answered:
+                stats["cache_hits"] += 1
+                emit(document, answered[key], LLM_CONFIDENCE, key)
+            elif key in waiting:
+                stats["cache_hits"] += 1
+                waiting[key].append(document)
+            elif client is not None:
+                waiting[key] = [document]
+                yield document, key
+
+    def settle(task: asyncio.Task, pack: Pack) -> None:
+        try:
+            outputs = task.result()
+        except Exception as exc:
+            log.warning("LLM request failed for %d document(s): %s", len(pack), exc)
+            outputs = [{}] * len(pack)
+        for (_, key), output in zip(pack, outputs):
+            sharing = waiting.pop(key, [])
+            if not output:
+                continue
+            answered[key] = output
+            for document in sharing:
+                emit(document, output, LLM_CONFIDENCE, key)
+
+    pending: Dict[asyncio.Task, Pack] = {}
+
+    async def drain(limit: int) -> None:
+        while len(pending) > limit:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                settle(task, pending.pop(task))
 
     try:
-        return json.loads(content)
-    except json.JSONDecodeError:
-        return {}
+        pack_size = int(llm_settings.get("pack_size", 1))
+        pack_max_chars = int(llm_settings.get("pack_max_chars", 1500))
+        for pack in _packs(misses(), pack_size, pack_max_chars):
+            await drain(concurrency - 1)
+            pending[asyncio.create_task(_classify_pack(client, pack, candidates, llm_settings, stats))] = pack
+        await drain(0)
+        flush()
+    finally:
+        for task in pending:
+            task.cancel()
+        if client is not None:
+            await client.close()
 
 
-def run_llm_pass() -> None:
+def _load_llm_settings() -> Tuple[Dict[str, list], Dict, str]:
     settings = load_settings()
     candidates = settings["classification"]["candidate_values"]
-    for document in iter_needs_llm():
-        output = _call_llm(document["name"], document.get("excerpt", ""), candidates) or {}
-        if output:
-            upsert_labels(document["file_id"], output, source="llm", confidence=0.9, needs_review=1)
+    llm_settings = settings["classification"]["llm"]
+    version, fields = settings_fingerprint(candidates, llm_settings)
+    record_rule_set(version, "llm", fields)
+    return candidates, llm_settings, version
+
+
+def run_llm_pass(documents: Iterable[Dict] | None = None,
+                 write: Callable[[List[Tuple]], object] | None = None) -> Dict[str, float]:
+    # write receives each batch of label rows (file_id, labels, "llm",
+    # confidence, needs_review, rules_version); upsert_labels_many by default.
+    candidates, llm_settings, version = _load_llm_settings()
+    stats = {"documents": 0, "cache_hits": 0, "api_calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    started = time.monotonic()
+    if documents is None:
+        documents = iter_needs_llm()
+    asyncio.run(_classify_documents(documents, candidates, llm_settings, stats, version,
+                                    write or upsert_labels_many))
+    elapsed = time.monotonic() - started
+    tokens = stats["prompt_tokens"] + stats["completion_tokens"]
+    stats["seconds"] = round(elapsed, 2)
+    stats["tokens_per_second"] = round(tokens / elapsed, 1) if elapsed > 0 else 0.0
+    stats["cost"] = round(
+        stats["prompt_tokens"] / 1000 * llm_settings.get("input_cost_per_1k", 0)
+        + stats["completion_tokens"] / 1000 * llm_settings.get("output_cost_per_1k", 0),
+        4,
+    )
+    return stats
+
+
+def run_stale_llm() -> Tuple[Dict, Dict[str, float]]:
+    # Asks again for LLM labels made with another model, prompt or candidate
+    # values than settings.yaml now holds. Labels the LLM gives no answer for
+    # (it is disabled, or the request failed) stay stale for the next run.
+    # Returns (apply_relabels' stats, run_llm_pass' stats).
+    version = _load_llm_settings()[2]
+    relabels = apply_relabels((), {"version": version})  # zeroed counters
+    documents = (document for batch in iter_stale_labels("llm", version) for document in batch)
+
+    def write(rows: List[Tuple]) -> None:
+        apply_relabels(((file_id, labels, source, confidence, rules_version)
+                        for file_id, labels, source, confidence, _, rules_version in rows), relabels)
+
+    return relabels, run_llm_pass(documents, write)
@@ -1,27 +1,92 @@
+import json
 import os
 import sqlite3
 import pathlib
-from typing import Dict, Iterable
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from src.metrics import increment, timed
 
 DB_PATH = os.getenv("DB_PATH", "data/workdrive.db")
-_SCHEMA_ENSURED = False
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "500"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "65536"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "30"))
+SCHEMA_PATH = pathlib.Path(__file__).resolve().parent.parent / "data" / "schema.sql"
+# The schema is brought up to date once per process, when its first
+# connection opens; helpers never check it themselves.
+_MIGRATED = False
+_MIGRATE_LOCK = threading.RLock()
+_local = threading.local()
 
 
 def _conn():
-    path = pathlib.Path(DB_PATH)
-    path.parent.mkdir(parents=True, exist_ok=True)
-    return sqlite3.connect(DB_PATH)
+    # One long-lived connection per thread; `with _conn() as conn` still
+    # scopes a transaction (commit/rollback) without closing the connection.
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        path = pathlib.Path(DB_PATH)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        _local.conn = conn
+        if not _MIGRATED and not getattr(_local, "migrating", False):
+            init_db()
+    return conn
 
 
-def init_db():
-    with _conn() as conn:
-        conn.executescript(open("data/schema.sql").read())
-        _ensure_schema(conn)
+def close_conn() -> None:
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+def _chunked(rows: Iterable, size: int | None = None) -> Iterator[List]:
+    size = size or DB_BATCH_SIZE
+    chunk: List = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _table_of(sql: str) -> str:
+    match = re.search(r"\b(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+(\w+)", sql, re.IGNORECASE)
+    return match.group(1) if match else "other"
+
+
+def _executemany(sql: str, params: Iterable[Tuple], batch_size: int | None = None) -> int:
+    conn = _conn()
+    name = f"db.write.{_table_of(sql)}"
+    count = 0
+    for chunk in _chunked(params, batch_size):
+        with timed(name), conn:
+            conn.executemany(sql, chunk)
+        increment(f"{name}.rows", len(chunk))
+        count += len(chunk)
+    return count
+
+
+def _schema_sql() -> str:
+    return SCHEMA_PATH.read_text()
+
+
+def _columns(conn, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
 
 
 def _ensure_column(conn, table: str, column: str, definition: str) -> None:
-    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
-    if column not in existing:
+    if column not in _columns(conn, table):
         conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
 
 
@@ -33,147 +98,688 @@ def _table_exists(conn, table: str) -> bool:
     return cursor.fetchone() is not None
 
 
-def _ensure_schema(conn) -> None:
-    global _SCHEMA_ENSURED
-    if _SCHEMA_ENSURED:
-        return
-    if not _table_exists(conn, "documents") or not _table_exists(conn, "labels"):
+# Migrations bring tables created by an older schema.sql up to the current
+# one; schema.sql itself (all IF NOT EXISTS) then creates whatever is still
+# missing, so a new database simply skips to it. Each migration is safe to
+# run again: an interrupted one is redone (or resumed) on the next start,
+# as versions are only recorded once the whole upgrade has finished. Add new
+# ones at the end with the next version number.
+def _migrate_columns(conn) -> None:
+    # Columns added before migrations were versioned.
+    for table, column, definition in (
+        ("documents", "permalink", "TEXT"),
+        ("documents", "download_url", "TEXT"),
+        ("documents", "parent_id", "TEXT"),
+        ("documents", "deleted_at", "TEXT"),
+        ("documents", "excerpt_version", "TEXT"),
+        ("documents", "excerpt_strategy", "TEXT"),
+        ("labels", "hardware_version", "TEXT"),
+        ("labels", "software_version", "TEXT"),
+        ("labels", "priority", "TEXT"),
+        ("labels", "audience_level", "TEXT"),
+        ("content_cache", "excerpt_strategy", "TEXT"),
+    ):
+        if _table_exists(conn, table):
+            _ensure_column(conn, table, column, definition)
+
+
+def _migrate_excerpts(conn) -> None:
+    # Moves documents.excerpt into the excerpts table (leaving its length in
+    # documents.excerpt_chars) one rowid batch per transaction. Moved rows
+    # are nulled, so an interrupted run resumes with the rest. The search
+    # index read the old column; it is dropped here and rebuilt after
+    # schema.sql recreates it.
+    if not _table_exists(conn, "documents") or "excerpt" not in _columns(conn, "documents"):
         return
-    _ensure_column(conn, "documents", "permalink", "TEXT")
-    _ensure_column(conn, "documents", "download_url", "TEXT")
-    _ensure_column(conn, "labels", "hardware_version", "TEXT")
-    _ensure_column(conn, "labels", "software_version", "TEXT")
-    _ensure_column(conn, "labels", "priority", "TEXT")
-    _ensure_column(conn, "labels", "audience_level", "TEXT")
-    _SCHEMA_ENSURED = True
+    conn.executescript(
+        """
+        DROP TRIGGER IF EXISTS documents_fts_insert;
+        DROP TRIGGER IF EXISTS documents_fts_delete;
+        DROP TRIGGER IF EXISTS documents_fts_update;
+        DROP TABLE IF EXISTS documents_fts;
+        CREATE TABLE IF NOT EXISTS excerpts (file_id TEXT PRIMARY KEY, excerpt TEXT);
+        """
+    )
+    _ensure_column(conn, "documents", "excerpt_chars", "INTEGER")
+    last_rowid = 0
+    while True:
+        with conn:
+            row = conn.execute(
+                "SELECT MAX(rowid), COUNT(*) FROM (SELECT rowid FROM documents WHERE rowid>? ORDER BY rowid LIMIT ?)",
+                (last_rowid, DB_BATCH_SIZE),
+            ).fetchone()
+            if not row[1]:
+                break
+            conn.execute(
+                "INSERT OR REPLACE INTO excerpts(file_id, excerpt) SELECT file_id, excerpt FROM documents "
+                "WHERE rowid>? AND rowid<=? AND excerpt IS NOT NULL",
+                (last_rowid, row[0]),
+            )
+            conn.execute(
+                "UPDATE documents SET excerpt_chars=length(excerpt), excerpt=NULL "
+                "WHERE rowid>? AND rowid<=? AND excerpt IS NOT NULL",
+                (last_rowid, row[0]),
+            )
+        last_rowid = row[0]
+    with conn:
+        conn.execute("ALTER TABLE documents DROP COLUMN excerpt")
+
+
+def _migrate_rules_version(conn) -> None:
+    # Labels written before this have no rules_version, so classify --stale
+    # treats them as stale and rescores them once.
+    if _table_exists(conn, "labels"):
+        _ensure_column(conn, "labels", "rules_version", "TEXT")
+
+
+_MIGRATIONS = (
+    (1, "columns", _migrate_columns),
+    (2, "excerpts", _migrate_excerpts),
+    (3, "rules_version", _migrate_rules_version),
+)
+SCHEMA_VERSION = _MIGRATIONS[-1][0]
+
+
+def _search_index_complete(conn) -> bool:
+    # documents_fts_docsize has one row per indexed document.
+    if not _table_exists(conn, "documents_fts"):
+        return False
+    row = conn.execute(
+        "SELECT (SELECT COUNT(*) FROM documents_fts_docsize) = (SELECT COUNT(*) FROM documents)"
+    ).fetchone()
+    return bool(row[0])
+
+
+def _apply_schema(conn) -> None:
+    # Every statement in schema.sql is IF NOT EXISTS. A search index created
+    # next to existing documents (or left half-built) is filled here.
+    had_index = _table_exists(conn, "documents_fts")
+    conn.executescript(_schema_sql())
+    if not had_index or not _search_index_complete(conn):
+        rebuild_search_index(conn)
+
+
+def migrate(conn=None) -> List[int]:
+    # Applies pending migrations and schema.sql; returns the versions
+    # applied. Up to date, this is a single read of schema_version.
+    conn = conn or _conn()
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT, applied_at TEXT)"
+    )
+    current = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+    pending = [migration for migration in _MIGRATIONS if migration[0] > current]
+    if not pending:
+        return []
+    for version, name, migration in pending:
+        with timed(f"db.migrate.{name}"):
+            migration(conn)
+    _apply_schema(conn)
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO schema_version(version, name, applied_at) VALUES (?,?,datetime('now'))",
+            [(version, name) for version, name, _ in pending],
+        )
+    return [version for version, _, _ in pending]
+
+
+def init_db() -> List[int]:
+    # Returns the versions this call applied. While it runs, _conn() on this
+    # thread hands out the connection without migrating again, so the
+    # migrations are applied (and reported) here, not by a nested call.
+    global _MIGRATED
+    with _MIGRATE_LOCK:
+        _local.migrating = True
+        try:
+            applied = migrate(_conn())
+        finally:
+            _local.migrating = False
+        _MIGRATED = True
+    return applied
+
+
+def schema_versions() -> List[Tuple[int, str, str]]:
+    return _conn().execute("SELECT version, name, applied_at FROM schema_version ORDER BY version").fetchall()
+
+
+# Crawl bookkeeping (last_seen, last_listed, run_started) is kept to the
+# millisecond: finish_crawl tombstones rows last seen before the run
+# started, and whole seconds made same-second rows look current.
+_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# A changed modified_time/size drops the stored excerpt so extraction picks
+# the file up again; unchanged files keep theirs. (The documents_fts_update
+# trigger deletes the excerpt row itself.)
+_UPSERT_DOCUMENT_SQL = f"""
+INSERT INTO documents(file_id,name,path,size,created_time,modified_time,suffix,permalink,download_url,parent_id,last_seen)
+VALUES (?,?,?,?,?,?,?,?,?,?,{_NOW})
+ON CONFLICT(file_id) DO UPDATE SET
+  excerpt_chars=CASE WHEN documents.modified_time IS excluded.modified_time
+                      AND documents.size IS excluded.size
+                     THEN documents.excerpt_chars END,
+  sha256=CASE WHEN documents.modified_time IS excluded.modified_time
+               AND documents.size IS excluded.size
+              THEN documents.sha256 END,
+  excerpt_version=CASE WHEN documents.modified_time IS excluded.modified_time
+                        AND documents.size IS excluded.size
+                       THEN documents.excerpt_version END,
+  excerpt_strategy=CASE WHEN documents.modified_time IS excluded.modified_time
+                         AND documents.size IS excluded.size
+                        THEN documents.excerpt_strategy END,
+  name=excluded.name, path=excluded.path, size=excluded.size,
+  created_time=excluded.created_time, modified_time=excluded.modified_time,
+  suffix=excluded.suffix,
+  permalink=excluded.permalink,
+  download_url=excluded.download_url,
+  parent_id=COALESCE(excluded.parent_id, documents.parent_id),
+  last_seen={_NOW},
+  deleted_at=NULL;
+"""
+
+
+def _document_params(row: Dict) -> Tuple:
+    suffix = os.path.splitext(row["name"])[1].lower()
+    return (
+        row["file_id"],
+        row["name"],
+        row["path"],
+        row["size"],
+        row["created_time"],
+        row["modified_time"],
+        suffix,
+        row.get("permalink", ""),
+        row.get("download_url", ""),
+        row.get("parent_id"),
+    )
 
 
 def upsert_document(row: Dict):
-    with _conn() as conn:
-        _ensure_schema(conn)
-        suffix = os.path.splitext(row["name"])[1].lower()
+    upsert_documents([row])
+
+
+def upsert_documents(rows: Iterable[Dict], batch_size: int | None = None) -> int:
+    return _executemany(_UPSERT_DOCUMENT_SQL, (_document_params(row) for row in rows), batch_size)
+
+
+def mark_seen(file_id: str):
+    mark_seen_many([file_id])
+
+
+def mark_seen_many(file_ids: Iterable[str], batch_size: int | None = None) -> int:
+    return _executemany(
+        f"UPDATE documents SET last_seen={_NOW} WHERE file_id=?",
+        ((file_id,) for file_id in file_ids),
+        batch_size,
+    )
+
+
+_INSERT_FRONTIER_SQL = """
+INSERT OR IGNORE INTO crawl_frontier(container_id,container_kind,prefix,page_offset,page_limit,stride)
+VALUES (?,?,?,?,?,?)
+"""
+
+_UPSERT_FOLDER_SQL = f"""
+INSERT INTO folders(folder_id,parent_id,path,modified_at,child_count,last_listed,last_seen)
+VALUES (?,?,?,?,?,NULL,{_NOW})
+ON CONFLICT(folder_id) DO UPDATE SET
+  last_listed=CASE WHEN folders.path IS excluded.path
+                    AND folders.modified_at IS excluded.modified_at
+                    AND folders.child_count IS excluded.child_count
+                   THEN folders.last_listed END,
+  parent_id=excluded.parent_id, path=excluded.path,
+  modified_at=excluded.modified_at, child_count=excluded.child_count,
+  last_seen={_NOW}
+"""
+
+_TOUCH_SUBTREE_SQL = """
+WITH RECURSIVE subtree(folder_id) AS (
+  SELECT ?
+  UNION
+  SELECT f.folder_id FROM folders f JOIN subtree s ON f.parent_id=s.folder_id
+)
+UPDATE {table} SET last_seen={now} WHERE {column} IN subtree
+"""
+
+
+def has_crawl_checkpoint() -> bool:
+    conn = _conn()
+    row = conn.execute("SELECT 1 FROM crawl_state WHERE key='run_started'").fetchone()
+    return row is not None
+
+
+def begin_crawl(seed_tasks: Iterable[Tuple], restart: bool = False) -> Tuple[str, List[Tuple]]:
+    # Tasks are (container_id, container_kind, prefix, page_offset, page_limit, stride).
+    # An unfinished run is resumed from its frontier unless restart is set.
+    conn = _conn()
+    with conn:
+        row = conn.execute("SELECT value FROM crawl_state WHERE key='run_started'").fetchone()
+        if row and not restart:
+            tasks = conn.execute(
+                "SELECT container_id,container_kind,prefix,page_offset,page_limit,stride FROM crawl_frontier"
+            ).fetchall()
+            return row[0], tasks
+        run_started = conn.execute(f"SELECT {_NOW}").fetchone()[0]
+        tasks = list(seed_tasks)
+        conn.execute("DELETE FROM crawl_frontier")
         conn.execute(
-            """
-            INSERT INTO documents(file_id,name,path,size,created_time,modified_time,suffix,permalink,download_url,last_seen)
-            VALUES (?,?,?,?,?,?,?,?,?,datetime('now'))
-            ON CONFLICT(file_id) DO UPDATE SET
-              name=excluded.name, path=excluded.path, size=excluded.size,
-              created_time=excluded.created_time, modified_time=excluded.modified_time,
-              suffix=excluded.suffix,
-              permalink=excluded.permalink,
-              download_url=excluded.download_url,
-              last_seen=datetime('now');
-            """,
-            (
-                row["file_id"],
-                row["name"],
-                row["path"],
-                row["size"],
-                row["created_time"],
-                row["modified_time"],
-                suffix,
-                row.get("permalink", ""),
-                row.get("download_url", ""),
-            ),
+            "INSERT OR REPLACE INTO crawl_state(key,value) VALUES ('run_started',?)",
+            (run_started,),
         )
+        conn.executemany(_INSERT_FRONTIER_SQL, tasks)
+    return run_started, tasks
 
 
-def mark_seen(file_id: str):
-    with _conn() as conn:
-        _ensure_schema(conn)
+def get_folder_states(folder_ids: List[str]) -> Dict[str, Tuple]:
+    # folder_id -> (path, modified_at, child_count, last_listed)
+    if not folder_ids:
+        return {}
+    conn = _conn()
+    placeholders = ",".join("?" for _ in folder_ids)
+    cursor = conn.execute(
+        f"SELECT folder_id,path,modified_at,child_count,last_listed FROM folders WHERE folder_id IN ({placeholders})",
+        folder_ids,
+    )
+    return {row[0]: tuple(row[1:]) for row in cursor}
+
+
+def record_crawl_page(
+    task: Tuple,
+    documents: List[Dict],
+    folders: List[Tuple],
+    new_tasks: List[Tuple],
+    unchanged_folder_ids: List[str],
+) -> None:
+    # One transaction per listed page keeps rows and the frontier consistent,
+    # so an interrupted crawl resumes exactly where it stopped.
+    # folders: (folder_id, parent_id, path, modified_at, child_count)
+    conn = _conn()
+    with timed("db.write.crawl_page"), conn:
+        conn.executemany(_UPSERT_DOCUMENT_SQL, [_document_params(row) for row in documents])
+        conn.executemany(_UPSERT_FOLDER_SQL, folders)
+        for folder_id in unchanged_folder_ids:
+            conn.execute(_TOUCH_SUBTREE_SQL.format(table="folders", column="folder_id", now=_NOW), (folder_id,))
+            conn.execute(_TOUCH_SUBTREE_SQL.format(table="documents", column="parent_id", now=_NOW), (folder_id,))
+        if task[3] == 0:
+            conn.execute(
+                f"UPDATE folders SET last_listed={_NOW} WHERE folder_id=?",
+                (task[0],),
+            )
+        conn.executemany(_INSERT_FRONTIER_SQL, new_tasks)
         conn.execute(
-            "UPDATE documents SET last_seen=datetime('now') WHERE file_id=?",
-            (file_id,),
+            "DELETE FROM crawl_frontier WHERE container_id=? AND page_offset=?",
+            (task[0], task[3]),
+        )
+
+
+def finish_crawl(run_started: str) -> int:
+    # Anything a completed run did not reach is gone from WorkDrive.
+    conn = _conn()
+    with conn:
+        cursor = conn.execute(
+            "UPDATE documents SET deleted_at=datetime('now') WHERE last_seen < ? AND deleted_at IS NULL",
+            (run_started,),
         )
+        conn.execute("DELETE FROM folders WHERE last_seen < ?", (run_started,))
+        conn.execute("DELETE FROM crawl_frontier")
+        conn.execute("DELETE FROM crawl_state WHERE key='run_started'")
+    return cursor.rowcount
+
+
+# The WHERE clause matches idx_documents_pending_extract word for word, as
+# SQLite only uses a partial index whose condition appears in the query.
+_PENDING_EXTRACTION_SQL = """
+SELECT file_id,name,suffix,sha256,size FROM documents
+WHERE deleted_at IS NULL AND COALESCE(excerpt_chars, 0)=0
+"""
+
+_STALE_EXCERPTS_SQL = """
+SELECT file_id,name,suffix,sha256,size FROM documents
+WHERE excerpt_version IS NOT ? AND deleted_at IS NULL
+"""
 
 
 def iter_documents_without_excerpt() -> Iterable[Dict]:
     with _conn() as conn:
-        _ensure_schema(conn)
-        for row in conn.execute(
-            "SELECT file_id,name,suffix FROM documents WHERE excerpt IS NULL OR excerpt=''"
-        ):
-            yield dict(file_id=row[0], name=row[1], suffix=row[2])
+        for row in conn.execute(_PENDING_EXTRACTION_SQL):
+            yield dict(file_id=row[0], name=row[1], suffix=row[2], sha256=row[3], size=row[4])
 
 
-def store_excerpt(file_id: str, excerpt: str, sha256: str):
+def iter_stale_excerpts(version: str) -> Iterable[Dict]:
+    # Live rows whose excerpt was produced by another extractor version (or
+    # never produced).
     with _conn() as conn:
-        _ensure_schema(conn)
-        conn.execute(
-            "UPDATE documents SET excerpt=?, sha256=? WHERE file_id=?",
-            (excerpt, sha256, file_id),
-        )
+        for row in conn.execute(_STALE_EXCERPTS_SQL, (version,)):
+            yield dict(file_id=row[0], name=row[1], suffix=row[2], sha256=row[3], size=row[4])
+
+
+_FINGERPRINT_MATCH_SQL = """
+SELECT src.sha256 FROM documents src
+WHERE src.name=documents.name AND src.size=documents.size
+  AND src.modified_time=documents.modified_time
+  AND src.sha256 IS NOT NULL AND src.file_id<>documents.file_id
+LIMIT 1
+"""
+
+_ADOPT_HASHES_SQL = f"""
+UPDATE documents SET sha256=({_FINGERPRINT_MATCH_SQL})
+WHERE deleted_at IS NULL AND COALESCE(excerpt_chars, 0)=0 AND sha256 IS NULL
+  AND EXISTS ({_FINGERPRINT_MATCH_SQL})
+"""
+
+
+def adopt_fingerprint_hashes() -> int:
+    # A file with the same name, size and modified_time as an already hashed
+    # one is assumed to be a copy, so it can be served from content_cache
+    # without downloading it.
+    conn = _conn()
+    with conn:
+        cursor = conn.execute(_ADOPT_HASHES_SQL)
+    return cursor.rowcount
+
+
+_GET_CACHED_EXCERPT_SQL = "SELECT excerpt, excerpt_strategy FROM content_cache WHERE sha256=? AND parser_version=?"
+
+
+def get_cached_excerpt(sha256: str, parser_version: str) -> Tuple[str, str | None] | None:
+    # (excerpt, strategy) for content already extracted by this version.
+    conn = _conn()
+    row = conn.execute(_GET_CACHED_EXCERPT_SQL, (sha256, parser_version)).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+# A new parser version invalidates the label results derived from the old excerpt.
+_CACHE_EXCERPT_SQL = """
+INSERT INTO content_cache(sha256,excerpt,excerpt_strategy,parser_version,updated_at)
+VALUES (?,?,?,?,datetime('now'))
+ON CONFLICT(sha256) DO UPDATE SET
+  heuristic_key=CASE WHEN content_cache.parser_version IS excluded.parser_version
+                     THEN content_cache.heuristic_key END,
+  llm_key=CASE WHEN content_cache.parser_version IS excluded.parser_version
+               THEN content_cache.llm_key END,
+  excerpt=excluded.excerpt, excerpt_strategy=excluded.excerpt_strategy,
+  parser_version=excluded.parser_version,
+  updated_at=datetime('now')
+"""
+
+
+def store_excerpt(file_id: str, excerpt: str, sha256: str, strategy: str | None = None):
+    store_excerpts([(file_id, excerpt, sha256, strategy)])
+
+
+def store_excerpts(rows: Iterable[Tuple[str, str, str, str | None]], parser_version: str | None = None,
+                   batch_size: int | None = None) -> int:
+    # rows: (file_id, excerpt, sha256, strategy); with parser_version the excerpts are
+    # also recorded in content_cache for other copies of the same content,
+    # and the version is kept on each document (excerpt_version).
+    conn = _conn()
+    count = 0
+    for chunk in _chunked(rows, batch_size):
+        with timed("db.write.excerpts"), conn:
+            conn.executemany(
+                "UPDATE documents SET excerpt_chars=?, sha256=?, excerpt_version=?, excerpt_strategy=? WHERE file_id=?",
+                [(len(excerpt or ""), sha256, parser_version, strategy, file_id)
+                 for file_id, excerpt, sha256, strategy in chunk],
+            )
+            conn.executemany(
+                """
+                INSERT INTO excerpts(file_id, excerpt) SELECT file_id, ? FROM documents WHERE file_id=?
+                ON CONFLICT(file_id) DO UPDATE SET excerpt=excluded.excerpt
+                """,
+                [(excerpt or "", file_id) for file_id, excerpt, _, _ in chunk],
+            )
+            if parser_version is not None:
+                conn.executemany(
+                    _CACHE_EXCERPT_SQL,
+                    [(sha256, excerpt, strategy, parser_version) for _, excerpt, sha256, strategy in chunk if sha256],
+                )
+        count += len(chunk)
+    return count
+
+
+_CACHE_STAGES = ("heuristic", "llm")
+
+
+def get_cached_labels(stage: str, sha256: str | None, key: str) -> Tuple[Dict, float] | None:
+    if stage not in _CACHE_STAGES:
+        raise ValueError(f"Unknown cache stage: {stage}")
+    if not sha256:
+        return None
+    conn = _conn()
+    row = conn.execute(
+        f"SELECT {stage}_labels, {stage}_confidence FROM content_cache WHERE sha256=? AND {stage}_key=?",
+        (sha256, key),
+    ).fetchone()
+    if not row or row[0] is None:
+        return None
+    return json.loads(row[0]), row[1]
+
+
+def cache_labels_many(stage: str, rows: Iterable[Tuple[str, str, Dict, float]],
+                      batch_size: int | None = None) -> int:
+    # rows: (sha256, key, labels, confidence)
+    if stage not in _CACHE_STAGES:
+        raise ValueError(f"Unknown cache stage: {stage}")
+    return _executemany(
+        f"""
+        INSERT INTO content_cache(sha256,{stage}_key,{stage}_labels,{stage}_confidence,updated_at)
+        VALUES (?,?,?,?,datetime('now'))
+        ON CONFLICT(sha256) DO UPDATE SET
+          {stage}_key=excluded.{stage}_key, {stage}_labels=excluded.{stage}_labels,
+          {stage}_confidence=excluded.{stage}_confidence, updated_at=datetime('now')
+        """,
+        ((sha256, key, json.dumps(labels), confidence) for sha256, key, labels, confidence in rows if sha256),
+        batch_size,
+    )
+
+
+# Work-selection queries scan the narrow documents/labels rows and fetch
+# each excerpt by primary key only for the rows they return.
+_HEURISTIC_WORK_SQL = """
+SELECT d.file_id, d.name, COALESCE(e.excerpt, ''), d.sha256
+FROM documents d
+LEFT JOIN labels l ON l.file_id=d.file_id
+LEFT JOIN excerpts e ON e.file_id=d.file_id
+WHERE d.excerpt_chars IS NOT NULL AND d.deleted_at IS NULL
+  AND (l.file_id IS NULL OR l.source IS NULL)
+"""
 
 
 def iter_documents_for_heuristics() -> Iterable[Dict]:
     with _conn() as conn:
-        _ensure_schema(conn)
-        query = """
-        SELECT d.file_id, d.name, d.excerpt
-        FROM documents d
-        LEFT JOIN labels l ON l.file_id=d.file_id
-        WHERE d.excerpt IS NOT NULL AND (l.file_id IS NULL OR l.source IS NULL)
-        """
-        for row in conn.execute(query):
-            yield dict(file_id=row[0], name=row[1], excerpt=row[2])
+        for row in conn.execute(_HEURISTIC_WORK_SQL):
+            yield dict(file_id=row[0], name=row[1], excerpt=row[2], sha256=row[3])
+
+
+LABEL_FIELDS = (
+    "doc_type", "model_type", "subsystem", "language",
+    "hardware_version", "software_version", "priority", "audience_level",
+)
+
+
+_UPSERT_LABELS_SQL = """
+INSERT INTO labels(file_id,doc_type,model_type,subsystem,language,hardware_version,software_version,priority,audience_level,source,confidence,needs_review,rules_version)
+VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
+ON CONFLICT(file_id) DO UPDATE SET
+  doc_type=excluded.doc_type, model_type=excluded.model_type,
+  subsystem=excluded.subsystem, language=excluded.language,
+  hardware_version=excluded.hardware_version,
+  software_version=excluded.software_version,
+  priority=excluded.priority,
+  audience_level=excluded.audience_level,
+  source=excluded.source, confidence=excluded.confidence,
+  needs_review=excluded.needs_review, rules_version=excluded.rules_version
+"""
+
+
+def _label_params(file_id: str, labels: Dict, source: str, confidence: float, needs_review: int,
+                  rules_version: str | None = None) -> Tuple:
+    return (
+        file_id,
+        labels.get("doc_type", ""),
+        labels.get("model_type", ""),
+        labels.get("subsystem", ""),
+        labels.get("language", ""),
+        labels.get("hardware_version", ""),
+        labels.get("software_version", ""),
+        labels.get("priority", ""),
+        labels.get("audience_level", ""),
+        source,
+        confidence,
+        needs_review,
+        rules_version,
+    )
+
+
+def upsert_labels(file_id: str, labels: Dict, source: str, confidence: float, needs_review: int,
+                  rules_version: str | None = None):
+    upsert_labels_many([(file_id, labels, source, confidence, needs_review, rules_version)])
+
 
+def upsert_labels_many(rows: Iterable[Tuple], batch_size: int | None = None) -> int:
+    # rows: (file_id, labels, source, confidence, needs_review[, rules_version])
+    return _executemany(_UPSERT_LABELS_SQL, (_label_params(*row) for row in rows), batch_size)
 
-def upsert_labels(file_id: str, labels: Dict, source: str, confidence: float, needs_review: int):
+
+def record_rule_set(version: str, stage: str, fields: Dict[str, str]) -> None:
     with _conn() as conn:
-        _ensure_schema(conn)
         conn.execute(
-            """
-            INSERT INTO labels(file_id,doc_type,model_type,subsystem,language,hardware_version,software_version,priority,audience_level,source,confidence,needs_review)
-            VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
-            ON CONFLICT(file_id) DO UPDATE SET
-              doc_type=excluded.doc_type, model_type=excluded.model_type,
-              subsystem=excluded.subsystem, language=excluded.language,
-              hardware_version=excluded.hardware_version,
-              software_version=excluded.software_version,
-              priority=excluded.priority,
-              audience_level=excluded.audience_level,
-              source=excluded.source, confidence=excluded.confidence,
-              needs_review=excluded.needs_review
-            """,
-            (
-                file_id,
-                labels.get("doc_type", ""),
-                labels.get("model_type", ""),
-                labels.get("subsystem", ""),
-                labels.get("language", ""),
-                labels.get("hardware_version", ""),
-                labels.get("software_version", ""),
-                labels.get("priority", ""),
-                labels.get("audience_level", ""),
-                source,
-                confidence,
-                needs_review,
-            ),
+            "INSERT OR IGNORE INTO rule_sets(version, stage, fields) VALUES (?,?,?)",
+            (version, stage, json.dumps(fields, sort_keys=True)),
         )
 
 
+def get_rule_sets(versions: Iterable[str]) -> Dict[str, Dict[str, str]]:
+    # version -> field hashes, for the versions that are recorded.
+    versions = [version for version in set(versions) if version]
+    if not versions:
+        return {}
+    placeholders = ",".join("?" * len(versions))
+    return {
+        row[0]: json.loads(row[1])
+        for row in _conn().execute(f"SELECT version, fields FROM rule_sets WHERE version IN ({placeholders})", versions)
+    }
+
+
+# Machine labels made with other rules than `version`, one keyset page at a
+# time so the caller can write between pages. Human labels never match.
+_STALE_LABELS_SQL = f"""
+SELECT d.file_id, d.name, COALESCE(e.excerpt, ''), d.sha256,
+       {", ".join(f"l.{field}" for field in LABEL_FIELDS)},
+       l.confidence, l.rules_version
+FROM labels l JOIN documents d ON d.file_id=l.file_id
+LEFT JOIN excerpts e ON e.file_id=d.file_id
+WHERE l.file_id>? AND l.source=? AND l.rules_version IS NOT ?
+  AND d.excerpt_chars IS NOT NULL AND d.deleted_at IS NULL
+ORDER BY l.file_id
+LIMIT ?
+"""
+
+
+def iter_stale_labels(source: str, version: str, batch_size: int | None = None) -> Iterator[List[Dict]]:
+    if source == "human":
+        raise ValueError("Human labels are never reclassified")
+    last = ""
+    while True:
+        rows = _conn().execute(_STALE_LABELS_SQL, (last, source, version, batch_size or DB_BATCH_SIZE)).fetchall()
+        if not rows:
+            return
+        yield [
+            dict(file_id=row[0], name=row[1], excerpt=row[2], sha256=row[3],
+                 labels=dict(zip(LABEL_FIELDS, ((value or "") for value in row[4:12]))),
+                 confidence=row[12], rules_version=row[13])
+            for row in rows
+        ]
+        last = rows[-1][0]
+
+
+def apply_relabels(rows: Iterable[Tuple[str, Dict, str, float, str]], stats: Dict | None = None,
+                   actor: str = "pipeline:stale", batch_size: int | None = None) -> Dict:
+    # Reclassified machine labels, rows: (file_id, labels, source, confidence,
+    # rules_version). Only rows whose labels differ are rewritten (and sent
+    # back to review, with an audit row per changed field); the rest just get
+    # the new rules_version. A row that became human meanwhile is skipped.
+    # Counts accumulate into `stats`, with transitions[(field, old, new)].
+    stats = stats if stats is not None else {}
+    for key in ("checked", "changed", "unchanged", "skipped", "changes"):
+        stats.setdefault(key, 0)
+    transitions = stats.setdefault("transitions", Counter())
+    conn = _conn()
+    for chunk in _chunked(rows, batch_size):
+        stats["checked"] += len(chunk)
+        placeholders = ",".join("?" * len(chunk))
+        current = {
+            row[0]: row
+            for row in conn.execute(
+                f"SELECT file_id, {', '.join(LABEL_FIELDS)}, source FROM labels WHERE file_id IN ({placeholders})",
+                [row[0] for row in chunk],
+            )
+        }
+        updates, touches, audit = [], [], []
+        for file_id, labels, source, confidence, rules_version in chunk:
+            stored = current.get(file_id)
+            if stored is None or stored[-1] in (None, "human"):
+                stats["skipped"] += 1
+                continue
+            old_values = dict(zip(LABEL_FIELDS, ((value or "") for value in stored[1:-1])))
+            new_values = {field: labels.get(field) or "" for field in LABEL_FIELDS}
+            changed = [field for field in LABEL_FIELDS if new_values[field] != old_values[field]]
+            if not changed and source == stored[-1]:
+                touches.append((confidence, rules_version, file_id, stored[-1]))
+                stats["unchanged"] += 1
+                continue
+            updates.append((*(new_values[field] for field in LABEL_FIELDS), source, confidence, rules_version,
+                            file_id, stored[-1]))
+            audit.extend((file_id, field, old_values[field], new_values[field], actor) for field in changed)
+            transitions.update((field, old_values[field], new_values[field]) for field in changed)
+            stats["changed"] += 1
+            stats["changes"] += len(changed)
+        with timed("db.write.relabels"), conn:
+            conn.executemany(
+                f"""
+                UPDATE labels
+                SET {", ".join(f"{field}=?" for field in LABEL_FIELDS)}, source=?, confidence=?, rules_version=?,
+                    needs_review=1
+                WHERE file_id=? AND source=?
+                """,
+                updates,
+            )
+            conn.executemany(
+                "UPDATE labels SET confidence=?, rules_version=? WHERE file_id=? AND source=?",
+                touches,
+            )
+            conn.executemany(
+                "INSERT INTO audit(file_id,field,old_value,new_value,actor) VALUES (?,?,?,?,?)",
+                audit,
+            )
+    return stats
+
+
+_LLM_WORK_SQL = """
+SELECT d.file_id, d.name, COALESCE(e.excerpt, ''), d.sha256
+FROM labels l JOIN documents d ON d.file_id=l.file_id
+LEFT JOIN excerpts e ON e.file_id=d.file_id
+WHERE l.source='heuristic' AND (l.doc_type='' OR l.model_type='' OR l.confidence < 0.8)
+  AND d.deleted_at IS NULL
+"""
+
+_SYNC_WORK_SQL = """
+SELECT d.file_id, d.name, l.doc_type, l.model_type, l.subsystem, l.language,
+       l.hardware_version, l.software_version, l.priority, l.audience_level,
+       s.template_id, s.payload_hash
+FROM labels l JOIN documents d ON d.file_id=l.file_id
+LEFT JOIN sync_state s ON s.file_id=d.file_id
+WHERE l.needs_review=0 AND d.deleted_at IS NULL
+"""
+
+
 def iter_needs_llm() -> Iterable[Dict]:
     with _conn() as conn:
-        _ensure_schema(conn)
-        query = """
-        SELECT d.file_id, d.name, d.excerpt, l.doc_type, l.model_type
-        FROM documents d JOIN labels l ON l.file_id=d.file_id
-        WHERE l.source='heuristic' AND (l.doc_type='' OR l.model_type='' OR l.confidence < 0.8)
-        """
-        for row in conn.execute(query):
-            yield dict(file_id=row[0], name=row[1], excerpt=row[2])
+        for row in conn.execute(_LLM_WORK_SQL):
+            yield dict(file_id=row[0], name=row[1], excerpt=row[2], sha256=row[3])
 
 
 def iter_for_sync() -> Iterable[Dict]:
     with _conn() as conn:
-        _ensure_schema(conn)
-        query = """
-        SELECT d.file_id, d.name, l.doc_type, l.model_type, l.subsystem, l.language,
-               l.hardware_version, l.software_version, l.priority, l.audience_level
-        FROM documents d JOIN labels l ON l.file_id=d.file_id
-        WHERE l.needs_review=0
-        """
-        for row in conn.execute(query):
+        for row in conn.execute(_SYNC_WORK_SQL):
             yield dict(
                 file_id=row[0],
                 name=row[1],
@@ -185,58 +791,392 @@ def iter_for_sync() -> Iterable[Dict]:
                 software_version=row[7],
                 priority=row[8],
                 audience_level=row[9],
+                synced_template_id=row[10],
+                synced_hash=row[11],
             )
 
 
-def save_audit_change(file_id: str, field: str, old_value: str, new_value: str, actor: str = "pipeline"):
+def mark_synced_many(rows: Iterable[Tuple[str, str, str]], batch_size: int | None = None) -> int:
+    # rows: (file_id, template_id, payload_hash)
+    return _executemany(
+        """
+        INSERT INTO sync_state(file_id,template_id,payload_hash,pushed_at,last_error,failures)
+        VALUES (?,?,?,datetime('now'),NULL,0)
+        ON CONFLICT(file_id) DO UPDATE SET
+          template_id=excluded.template_id, payload_hash=excluded.payload_hash,
+          pushed_at=excluded.pushed_at, last_error=NULL, failures=0, failed_at=NULL
+        """,
+        rows,
+        batch_size,
+    )
+
+
+def record_sync_failures_many(rows: Iterable[Tuple[str, str, str]], batch_size: int | None = None) -> int:
+    # rows: (file_id, template_id, error); the last pushed hash is kept, so the
+    # row is pushed again on the next run.
+    return _executemany(
+        """
+        INSERT INTO sync_state(file_id,template_id,last_error,failures,failed_at)
+        VALUES (?,?,?,1,datetime('now'))
+        ON CONFLICT(file_id) DO UPDATE SET
+          last_error=excluded.last_error, failures=sync_state.failures + 1,
+          failed_at=excluded.failed_at
+        """,
+        rows,
+        batch_size,
+    )
+
+
+def record_template(template_id: str, name: str) -> None:
     with _conn() as conn:
-        _ensure_schema(conn)
         conn.execute(
-            "INSERT INTO audit(file_id,field,old_value,new_value,actor) VALUES (?,?,?,?,?)",
-            (file_id, field, old_value, new_value, actor),
+            "INSERT INTO templates(id, name) VALUES (?,?) ON CONFLICT(id) DO UPDATE SET name=excluded.name",
+            (template_id, name),
         )
 
 
-def all_for_csv():
+def add_template_attachments(template_id: str, count: int) -> None:
+    if not count:
+        return
     with _conn() as conn:
-        _ensure_schema(conn)
-        query = """
-        SELECT d.file_id, d.path, d.name, d.size, d.modified_time,
-               d.permalink, d.download_url, d.excerpt,
-               l.doc_type, l.model_type, l.subsystem, l.language,
-               l.hardware_version, l.software_version, l.priority, l.audience_level,
-               l.source, l.needs_review
-        FROM documents d LEFT JOIN labels l ON l.file_id=d.file_id
-        ORDER BY d.path
+        conn.execute("UPDATE templates SET attached_count=attached_count+? WHERE id=?", (count, template_id))
+
+
+def save_audit_change(file_id: str, field: str, old_value: str, new_value: str, actor: str = "pipeline"):
+    save_audit_changes([(file_id, field, old_value, new_value, actor)])
+
+
+def save_audit_changes(rows: Iterable[Tuple[str, str, str, str, str]], batch_size: int | None = None) -> int:
+    # rows: (file_id, field, old_value, new_value, actor)
+    return _executemany(
+        "INSERT INTO audit(file_id,field,old_value,new_value,actor) VALUES (?,?,?,?,?)",
+        rows,
+        batch_size,
+    )
+
+
+CSV_COLUMNS = {
+    "file_id": "d.file_id",
+    "path": "d.path",
+    "name": "d.name",
+    "size": "d.size",
+    "modified_time": "d.modified_time",
+    "permalink": "d.permalink",
+    "download_url": "d.download_url",
+    "excerpt": "x.excerpt",
+    "doc_type": "l.doc_type",
+    "model_type": "l.model_type",
+    "subsystem": "l.subsystem",
+    "language": "l.language",
+    "hardware_version": "l.hardware_version",
+    "software_version": "l.software_version",
+    "priority": "l.priority",
+    "audience_level": "l.audience_level",
+    "source": "l.source",
+    "needs_review": "l.needs_review",
+}
+
+
+def _csv_sql(columns: List[str]) -> str:
+    # The excerpts table is only joined when the excerpt column is asked for.
+    return f"""
+    SELECT {", ".join(CSV_COLUMNS[column] for column in columns)}
+    FROM documents d LEFT JOIN labels l ON l.file_id=d.file_id
+    {"LEFT JOIN excerpts x ON x.file_id=d.file_id" if "excerpt" in columns else ""}
+    WHERE d.deleted_at IS NULL
+    ORDER BY d.path
+    """
+
+
+def iter_for_csv(columns: List[str] | None = None) -> Iterator[Tuple]:
+    # Streams rows (as tuples, in column order) straight off the cursor.
+    columns = columns or list(CSV_COLUMNS)
+    unknown = [column for column in columns if column not in CSV_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown CSV column(s): {', '.join(unknown)}")
+    conn = _conn()
+    yield from conn.execute(_csv_sql(columns))
+
+
+SNAPSHOT_COLUMNS = (
+    "file_id", "path", "name", "top_folder", "size", "created_time", "modified_time", "suffix",
+    "sha256", *LABEL_FIELDS, "source", "confidence", "needs_review", "deleted_at",
+)
+
+
+def _snapshot_sql(include_deleted: bool) -> str:
+    return f"""
+    SELECT d.file_id, d.path, d.name,
+           CASE WHEN instr(d.path,'/')>0 THEN substr(d.path,1,instr(d.path,'/')-1) ELSE '' END,
+           d.size, d.created_time, d.modified_time, d.suffix, d.sha256,
+           {", ".join(f"l.{field}" for field in LABEL_FIELDS)},
+           l.source, l.confidence, l.needs_review, d.deleted_at,
+           e.row_hash
+    FROM documents d
+    LEFT JOIN labels l ON l.file_id=d.file_id
+    LEFT JOIN export_state e ON e.file_id=d.file_id
+    {"" if include_deleted else "WHERE d.deleted_at IS NULL"}
+    """
+
+
+def iter_for_snapshot(include_deleted: bool = False) -> Iterator[Tuple]:
+    # Rows in SNAPSHOT_COLUMNS order followed by the hash recorded at the
+    # last snapshot (None if never exported). Excerpts are left out.
+    conn = _conn()
+    yield from conn.execute(_snapshot_sql(include_deleted))
+
+
+def mark_exported_many(rows: Iterable[Tuple[str, str, str]], batch_size: int | None = None) -> int:
+    # rows: (file_id, row_hash, snapshot)
+    return _executemany(
         """
-        cursor = conn.execute(query)
-        columns = [desc[0] for desc in cursor.description]
-        rows = [dict(zip(columns, row)) for row in cursor]
-        return rows
+        INSERT INTO export_state(file_id,row_hash,snapshot) VALUES (?,?,?)
+        ON CONFLICT(file_id) DO UPDATE SET row_hash=excluded.row_hash, snapshot=excluded.snapshot
+        """,
+        rows,
+        batch_size,
+    )
 
 
-def update_from_csv_row(row: Dict):
-    with _conn() as conn:
-        _ensure_schema(conn)
-        conn.execute(
-            """
-            UPDATE labels
-            SET doc_type=?, model_type=?, subsystem=?, language=?,
-                hardware_version=?, software_version=?, priority=?, audience_level=?,
-                source=?, needs_review=?
-            WHERE file_id=?
-            """,
-            (
-                row.get("doc_type", ""),
-                row.get("model_type", ""),
-                row.get("subsystem", ""),
-                row.get("language", ""),
-                row.get("hardware_version", ""),
-                row.get("software_version", ""),
-                row.get("priority", ""),
-                row.get("audience_level", ""),
-                "human",
-                0,
-                row["file_id"],
-            ),
+_REVIEW_COLUMNS = """
+d.file_id, d.path, d.name, d.permalink, d.download_url,
+l.doc_type, l.model_type, l.subsystem, l.language,
+l.hardware_version, l.software_version, l.priority, l.audience_level,
+l.source, l.confidence, l.needs_review
+"""
+
+
+def _review_filters(filters: Dict) -> Tuple[List[str], List]:
+    clauses, params = ["d.deleted_at IS NULL"], []
+    if filters.get("needs_review") is not None:
+        clauses.append("l.needs_review=?")
+        params.append(int(filters["needs_review"]))
+    if filters.get("source"):
+        clauses.append("l.source=?")
+        params.append(filters["source"])
+    if filters.get("doc_type") is not None:
+        clauses.append("COALESCE(l.doc_type,'')=?")
+        params.append(filters["doc_type"])
+    if filters.get("min_confidence") is not None:
+        clauses.append("l.confidence>=?")
+        params.append(filters["min_confidence"])
+    if filters.get("max_confidence") is not None:
+        clauses.append("l.confidence<=?")
+        params.append(filters["max_confidence"])
+    if filters.get("path_prefix"):
+        # A range instead of LIKE so the path index is used.
+        clauses.append("d.path>=? AND d.path<?")
+        params.extend([filters["path_prefix"], filters["path_prefix"] + "\U0010ffff"])
+    return clauses, params
+
+
+def _review_page_sql(clauses: List[str]) -> str:
+    return f"""
+    SELECT {_REVIEW_COLUMNS}
+    FROM documents d LEFT JOIN labels l ON l.file_id=d.file_id
+    WHERE {" AND ".join(clauses)}
+    ORDER BY d.path, d.file_id
+    LIMIT ?
+    """
+
+
+def review_page(filters: Dict, after: Tuple[str, str] | None = None, limit: int = 50) -> List[Dict]:
+    # Keyset pagination on (path, file_id): each page costs the same however
+    # deep into the inventory it is. Excerpts are left out; see get_excerpt.
+    clauses, params = _review_filters(filters)
+    if after:
+        clauses.append("(d.path, d.file_id) > (?, ?)")
+        params.extend(after)
+    conn = _conn()
+    cursor = conn.execute(_review_page_sql(clauses), (*params, limit))
+    columns = [desc[0] for desc in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
+
+
+def get_excerpt(file_id: str) -> str:
+    conn = _conn()
+    row = conn.execute("SELECT excerpt FROM excerpts WHERE file_id=?", (file_id,)).fetchone()
+    return (row[0] or "") if row else ""
+
+
+def label_sources() -> List[str]:
+    conn = _conn()
+    return [row[0] for row in conn.execute("SELECT DISTINCT source FROM labels WHERE source IS NOT NULL ORDER BY source")]
+
+
+def rebuild_search_index(conn=None, batch_size: int | None = None) -> int:
+    # Refills documents_fts from documents in rowid batches, one transaction
+    # per batch, so a large inventory never holds one long write lock.
+    conn = conn or _conn()
+    batch_size = batch_size or DB_BATCH_SIZE
+    with conn:
+        conn.execute("INSERT INTO documents_fts(documents_fts) VALUES ('delete-all')")
+    count, last_rowid = 0, 0
+    while True:
+        with conn:
+            row = conn.execute(
+                "SELECT MAX(rowid), COUNT(*) FROM (SELECT rowid FROM documents WHERE rowid>? ORDER BY rowid LIMIT ?)",
+                (last_rowid, batch_size),
+            ).fetchone()
+            if not row[1]:
+                break
+            conn.execute(
+                """
+                INSERT INTO documents_fts(rowid, name, path, excerpt)
+                SELECT doc_rowid, name, path, excerpt FROM documents_search WHERE doc_rowid>? AND doc_rowid<=?
+                """,
+                (last_rowid, row[0]),
+            )
+        count += row[1]
+        last_rowid = row[0]
+    with conn:
+        conn.execute("INSERT INTO documents_fts(documents_fts) VALUES ('optimize')")
+    return count
+
+
+def _fts_query(text: str) -> str:
+    # Each word becomes a quoted term (so '-', ':' and the like are literal);
+    # a trailing * keeps prefix matching. Terms are ANDed.
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def _search_sql(clauses: List[str]) -> str:
+    return f"""
+    SELECT {_REVIEW_COLUMNS},
+           snippet(documents_fts, 2, '[', ']', ' … ', 16) AS snippet,
+           bm25(documents_fts, 10.0, 3.0, 1.0) AS rank
+    FROM documents_fts
+    JOIN documents d ON d.rowid=documents_fts.rowid
+    LEFT JOIN labels l ON l.file_id=d.file_id
+    WHERE documents_fts MATCH ? AND {" AND ".join(clauses)}
+    ORDER BY rank
+    LIMIT ?
+    """
+
+
+def search_documents(text: str, filters: Dict | None = None, limit: int = 50) -> List[Dict]:
+    # BM25-ranked matches (name hits weigh most, then path, then excerpt),
+    # with a highlighted excerpt snippet; the review filters apply as well.
+    query = _fts_query(text)
+    if not query:
+        return []
+    clauses, params = _review_filters(filters or {})
+    conn = _conn()
+    cursor = conn.execute(_search_sql(clauses), (query, *params, limit))
+    columns = [desc[0] for desc in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
+
+
+def _pipeline_queries() -> Dict[str, Tuple[str, Tuple]]:
+    # name -> (sql, sample parameters) for every query the pipeline and the
+    # review app run over the inventory.
+    review_clauses, review_params = _review_filters({"needs_review": 1, "source": "heuristic", "max_confidence": 0.5})
+    return {
+        "extract.pending": (_PENDING_EXTRACTION_SQL, ()),
+        "extract.stale": (_STALE_EXCERPTS_SQL, ("",)),
+        "extract.adopt_hashes": (_ADOPT_HASHES_SQL, ()),
+        "extract.cached_excerpt": (_GET_CACHED_EXCERPT_SQL, ("", "")),
+        "heuristic.work": (_HEURISTIC_WORK_SQL, ()),
+        "heuristic.stale": (_STALE_LABELS_SQL, ("", "heuristic", "", DB_BATCH_SIZE)),
+        "llm.work": (_LLM_WORK_SQL, ()),
+        "llm.stale": (_STALE_LABELS_SQL, ("", "llm", "", DB_BATCH_SIZE)),
+        "sync.work": (_SYNC_WORK_SQL, ()),
+        "export.csv": (_csv_sql(list(CSV_COLUMNS)), ()),
+        "export.snapshot": (_snapshot_sql(False), ()),
+        "review.page": (_review_page_sql(review_clauses), (*review_params, 50)),
+        "review.search": (_search_sql(review_clauses), ('"manual"', *review_params, 50)),
+        "review.excerpt": ("SELECT excerpt FROM excerpts WHERE file_id=?", ("",)),
+    }
+
+
+def explain_queries() -> Dict[str, List[Tuple[int, int, str]]]:
+    # EXPLAIN QUERY PLAN for each pipeline query: (id, parent, detail) rows,
+    # where parent points at the enclosing step (0 for top-level steps).
+    conn = _conn()
+    return {
+        name: [(row[0], row[1], row[3]) for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        for name, (sql, params) in _pipeline_queries().items()
+    }
+
+
+def apply_label_corrections(rows: Iterable[Dict], actor: str = "reviewer:csv",
+                            batch_size: int | None = None) -> Dict[str, int]:
+    # Reviewer corrections: each row is marked human-reviewed, and an audit
+    # row is written per field whose value changed. Columns missing from a
+    # row keep their stored value. One transaction per batch.
+    stats = {"rows": 0, "updated": 0, "unchanged": 0, "missing": 0, "changes": 0}
+    conn = _conn()
+    for chunk in _chunked(rows, batch_size):
+        stats["rows"] += len(chunk)
+        placeholders = ",".join("?" * len(chunk))
+        current = {
+            row[0]: row
+            for row in conn.execute(
+                f"SELECT file_id, {', '.join(LABEL_FIELDS)}, source, needs_review FROM labels WHERE file_id IN ({placeholders})",
+                [row["file_id"] for row in chunk],
+            )
+        }
+        updates, audit = [], []
+        for row in chunk:
+            stored = current.get(row["file_id"])
+            if stored is None:
+                stats["missing"] += 1
+                continue
+            old_values = dict(zip(LABEL_FIELDS, ((value or "") for value in stored[1:-2])))
+            new_values = {field: row.get(field, old_values[field]) or "" for field in LABEL_FIELDS}
+            changed = [field for field in LABEL_FIELDS if new_values[field] != old_values[field]]
+            if not changed and stored[-2] == "human" and stored[-1] == 0:
+                stats["unchanged"] += 1
+                continue
+            updates.append((*(new_values[field] for field in LABEL_FIELDS), row["file_id"]))
+            audit.extend((row["file_id"], field, old_values[field], new_values[field], actor) for field in changed)
+            stats["updated"] += 1
+            stats["changes"] += len(changed)
+        with timed("db.write.corrections"), conn:
+            conn.executemany(
+                f"""
+                UPDATE labels
+                SET {", ".join(f"{field}=?" for field in LABEL_FIELDS)}, source='human', needs_review=0
+                WHERE file_id=?
+                """,
+                updates,
+            )
+            conn.executemany(
+                "INSERT INTO audit(file_id,field,old_value,new_value,actor) VALUES (?,?,?,?,?)",
+                audit,
+            )
+    return stats
+
+
+def update_from_csv_row(row: Dict, actor: str = "reviewer:app"):
+    apply_label_corrections([row], actor=actor)
+
+
+def record_run(command: str, started_at: str, seconds: float, status: str, metrics: Dict) -> int:
+    conn = _conn()
+    with conn:
+        cursor = conn.execute(
+            "INSERT INTO runs(command,started_at,seconds,status,metrics) VALUES (?,?,?,?,?)",
+            (command, started_at, seconds, status, json.dumps(metrics)),
         )
+    return cursor.lastrowid
+
+
+def get_run(run_id: int | None = None) -> Dict | None:
+    # The given run, or the latest one.
+    conn = _conn()
+    query = "SELECT id, command, started_at, seconds, status, metrics FROM runs"
+    if run_id is None:
+        row = conn.execute(f"{query} ORDER BY id DESC LIMIT 1").fetchone()
+    else:
+        row = conn.execute(f"{query} WHERE id=?", (run_id,)).fetchone()
+    if not row:
+        return None
+    return dict(id=row[0], command=row[1], started_at=row[2], seconds=row[3], status=row[4],
+                metrics=json.loads(row[5] or "{}"))
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Tuple
+from urllib.parse import quote
+
+try:
+    import pyarrow as pa  # optional: pip install pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from src.db import LABEL_FIELDS, SNAPSHOT_COLUMNS, iter_for_snapshot, mark_exported_many
+
+PARQUET_ROW_GROUP_ROWS = int(os.getenv("PARQUET_ROW_GROUP_ROWS", "20000"))
+PARTITION_COLUMNS = ("doc_type", "top_folder")
+
+# Low-cardinality text columns are dictionary-encoded.
+_DICTIONARY_COLUMNS = ("top_folder", "suffix", "source", *LABEL_FIELDS)
+_TYPES = {"size": "int64", "confidence": "float64", "needs_review": "bool"}
+
+
+def _schema() -> "pa.Schema":
+    fields = []
+    for column in SNAPSHOT_COLUMNS:
+        if column in _DICTIONARY_COLUMNS:
+            fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append(pa.field(column, pa.type_for_alias(_TYPES.get(column, "string"))))
+    return pa.schema(fields)
+
+
+def _row_hash(row: Tuple) -> str:
+    return hashlib.sha256(json.dumps(row, default=str).encode("utf-8")).hexdigest()
+
+
+def _arrays(schema: "pa.Schema", columns: List[List]) -> List["pa.Array"]:
+    arrays = []
+    for field, values in zip(schema, columns):
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+        elif pa.types.is_boolean(field.type):
+            arrays.append(pa.array([None if value is None else bool(value) for value in values], type=field.type))
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return arrays
+
+
+def _partition_dir(column: str, value) -> str:
+    return f"{column}={quote(str(value), safe='') if value is not None else '__HIVE_DEFAULT_PARTITION__'}"
+
+
+class _PartitionWriter:
+    # One Parquet file per partition, written from the calling thread (the
+    # SQLite connection is per thread). Rows are buffered per partition and
+    # written a row group at a time; when the buffers together exceed a few
+    # row groups the largest is written early, bounding memory.
+    def __init__(self, target: Path, schema: "pa.Schema", partition_by: str | None):
+        self.target = target
+        self.partition_by = partition_by
+        self.partition_index = SNAPSHOT_COLUMNS.index(partition_by) if partition_by else None
+        self.schema = schema.remove(self.partition_index) if partition_by else schema
+        self.buffers: Dict = {}
+        self.writers: Dict = {}
+        self.buffered = 0
+
+    def add(self, values: Tuple) -> None:
+        key = values[self.partition_index] if self.partition_by else None
+        if self.partition_by:
+            values = values[:self.partition_index] + values[self.partition_index + 1:]
+        self.buffers.setdefault(key, []).append(values)
+        self.buffered += 1
+        if len(self.buffers[key]) >= PARQUET_ROW_GROUP_ROWS:
+            self._write(key)
+        elif self.buffered >= 4 * PARQUET_ROW_GROUP_ROWS:
+            self._write(max(self.buffers, key=lambda candidate: len(self.buffers[candidate])))
+
+    def _write(self, key) -> None:
+        rows = self.buffers.pop(key)
+        self.buffered -= len(rows)
+        if key not in self.writers:
+            directory = self.target / _partition_dir(self.partition_by, key) if self.partition_by else self.target
+            directory.mkdir(parents=True, exist_ok=True)
+            self.writers[key] = pq.ParquetWriter(directory / "part-0.parquet", self.schema, compression="zstd")
+        columns = [list(column) for column in zip(*rows)]
+        self.writers[key].write_table(pa.Table.from_arrays(_arrays(self.schema, columns), schema=self.schema))
+
+    def close(self) -> None:
+        for key in list(self.buffers):
+            self._write(key)
+        for writer in self.writers.values():
+            writer.close()
+
+
+def export_parquet(out_dir: str, partition_by: str | None = "doc_type", incremental: bool = False) -> Dict:
+    # Writes out_dir/snapshot=<UTC time>/ as a hive-partitioned Parquet
+    # dataset, streamed from SQLite. Incremental snapshots hold only rows
+    # added or changed since the previous snapshot, tombstoned files
+    # included (deleted_at is set).
+    if pa is None:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow).")
+    if partition_by and partition_by not in PARTITION_COLUMNS:
+        raise ValueError(f"Partition column must be one of {', '.join(PARTITION_COLUMNS)}")
+    snapshot = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    target = Path(out_dir) / f"snapshot={snapshot}"
+    if target.exists():
+        raise FileExistsError(f"{target} already exists")
+    target.mkdir(parents=True)
+    width = len(SNAPSHOT_COLUMNS)
+    exported: List[Tuple[str, str, str]] = []
+    stats = {"snapshot": snapshot, "path": str(target), "rows": 0, "written": 0}
+
+    writer = _PartitionWriter(target, _schema(), partition_by)
+    try:
+        for row in iter_for_snapshot(include_deleted=incremental):
+            stats["rows"] += 1
+            values = tuple(value if value != "" else None for value in row[:width])
+            row_hash = _row_hash(values)
+            if incremental and row_hash == row[width]:
+                continue
+            exported.append((values[0], row_hash, snapshot))
+            writer.add(values)
+    finally:
+        writer.close()
+    stats["written"] = len(exported)
+    # Only recorded once the dataset is fully written, so a failed export
+    # is simply repeated by the next run.
+    mark_exported_many(exported)
+    (target / "_snapshot.json").write_text(json.dumps(
+        {"snapshot": snapshot, "mode": "incremental" if incremental else "full",
+         "partition_by": partition_by, "rows": stats["written"]},
+        indent=2,
+    ))
+    return stats
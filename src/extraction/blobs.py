@@ -0,0 +1,85 @@
+import contextlib
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Set, Tuple
+
+# Downloaded files are kept here by sha256 so re-extraction (after a parser
+# or settings change) does not download them again. 0 MB disables the cache.
+EXTRACT_BLOB_CACHE_DIR = os.getenv("EXTRACT_BLOB_CACHE_DIR", "data/blobs")
+EXTRACT_BLOB_CACHE_MB = int(os.getenv("EXTRACT_BLOB_CACHE_MB", "2048"))
+
+
+class BlobCache:
+    # Content-addressed store bounded to max_bytes, evicting the least
+    # recently used blob first. A blob's mtime is its last use; pinned blobs
+    # (being parsed) are never evicted.
+    def __init__(self, root: str = EXTRACT_BLOB_CACHE_DIR, max_bytes: int = EXTRACT_BLOB_CACHE_MB * 1024 * 1024):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._blobs: Dict[str, Tuple[float, int]] = {}  # sha256 -> (last used, size)
+        self._pinned: Set[str] = set()
+        self._bytes = 0
+        if self.enabled:
+            self.root.mkdir(parents=True, exist_ok=True)
+            for path in self.root.glob("??/*"):
+                with contextlib.suppress(OSError):
+                    stat = path.stat()
+                    self._blobs[path.name] = (stat.st_mtime, stat.st_size)
+                    self._bytes += stat.st_size
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256
+
+    def get(self, sha256: str) -> str | None:
+        # Returns the blob's path, pinned until release(sha256).
+        with self._lock:
+            if sha256 not in self._blobs:
+                return None
+            path = self._path(sha256)
+            now = time.time()
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                self._bytes -= self._blobs.pop(sha256)[1]
+                return None
+            self._blobs[sha256] = (now, self._blobs[sha256][1])
+            self._pinned.add(sha256)
+            return str(path)
+
+    def release(self, sha256: str) -> None:
+        with self._lock:
+            self._pinned.discard(sha256)
+
+    def put(self, sha256: str, path: str) -> None:
+        # Moves the file at path into the cache (or deletes it when it does
+        # not fit), then evicts down to max_bytes.
+        size = os.path.getsize(path)
+        with self._lock:
+            if not self.enabled or size > self.max_bytes or sha256 in self._blobs:
+                os.remove(path)
+                return
+            target = self._path(sha256)
+            target.parent.mkdir(exist_ok=True)
+            shutil.move(path, target)
+            self._blobs[sha256] = (time.time(), size)
+            self._bytes += size
+            for victim in sorted(self._blobs, key=lambda key: self._blobs[key][0]):
+                if self._bytes <= self.max_bytes:
+                    break
+                if victim in self._pinned:
+                    continue
+                with contextlib.suppress(OSError):
+                    os.remove(self._path(victim))
+                self._bytes -= self._blobs.pop(victim)[1]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"blobs": len(self._blobs), "bytes": self._bytes}
@@ -1,71 +1,333 @@
+import contextlib
 import hashlib
-import io
+import json
+import logging
+import multiprocessing
 import os
+import signal
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Tuple
 
 import pandas as pd
 from docx import Document
-from pdfminer.high_level import extract_text as pdf_extract_text
+from tqdm import tqdm
 
 try:
     from pptx import Presentation  # optional: pip install python-pptx
 except ImportError:
     Presentation = None
 
-from src.db import iter_documents_without_excerpt, store_excerpt
-from src.workdrive.api import download_file_bytes
+from src.db import (adopt_fingerprint_hashes, get_cached_excerpt, iter_documents_without_excerpt,
+                    iter_stale_excerpts, store_excerpts)
+from src.extraction.blobs import BlobCache
+from src.extraction.pdf import EXCERPT_PDF_SAMPLE_PAGES, BudgetExceeded, pdf_text
+from src.extraction.pdf import backend as pdf_backend
+from src.metrics import increment, observe
+from src.workdrive.api import DownloadTooLarge, download_to_file
 
+# Bump when a parser change should invalidate cached excerpts.
+PARSER_VERSION = "2"
 EXCERPT_MAX = int(os.getenv("EXCERPT_MAX_CHARS", "15000"))
 EXCERPT_PDF_MAX_PAGES = int(os.getenv("EXCERPT_PDF_MAX_PAGES", "0"))
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "0")) or (os.cpu_count() or 1)
+EXTRACT_DOWNLOAD_CONCURRENCY = int(os.getenv("EXTRACT_DOWNLOAD_CONCURRENCY", "8"))
+# Downloads are spooled here and removed once parsed.
+EXTRACT_SPOOL_DIR = os.getenv("EXTRACT_SPOOL_DIR") or None
+EXTRACTABLE_SUFFIXES = (".pdf", ".docx", ".xlsx", ".xls", ".pptx")
+# Per-suffix caps override the default, e.g. EXCERPT_MAX_BYTES_PDF=524288000.
+EXCERPT_MAX_BYTES = int(os.getenv("EXCERPT_MAX_BYTES", str(200 * 1024 * 1024)))
+# CPU seconds one file may take to parse; 0 = no limit.
+EXTRACT_CPU_SECONDS = float(os.getenv("EXTRACT_CPU_SECONDS", "60"))
 
-def _extract_content(data: bytes, suffix: str) -> str:
-    buffer = io.BytesIO(data)
-    extension = (suffix or "").lower()
+
+def _fingerprint() -> str:
+    # Everything that changes what an excerpt contains. Excerpts stored under
+    # another fingerprint are stale and redone by `extract --reextract`.
+    settings = {
+        "parser": PARSER_VERSION,
+        "max_chars": EXCERPT_MAX,
+        "pdf_max_pages": EXCERPT_PDF_MAX_PAGES,
+        "pdf_sample_pages": EXCERPT_PDF_SAMPLE_PAGES,
+        "pdf_backend": pdf_backend(),
+        "pptx": Presentation is not None,
+    }
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"{PARSER_VERSION}-{digest[:12]}"
+
+
+EXTRACTOR_VERSION = _fingerprint()
+
+log = logging.getLogger(__name__)
+
+
+def _max_bytes(suffix: str) -> int:
+    override = os.getenv(f"EXCERPT_MAX_BYTES_{(suffix or '').lstrip('.').upper()}")
+    return int(override) if override else EXCERPT_MAX_BYTES
+
+
+def _parse(buffer: BinaryIO, extension: str) -> Tuple[str, str]:
+    # Returns (excerpt, strategy); the strategy names what produced it.
+    if extension == ".pdf":
+        return pdf_text(buffer, EXCERPT_MAX, EXCERPT_PDF_MAX_PAGES)
+
+    if extension == ".docx":
+        document = Document(buffer)
+        text = "\n".join(p.text for p in document.paragraphs)
+        return text[:EXCERPT_MAX], "docx"
+
+    if extension == ".xlsx":
+        df = pd.read_excel(buffer, sheet_name=0, nrows=20, engine="openpyxl")
+        return df.to_csv(sep=" ", index=False)[:EXCERPT_MAX], "xlsx"
+
+    if extension == ".xls":
+        # Requires a reader that supports xls; install xlrd==1.2.0 or a compatible engine
+        df = pd.read_excel(buffer, sheet_name=0, nrows=20)
+        return df.to_csv(sep=" ", index=False)[:EXCERPT_MAX], "xls"
+
+    if extension == ".pptx":
+        if Presentation is None:
+            return "", "pptx-unavailable"
+        presentation = Presentation(buffer)
+        text_runs = []
+        for slide in presentation.slides:
+            for shape in getattr(slide, "shapes", []):
+                text = getattr(shape, "text", "")
+                if text:
+                    text_runs.append(text)
+        return "\n".join(text_runs)[:EXCERPT_MAX], "pptx"
+
+    # (optional) else: unknown extension -> empty
+    return "", "none"
+
+
+@contextlib.contextmanager
+def _cpu_budget(seconds: float):
+    # SIGPROF fires once this process has used `seconds` more CPU time and
+    # raises BudgetExceeded inside the parser, aborting it without taking
+    # the worker process down. Code stuck in a C extension is only
+    # interrupted once it returns to Python.
+    if seconds <= 0 or not hasattr(signal, "setitimer"):
+        yield
+        return
+
+    def expire(signum, frame):
+        raise BudgetExceeded(f"parser used more than {seconds}s of CPU")
+
+    previous = signal.signal(signal.SIGPROF, expire)
+    signal.setitimer(signal.ITIMER_PROF, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, previous)
+
+
+def _extract_file(path: str, suffix: str) -> Tuple[str, str, float, bool]:
+    # Runs in a parser process, so it reports its own timing (and whether
+    # the parser failed) back with the excerpt for the parent's metrics.
+    started = time.perf_counter()
+    failed = False
+    with open(path, "rb") as handle:
+        try:
+            with _cpu_budget(EXTRACT_CPU_SECONDS):
+                excerpt, strategy = _parse(handle, (suffix or "").lower())
+        except BudgetExceeded:
+            excerpt, strategy, failed = "", "timeout", True
+        except Exception:
+            excerpt, strategy, failed = "", "failed", True  # swallow parse errors per your design
+    return excerpt, strategy, time.perf_counter() - started, failed
+
+
+def _discard(path: str) -> None:
+    with contextlib.suppress(OSError):
+        os.remove(path)
+
+
+def _download(rid: str, suffix: str) -> Tuple[str, str]:
+    # Returns (spool path, sha256); the caller owns and removes the file.
+    handle = tempfile.NamedTemporaryFile(dir=EXTRACT_SPOOL_DIR, suffix=suffix, delete=False)
     try:
-        if extension == ".pdf":
-            pdf_kwargs = {}
-            if EXCERPT_PDF_MAX_PAGES > 0:
-                pdf_kwargs["maxpages"] = EXCERPT_PDF_MAX_PAGES
-            text = pdf_extract_text(buffer, **pdf_kwargs) or ""
-            return text[:EXCERPT_MAX]
-
-        if extension == ".docx":
-            document = Document(buffer)
-            text = "\n".join(p.text for p in document.paragraphs)
-            return text[:EXCERPT_MAX]
-
-        if extension == ".xlsx":
-            df = pd.read_excel(buffer, sheet_name=0, nrows=20, engine="openpyxl")
-            return df.to_csv(sep=" ", index=False)[:EXCERPT_MAX]
-
-        if extension == ".xls":
-            # Requires a reader that supports xls; install xlrd==1.2.0 or a compatible engine
-            df = pd.read_excel(buffer, sheet_name=0, nrows=20)
-            return df.to_csv(sep=" ", index=False)[:EXCERPT_MAX]
-
-        if extension == ".pptx":
-            if Presentation is None:
-                return ""
-            presentation = Presentation(buffer)
-            text_runs = []
-            for slide in presentation.slides:
-                for shape in getattr(slide, "shapes", []):
-                    text = getattr(shape, "text", "")
-                    if text:
-                        text_runs.append(text)
-            return "\n".join(text_runs)[:EXCERPT_MAX]
-
-        # (optional) else: unknown extension -> empty
-    except Exception:
-        return ""  # swallow parse errors per your design
-
-    return ""
-
-def run_extraction() -> None:
-    for document in iter_documents_without_excerpt():
-        # IMPORTANT: pass the correct id that your download function expects
-        rid = document.get("resource_id") or document.get("file_id")
-        content = download_file_bytes(rid)
-        excerpt = _extract_content(content, document.get("suffix", ".pdf"))
-        sha256 = hashlib.sha256(content).hexdigest()
-        store_excerpt(rid, excerpt, sha256)
+        with handle:
+            sha256 = download_to_file(rid, handle, max_bytes=_max_bytes(suffix))
+    except BaseException:
+        _discard(handle.name)
+        raise
+    return handle.name, sha256
+
+
+def _skip_reason(document: Dict) -> str | None:
+    suffix = (document.get("suffix") or "").lower()
+    if suffix not in EXTRACTABLE_SUFFIXES:
+        return f"no extractor for {suffix or 'files without a suffix'}"
+    size = int(document.get("size") or 0)
+    if size > _max_bytes(suffix):
+        return f"{size} bytes exceeds the {suffix} cap"
+    return None
+
+
+def _pipeline(documents: Iterable[Dict], downloads: ThreadPoolExecutor, parsers: ProcessPoolExecutor,
+              max_in_flight: int, blobs: BlobCache) -> Iterator[Tuple[str, str, str]]:
+    # Downloads run on threads, parsing on processes; results come back to
+    # the calling thread, which is the only DB writer. At most max_in_flight
+    # documents are downloaded-but-unwritten at any time, bounding memory.
+    # Content already in content_cache (by known or downloaded sha256) is
+    # never parsed again, and copies downloaded in the same run share one parse.
+    # Files are streamed to a spool file, so memory does not grow with file
+    # size; suffixes without an extractor and oversized files are never fetched.
+    # Parsed downloads move into the blob cache, and documents whose sha256
+    # is known are parsed from there instead of being downloaded again.
+    documents = iter(documents)
+    ready: List[Tuple[str, str, str | None, str]] = []  # file_id, excerpt, sha256, strategy
+    downloading: Dict[Future, Tuple[str, str]] = {}
+    parsing: Dict[Future, Tuple[str, str, List[str], str, bool]] = {}  # path, sha256, rids, suffix, cached
+    parsing_by_sha: Dict[str, Future] = {}
+
+    def parse(path: str, sha256: str, rid: str, suffix: str, cached: bool) -> None:
+        future = parsers.submit(_extract_file, path, suffix)
+        parsing[future] = (path, sha256, [rid], suffix, cached)
+        parsing_by_sha[sha256] = future
+
+    def keep(sha256: str, path: str) -> None:
+        try:
+            blobs.put(sha256, path)
+        except OSError as exc:
+            log.warning("could not cache %s: %s", sha256, exc)
+            _discard(path)
+
+    def fill() -> None:
+        while not ready and len(downloading) + len(parsing) < max_in_flight:
+            document = next(documents, None)
+            if document is None:
+                return
+            # IMPORTANT: pass the correct id that your download function expects
+            rid = document.get("resource_id") or document.get("file_id")
+            reason = _skip_reason(document)
+            if reason:
+                log.info("skipping %s: %s", rid, reason)
+                increment("extract.skipped")
+                ready.append((rid, "", None, "skipped"))
+                continue
+            sha256 = document.get("sha256")
+            cached = get_cached_excerpt(sha256, EXTRACTOR_VERSION) if sha256 else None
+            if cached is not None:
+                increment("extract.cache_hits")
+                ready.append((rid, cached[0], sha256, cached[1]))
+                continue
+            suffix = document.get("suffix") or ".pdf"
+            if sha256 in parsing_by_sha:
+                parsing[parsing_by_sha[sha256]][2].append(rid)
+                continue
+            path = blobs.get(sha256) if sha256 else None
+            if path is not None:
+                increment("extract.blob_hits")
+                parse(path, sha256, rid, suffix, cached=True)
+                continue
+            downloading[downloads.submit(_download, rid, suffix)] = (rid, suffix)
+
+    try:
+        while True:
+            while ready:
+                yield ready.pop()
+            fill()
+            if ready:
+                continue
+            if not downloading and not parsing:
+                return
+            done, _ = wait([*downloading, *parsing], return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in downloading:
+                    rid, suffix = downloading.pop(future)
+                    try:
+                        path, sha256 = future.result()
+                    except DownloadTooLarge as exc:
+                        log.info("skipping %s: %s", rid, exc)
+                        ready.append((rid, "", None, "skipped"))
+                        continue
+                    except Exception as exc:
+                        log.warning("download failed for %s: %s", rid, exc)
+                        continue
+                    if sha256 in parsing_by_sha:
+                        parsing[parsing_by_sha[sha256]][2].append(rid)
+                        _discard(path)
+                        continue
+                    cached = get_cached_excerpt(sha256, EXTRACTOR_VERSION)
+                    if cached is not None:
+                        increment("extract.cache_hits")
+                        ready.append((rid, cached[0], sha256, cached[1]))
+                        keep(sha256, path)
+                        continue
+                    parse(path, sha256, rid, suffix, cached=False)
+                else:
+                    path, sha256, rids, suffix, cached = parsing.pop(future)
+                    del parsing_by_sha[sha256]
+                    nbytes = 0
+                    with contextlib.suppress(OSError):
+                        nbytes = os.path.getsize(path)
+                    if cached:
+                        blobs.release(sha256)
+                    else:
+                        # Kept even when parsing failed: a fixed parser can
+                        # then re-extract it without a download.
+                        keep(sha256, path)
+                    try:
+                        excerpt, strategy, seconds, failed = future.result()
+                    except Exception as exc:  # e.g. a parser process died
+                        log.warning("extraction failed for %s: %s", ", ".join(rids), exc)
+                        excerpt, strategy, seconds, failed = "", "failed", 0.0, True
+                    observe(f"extract.parse{suffix.lower()}", seconds, nbytes, error=failed)
+                    if "timeout" in strategy:
+                        log.warning("%s hit the %ss parse budget (%s)", ", ".join(rids), EXTRACT_CPU_SECONDS, strategy)
+                        increment("extract.timeouts")
+                    ready.extend((rid, excerpt, sha256, strategy) for rid in rids)
+    finally:
+        # Abandoned run: drop the spool files of documents still in flight.
+        for future in downloading:
+            future.cancel()
+        for future in downloading:
+            if not future.cancelled() and future.exception() is None:
+                _discard(future.result()[0])
+        for path, sha256, _, _, cached in parsing.values():
+            if cached:
+                blobs.release(sha256)
+            else:
+                _discard(path)
+
+
+@contextlib.contextmanager
+def extractor(workers: int | None = None, download_concurrency: int | None = None):
+    # Yields extract(documents) -> count, which downloads, parses and stores
+    # the given documents; the pools stay up across calls, so a pipelined run
+    # can feed it batch after batch.
+    workers = workers or EXTRACT_WORKERS
+    download_concurrency = download_concurrency or EXTRACT_DOWNLOAD_CONCURRENCY
+    blobs = BlobCache()
+    # "spawn" keeps parser processes from forking a parent that already runs
+    # download threads.
+    with ThreadPoolExecutor(download_concurrency, thread_name_prefix="download") as downloads, \
+            ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as parsers:
+
+        def extract(documents: Iterable[Dict]) -> int:
+            adopt_fingerprint_hashes()
+            results = _pipeline(
+                documents,
+                downloads,
+                parsers,
+                max_in_flight=2 * (download_concurrency + workers),
+                blobs=blobs,
+            )
+            return store_excerpts(tqdm(results, desc="Extracting", unit="file"), parser_version=EXTRACTOR_VERSION)
+
+        yield extract
+
 
+def run_extraction(workers: int | None = None, download_concurrency: int | None = None,
+                   reextract: bool = False) -> int:
+    # reextract redoes rows whose excerpt came from another extractor
+    # version or settings (see _fingerprint), parsing cached blobs where
+    # it can; otherwise only rows without an excerpt are extracted.
+    with extractor(workers, download_concurrency) as extract:
+        if reextract:
+            return extract(iter_stale_excerpts(EXTRACTOR_VERSION))
+        return extract(iter_documents_without_excerpt())
@@ -0,0 +1,123 @@
+import os
+from typing import BinaryIO, Iterable, Iterator, List, Tuple
+
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LTTextContainer
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import resolve1
+
+try:
+    import pypdfium2 as pdfium  # optional fast text-layer backend: pip install pypdfium2
+except ImportError:
+    pdfium = None
+
+# PDFs with more pages are read on a sample: the first pages, a few from the
+# middle and the last ones. 0 reads every page (until the excerpt is full).
+EXCERPT_PDF_SAMPLE_PAGES = int(os.getenv("EXCERPT_PDF_SAMPLE_PAGES", "24"))
+# auto = pdfium when installed, else pdfminer.
+EXCERPT_PDF_BACKEND = os.getenv("EXCERPT_PDF_BACKEND", "auto")
+
+
+class BudgetExceeded(BaseException):
+    # Raised inside a parser when its CPU budget runs out. A BaseException,
+    # so parser code catching Exception cannot swallow it.
+    pass
+
+
+def backend() -> str:
+    if EXCERPT_PDF_BACKEND == "pdfminer" or pdfium is None:
+        return "pdfminer"
+    return "pdfium"
+
+
+def _pages(count: int, max_pages: int) -> Tuple[List[int], bool]:
+    # Page indexes to read, in order, and whether they are a sample.
+    if max_pages > 0:
+        count = min(count, max_pages)
+    budget = EXCERPT_PDF_SAMPLE_PAGES
+    if budget <= 0 or count <= budget:
+        return list(range(count)), False
+    tail = max(budget // 4, 1)
+    middle = (count - tail) // 2
+    head = list(range(budget - 2 * tail))
+    return list(dict.fromkeys([*head, *range(middle, middle + tail), *range(count - tail, count)])), True
+
+
+def _collect(texts: Iterable[str], max_chars: int) -> Tuple[str, bool]:
+    # Joins page texts until max_chars are in, so the remaining pages are
+    # never parsed. When the CPU budget runs out, what was read so far is
+    # kept; the flag says so.
+    parts: List[str] = []
+    size = 0
+    try:
+        for text in texts:
+            parts.append(text)
+            size += len(text)
+            if size >= max_chars:
+                break
+    except BudgetExceeded:
+        return "".join(parts)[:max_chars], True
+    return "".join(parts)[:max_chars], False
+
+
+def _strategy(name: str, sampled: bool, timed_out: bool) -> str:
+    return "+".join([name, *(["sampled"] if sampled else []), *(["timeout"] if timed_out else [])])
+
+
+def _pdfium_texts(document, indexes: List[int]) -> Iterator[str]:
+    for index in indexes:
+        page = document[index]
+        textpage = page.get_textpage()
+        try:
+            yield textpage.get_text_range() + "\n"
+        finally:
+            textpage.close()
+            page.close()
+
+
+def _read_pdfium(buffer: BinaryIO, max_chars: int, max_pages: int) -> Tuple[str, str]:
+    document = pdfium.PdfDocument(buffer)
+    try:
+        indexes, sampled = _pages(len(document), max_pages)
+        text, timed_out = _collect(_pdfium_texts(document, indexes), max_chars)
+    finally:
+        document.close()
+    return text, _strategy("pdfium", sampled, timed_out)
+
+
+def _page_count(buffer: BinaryIO) -> int | None:
+    try:
+        return int(resolve1(PDFDocument(PDFParser(buffer)).catalog["Pages"])["Count"])
+    except Exception:
+        return None
+    finally:
+        buffer.seek(0)
+
+
+def _pdfminer_texts(buffer: BinaryIO, indexes: List[int] | None, max_pages: int) -> Iterator[str]:
+    # extract_pages lays out one page at a time and skips pages not asked for.
+    for layout in extract_pages(buffer, page_numbers=indexes, maxpages=max_pages):
+        yield "".join(element.get_text() for element in layout if isinstance(element, LTTextContainer)) + "\n"
+
+
+def _read_pdfminer(buffer: BinaryIO, max_chars: int, max_pages: int) -> Tuple[str, str]:
+    count = _page_count(buffer)
+    # Without a page count (a damaged page tree) pages are read in order.
+    indexes, sampled = _pages(count, max_pages) if count is not None else (None, False)
+    text, timed_out = _collect(_pdfminer_texts(buffer, indexes, max_pages), max_chars)
+    return text, _strategy("pdfminer", sampled, timed_out)
+
+
+def pdf_text(buffer: BinaryIO, max_chars: int, max_pages: int = 0) -> Tuple[str, str]:
+    # Returns (text, strategy), e.g. "pdfium" or "pdfminer+sampled+timeout".
+    # pdfium reads the text layer directly and is much faster; a file it
+    # cannot open falls back to pdfminer.
+    if backend() == "pdfium":
+        try:
+            return _read_pdfium(buffer, max_chars, max_pages)
+        except BudgetExceeded:
+            raise
+        except Exception:
+            buffer.seek(0)
+    return _read_pdfminer(buffer, max_chars, max_pages)
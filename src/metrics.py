@@ -0,0 +1,117 @@
+import contextlib
+import threading
+import time
+from typing import Dict, Iterator
+
+# Upper bounds (seconds) of the latency histogram buckets; the last is +Inf.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_timers: Dict[str, Dict] = {}
+_counters: Dict[str, float] = {}
+
+
+def observe(name: str, seconds: float, nbytes: int = 0, error: bool = False) -> None:
+    # Records one timed operation (an API call, a parse, a DB batch, ...).
+    with _lock:
+        timer = _timers.get(name)
+        if timer is None:
+            timer = _timers[name] = {
+                "count": 0, "errors": 0, "seconds": 0.0, "bytes": 0,
+                "buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+            }
+        timer["count"] += 1
+        timer["errors"] += int(error)
+        timer["seconds"] += seconds
+        timer["bytes"] += nbytes
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                timer["buckets"][index] += 1
+                break
+        else:
+            timer["buckets"][-1] += 1
+
+
+def increment(name: str, amount: float = 1) -> None:
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+@contextlib.contextmanager
+def timed(name: str, started: float | None = None) -> Iterator[Dict]:
+    # Times the block; an exception counts as an error and propagates. The
+    # block may set sample["bytes"]. `started` (a perf_counter() reading)
+    # times from an earlier point instead of from entering the block.
+    sample = {"bytes": 0}
+    started = time.perf_counter() if started is None else started
+    try:
+        yield sample
+    except BaseException:
+        observe(name, time.perf_counter() - started, sample["bytes"], error=True)
+        raise
+    observe(name, time.perf_counter() - started, sample["bytes"])
+
+
+def snapshot() -> Dict:
+    with _lock:
+        return {
+            "timers": {name: {**timer, "buckets": list(timer["buckets"])} for name, timer in sorted(_timers.items())},
+            "counters": dict(sorted(_counters.items())),
+            "buckets": list(LATENCY_BUCKETS),
+        }
+
+
+def quantile(timer: Dict, q: float, bounds=LATENCY_BUCKETS) -> float:
+    # Estimated from the histogram like Prometheus' histogram_quantile:
+    # linear within the bucket holding the q-th observation; anything in
+    # the +Inf bucket reports the largest finite bound.
+    target = q * timer["count"]
+    seen = 0
+    for index, count in enumerate(timer["buckets"]):
+        if count and seen + count >= target:
+            if index >= len(bounds):
+                return bounds[-1]
+            lower = bounds[index - 1] if index else 0.0
+            return lower + (bounds[index] - lower) * (target - seen) / count
+        seen += count
+    return 0.0
+
+
+def reset() -> None:
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def to_prometheus(metrics: Dict, prefix: str = "workdrive") -> str:
+    # Prometheus text exposition format for a snapshot() dict.
+    lines = [f"# TYPE {prefix}_operation_seconds histogram"]
+    bounds = [*(str(bound) for bound in metrics["buckets"]), "+Inf"]
+    for name, timer in metrics["timers"].items():
+        op = _label(name)
+        cumulative = 0
+        for bound, count in zip(bounds, timer["buckets"]):
+            cumulative += count
+            lines.append(f'{prefix}_operation_seconds_bucket{{op="{op}",le="{bound}"}} {cumulative}')
+        lines.append(f'{prefix}_operation_seconds_sum{{op="{op}"}} {timer["seconds"]:.6f}')
+        lines.append(f'{prefix}_operation_seconds_count{{op="{op}"}} {timer["count"]}')
+    lines.append(f"# TYPE {prefix}_operation_errors_total counter")
+    lines.extend(
+        f'{prefix}_operation_errors_total{{op="{_label(name)}"}} {timer["errors"]}'
+        for name, timer in metrics["timers"].items()
+    )
+    lines.append(f"# TYPE {prefix}_operation_bytes_total counter")
+    lines.extend(
+        f'{prefix}_operation_bytes_total{{op="{_label(name)}"}} {timer["bytes"]}'
+        for name, timer in metrics["timers"].items()
+    )
+    lines.append(f"# TYPE {prefix}_events_total counter")
+    lines.extend(
+        f'{prefix}_events_total{{event="{_label(name)}"}} {value}'
+        for name, value in metrics["counters"].items()
+    )
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,149 @@
+import itertools
+import logging
+import os
+import threading
+from contextlib import closing
+from typing import Callable, Dict, Iterable, Iterator, List
+
+from src.classify.heuristic import run_heuristics
+from src.classify.llm import run_llm_pass
+from src.db import close_conn, iter_documents_for_heuristics, iter_documents_without_excerpt, iter_needs_llm
+from src.extraction.extract import extractor
+from src.metrics import timed
+from src.utils import write_csv
+from src.workdrive.inventory import crawl_incremental
+
+# How long an idle stage waits before looking for new upstream output.
+PIPELINE_POLL_SECONDS = float(os.getenv("PIPELINE_POLL_SECONDS", "2"))
+STAGES = ("crawl", "extract", "heuristic", "llm", "export")
+_STAGE_GROUPS = {"all": STAGES, "classify": ("heuristic", "llm")}
+
+log = logging.getLogger(__name__)
+
+
+def parse_stages(spec: str) -> List[str]:
+    selected = set()
+    for name in (part.strip() for part in spec.split(",")):
+        if name in _STAGE_GROUPS:
+            selected.update(_STAGE_GROUPS[name])
+        elif name in STAGES:
+            selected.add(name)
+        else:
+            raise ValueError(f"Unknown stage {name!r}; use all, classify or any of {', '.join(STAGES)}")
+    return [stage for stage in STAGES if stage in selected]
+
+
+class _Stage(threading.Thread):
+    # Runs one stage body on its own thread (and so its own SQLite
+    # connection); done is set however the body ends.
+    def __init__(self, name: str, body: Callable[[], Dict], stop: threading.Event):
+        super().__init__(name=f"pipeline-{name}", daemon=True)
+        self.stage = name
+        self.body = body
+        self.stop = stop
+        self.done = threading.Event()
+        self.result: Dict = {}
+        self.error: BaseException | None = None
+
+    def run(self) -> None:
+        try:
+            with timed(f"stage.{self.stage}"):
+                self.result = self.body()
+        except BaseException as exc:
+            log.exception("%s failed", self.name)
+            self.error = exc
+            self.stop.set()
+        finally:
+            close_conn()
+            self.done.set()
+
+
+def _fresh(documents: Iterator[Dict], seen: set, stop: threading.Event) -> Iterator[Dict]:
+    # Closing this closes `documents` too, ending its cursor (and the
+    # transaction it runs in on the thread's shared connection) right away.
+    with closing(documents):
+        for document in documents:
+            if stop.is_set():
+                return
+            if document["file_id"] in seen:
+                continue
+            seen.add(document["file_id"])
+            yield document
+
+
+def _passes(fetch: Callable[[], Iterator[Dict]], run_pass: Callable[[Iterable[Dict]], object],
+            upstream: threading.Event | None, stop: threading.Event) -> Dict:
+    # The database is the queue between stages: each pass hands run_pass the
+    # documents upstream has produced so far that this stage has not taken
+    # yet. Documents are taken once per run, so files that fail or are
+    # skipped are not retried until the next run. The stage ends once
+    # upstream is done and a pass finds nothing new.
+    seen: set = set()
+    passes = 0
+    while not stop.is_set():
+        upstream_done = upstream is None or upstream.is_set()
+        # Each pass's cursor is closed before the next poll opens another.
+        with closing(_fresh(fetch(), seen, stop)) as documents:
+            first = next(documents, None)
+            if first is not None:
+                passes += 1
+                run_pass(itertools.chain([first], documents))
+                continue
+        if upstream_done:
+            break
+        upstream.wait(PIPELINE_POLL_SECONDS)
+    return {"documents": len(seen), "passes": passes}
+
+
+def run_pipeline(stages: List[str], crawl_workers: int | None = None, full: bool = False,
+                 extract_workers: int | None = None, download_concurrency: int | None = None,
+                 csv_path: str = "data/inventory_labeled.csv") -> Dict:
+    # Selected stages run at the same time, each on its own thread, and pick
+    # up what the stage before them has written as soon as it lands. Every
+    # stage works from database state, so an interrupted run resumes where
+    # it stopped. Stage concurrency: crawl_workers listings, extract_workers
+    # parsers with download_concurrency downloads, llm.concurrency requests.
+    stop = threading.Event()
+    bodies: Dict[str, Callable[[], Dict]] = {}
+    upstream: Dict[str, threading.Event | None] = {}
+
+    def extract_body() -> Dict:
+        with extractor(extract_workers, download_concurrency) as extract:
+            return _passes(iter_documents_without_excerpt, extract, upstream["extract"], stop)
+
+    if "crawl" in stages:
+        bodies["crawl"] = lambda: {"tombstoned": crawl_incremental(crawl_workers, full=full, stop=stop)}
+    if "extract" in stages:
+        bodies["extract"] = extract_body
+    if "heuristic" in stages:
+        bodies["heuristic"] = lambda: _passes(iter_documents_for_heuristics, run_heuristics,
+                                              upstream["heuristic"], stop)
+    if "llm" in stages:
+        bodies["llm"] = lambda: _passes(iter_needs_llm, run_llm_pass, upstream["llm"], stop)
+
+    threads: Dict[str, _Stage] = {}
+    previous: _Stage | None = None
+    for name, body in bodies.items():
+        upstream[name] = previous.done if previous else None
+        threads[name] = previous = _Stage(name, body, stop)
+    for thread in threads.values():
+        thread.start()
+
+    results: Dict = {"interrupted": False}
+    try:
+        for thread in threads.values():
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        # In-flight work is finished and written; the rest resumes next run.
+        results["interrupted"] = True
+        stop.set()
+        for thread in threads.values():
+            thread.join()
+    for name, thread in threads.items():
+        if thread.error is not None:
+            raise thread.error
+        results[name] = thread.result
+    if "export" in stages and not results["interrupted"]:
+        results["export"] = {"rows": write_csv(csv_path), "path": csv_path}
+    return results
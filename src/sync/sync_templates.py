@@ -1,23 +1,212 @@
+import asyncio
+import hashlib
 import json
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Awaitable, Dict, Iterable, Iterator, List, NamedTuple, Tuple, TypeVar
 
-from src.db import iter_for_sync, save_audit_change
+from src.db import (
+    DB_BATCH_SIZE, add_template_attachments, iter_for_sync, mark_synced_many, record_sync_failures_many,
+    record_template, save_audit_changes,
+)
 from src.utils import ensure_template, load_settings
-from src.workdrive.datatemplates import update_values
+from src.workdrive.api import submit
+from src.workdrive.datatemplates import (
+    BULK_UPDATE_PATH, BULK_UPDATE_SIZE, BulkUnsupported, aattach_template, abulk_update_values, aupdate_values,
+    update_calls,
+)
 
+# Requests in flight at once (coroutines on the shared event loop).
+SYNC_WORKERS = int(os.getenv("WORKDRIVE_SYNC_WORKERS", "8"))
 
-def push_to_workdrive() -> None:
+log = logging.getLogger(__name__)
+T = TypeVar("T")
+
+
+def _payload(row: Dict) -> Dict[str, str]:
+    return {
+        "Document Type": row["doc_type"],
+        "Robot Model": row["model_type"],
+        "Subsystem": row["subsystem"],
+        "Language": row["language"],
+        "Hardware Version": row["hardware_version"],
+        "Software Version": row["software_version"],
+        "Priority": row["priority"],
+        "Audience Level": row["audience_level"],
+    }
+
+
+def _payload_hash(payload: Dict[str, str]) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class Change(NamedTuple):
+    file_id: str
+    payload: Dict[str, str]
+    payload_hash: str
+    attached: bool  # the template is already on the file
+
+
+def _changed_rows(rows: Iterable[Dict], template_id: str | None, stats: Dict) -> Iterator[Change]:
+    # A file counts as attached once a push to it with this template
+    # succeeded; everything else gets the template attached first.
+    for row in rows:
+        stats["checked"] += 1
+        payload = _payload(row)
+        payload_hash = _payload_hash(payload)
+        attached = row["synced_template_id"] == template_id and row["synced_hash"] is not None
+        if attached and row["synced_hash"] == payload_hash:
+            stats["unchanged"] += 1
+            continue
+        yield Change(row["file_id"], payload, payload_hash, attached)
+
+
+def _error(exc: BaseException) -> str:
+    return str(exc)[:500] or type(exc).__name__
+
+
+async def _limited(limit: asyncio.Semaphore, request: Awaitable[T]) -> T:
+    async with limit:
+        return await request
+
+
+async def _apush(group: List[Change], template_id: str, mode: Dict,
+                 limit: asyncio.Semaphore) -> List[Tuple[Change, str | None, bool]]:
+    # Attaches the template where missing, then updates the values: in one
+    # bulk request while mode["bulk"] holds, else one PATCH per file. Each
+    # request holds a slot of `limit`, shared by every group in flight.
+    # Returns (change, error or None, newly attached) per file.
+    errors: Dict[str, str] = {}
+    attach = [change.file_id for change in group if not change.attached]
+    for file_id, result in zip(attach, await asyncio.gather(
+            *(_limited(limit, aattach_template(file_id, template_id)) for file_id in attach),
+            return_exceptions=True)):
+        if isinstance(result, Exception):
+            errors[file_id] = _error(result)
+    todo = [change for change in group if change.file_id not in errors]
+    if todo and mode["bulk"]:
+        try:
+            results = await _limited(limit, abulk_update_values(
+                template_id, [(change.file_id, change.payload) for change in todo]))
+            errors.update({file_id: error for file_id, error in results.items() if error})
+            todo = []
+        except BulkUnsupported as exc:
+            if mode["bulk"]:
+                log.info("no bulk template update (%s); updating file by file", exc)
+            mode["bulk"] = False
+        except Exception as exc:
+            errors.update({change.file_id: _error(exc) for change in todo})
+            todo = []
+    for change, result in zip(todo, await asyncio.gather(
+            *(_limited(limit, aupdate_values(change.file_id, template_id, change.payload)) for change in todo),
+            return_exceptions=True)):
+        if isinstance(result, Exception):
+            errors[change.file_id] = _error(result)
+    attached = set(attach) - set(errors)
+    return [(change, errors.get(change.file_id), change.file_id in attached) for change in group]
+
+
+def _groups(changes: Iterable[Change], mode: Dict) -> Iterator[List[Change]]:
+    # Bulk requests take BULK_UPDATE_SIZE files; once bulk turns out to be
+    # unsupported, each file is its own request.
+    group: List[Change] = []
+    for change in changes:
+        group.append(change)
+        if len(group) >= (BULK_UPDATE_SIZE if mode["bulk"] else 1):
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+def _push(changes: Iterable[Change], template_id: str, workers: int, stats: Dict) -> None:
+    # Requests run on the shared event loop with at most `workers` in flight
+    # (and as many groups); results are written from this thread in
+    # DB_BATCH_SIZE batches. A failed row keeps its previous hash, so it is
+    # pushed again on the next run.
+    mode = {"bulk": bool(BULK_UPDATE_PATH) and BULK_UPDATE_SIZE > 1}
+    limit = asyncio.Semaphore(workers)
+    groups = _groups(changes, mode)
+    pushed: List[Tuple[str, str, str]] = []
+    audit: List[Tuple[str, str, str, str, str]] = []
+    failed: List[Tuple[str, str, str]] = []
+    in_flight: Dict[Future, List[Change]] = {}
+
+    def flush() -> None:
+        mark_synced_many(pushed)
+        save_audit_changes(audit)
+        record_sync_failures_many(failed)
+        pushed.clear()
+        audit.clear()
+        failed.clear()
+
+    def settle(future: Future) -> None:
+        in_flight.pop(future)
+        for change, error, newly_attached in future.result():
+            if error:
+                log.warning("sync failed for %s: %s", change.file_id, error)
+                stats["failed"] += 1
+                failed.append((change.file_id, template_id, error))
+            else:
+                stats["pushed"] += 1
+                stats["attached"] += newly_attached
+                pushed.append((change.file_id, template_id, change.payload_hash))
+                audit.append((change.file_id, "sync", "", json.dumps(change.payload), "pipeline"))
+
+    try:
+        while True:
+            for group in groups:
+                in_flight[submit(_apush(group, template_id, mode, limit))] = group
+                if len(in_flight) >= workers:
+                    break
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                settle(future)
+            if len(pushed) + len(failed) >= DB_BATCH_SIZE:
+                flush()
+    finally:
+        # Interrupted: requests already sent still finish, and what they did
+        # is recorded with everything still buffered, so pushes that happened
+        # are not repeated next run.
+        wait(in_flight)
+        for future, group in list(in_flight.items()):
+            try:
+                settle(future)
+            except Exception as exc:
+                log.warning("sync request failed for %d file(s): %s", len(group), exc)
+        flush()
+
+
+def plan_sync() -> Dict[str, int]:
+    # What a sync would do, without calling WorkDrive: rows to push and the
+    # requests that takes (assuming the bulk endpoint, when configured, works).
+    settings = load_settings()
+    template_id = ensure_template(settings, create=False)
+    stats = {"checked": 0, "unchanged": 0, "changed": 0}
+    values: List[Dict[str, str]] = []
+    attach = 0
+    for change in _changed_rows(iter_for_sync(), template_id, stats):
+        stats["changed"] += 1
+        attach += not change.attached
+        values.append(change.payload)
+    calls = {
+        "create_template": 0 if template_id else 1,
+        "attach": attach,
+        "update": update_calls(values, bulk=bool(BULK_UPDATE_PATH) and BULK_UPDATE_SIZE > 1),
+    }
+    return {**stats, **{f"{name}_calls": count for name, count in calls.items()}, "calls": sum(calls.values())}
+
+
+def push_to_workdrive(workers: int | None = None) -> Dict[str, int]:
     settings = load_settings()
     template_id = ensure_template(settings)
-    for row in iter_for_sync():
-        payload = {
-            "Document Type": row["doc_type"],
-            "Robot Model": row["model_type"],
-            "Subsystem": row["subsystem"],
-            "Language": row["language"],
-            "Hardware Version": row["hardware_version"],
-            "Software Version": row["software_version"],
-            "Priority": row["priority"],
-            "Audience Level": row["audience_level"],
-        }
-        update_values(row["file_id"], template_id, payload)
-        save_audit_change(row["file_id"], "sync", "", json.dumps(payload), actor="pipeline")
+    record_template(template_id, settings["template"]["name"])
+    stats = {"checked": 0, "unchanged": 0, "pushed": 0, "failed": 0, "attached": 0}
+    try:
+        _push(_changed_rows(iter_for_sync(), template_id, stats), template_id, workers or SYNC_WORKERS, stats)
+    finally:
+        add_template_attachments(template_id, stats["attached"])
+    return stats
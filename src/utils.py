@@ -1,12 +1,15 @@
 import os
 import json
 import csv
+import gzip
 import yaml
 from pathlib import Path
-from typing import Dict, List
-from src.db import all_for_csv, update_from_csv_row
+from typing import Dict, Iterable, Iterator, List
+from src.db import CSV_COLUMNS, LABEL_FIELDS, apply_label_corrections, iter_for_csv
 from src.workdrive.datatemplates import create_template_if_missing
 
+TEMPLATE_META = os.getenv("WORKDRIVE_TEMPLATE_META", ".template.json")
+
 
 def load_settings() -> Dict:
     return yaml.safe_load(open("config/settings.yaml"))
@@ -17,30 +20,62 @@ def read_settings() -> Dict:
     return load_settings()
 
 
-def write_csv(path: str):
-    rows = all_for_csv()
-    if not rows:
-        return
+def _open_text(path: str, mode: str):
+    # Paths ending in .gz are read/written gzip-compressed.
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", newline="", encoding="utf-8")
+    return open(path, mode, newline="", encoding="utf-8")
+
+
+def write_csv(path: str, columns: List[str] | None = None) -> int:
+    columns = columns or list(CSV_COLUMNS)
     Path(path).parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
-        writer.writeheader()
-        writer.writerows(rows)
+    count = 0
+    with _open_text(path, "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in iter_for_csv(columns):
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def _validated_rows(reader: Iterable[Dict], picklists: Dict[str, list], errors: List[str]) -> Iterator[Dict]:
+    # Rows with a value outside the settings picklists are reported and skipped.
+    for line, row in enumerate(reader, start=2):
+        if not row.get("file_id"):
+            errors.append(f"line {line}: missing file_id")
+            continue
+        invalid = [
+            f"{field}={row[field]!r}"
+            for field in LABEL_FIELDS
+            if field in row and (row[field] or "") not in picklists.get(field, [row[field] or ""])
+        ]
+        if invalid:
+            errors.append(f"line {line}: {', '.join(invalid)} not in candidate values")
+            continue
+        yield row
 
 
-def import_corrected_csv(path: str):
-    with open(path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            update_from_csv_row(row)
+def import_corrected_csv(path: str) -> Dict:
+    picklists = load_settings()["classification"]["candidate_values"]
+    errors: List[str] = []
+    with _open_text(path, "r") as f:
+        stats = apply_label_corrections(_validated_rows(csv.DictReader(f), picklists, errors))
+    stats["rejected"] = len(errors)
+    stats["errors"] = errors
+    return stats
 
 
-def ensure_template(settings: Dict) -> str:
+def ensure_template(settings: Dict, create: bool = True) -> str | None:
     # In a real system you'd persist the returned template id;
-    # here we create once and store id in a local file.
-    meta = Path(".template.json")
+    # here we create once and store id in a local file. With create=False a
+    # missing template gives None instead.
+    meta = Path(TEMPLATE_META)
     if meta.exists():
         return json.loads(meta.read_text())["id"]
+    if not create:
+        return None
     template = create_template_if_missing(settings["template"]["name"],
                                           settings["template"]["description"],
                                           settings["template"]["fields"])
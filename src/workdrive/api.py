@@ -1,14 +1,43 @@
+import asyncio
+import concurrent.futures
+import hashlib
 import os
-from typing import Any, Dict
+import threading
+import time
+import weakref
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, BinaryIO, Dict, Tuple, TypeVar
 
-import requests
-from tenacity import retry, stop_after_attempt, wait_exponential
+import httpx
+from tenacity import retry, retry_if_exception_type
 
-from .auth import get_access_token
+from src.metrics import increment, observe, timed
+
+from .auth import cached_access_token, get_access_token, invalidate_access_token
+
+try:
+    import h2  # noqa: F401  HTTP/2 for httpx: pip install "httpx[http2]"
+except ImportError:
+    h2 = None
 
 API_BASE = os.getenv("WORKDRIVE_API_BASE", "https://workdrive.zoho.com/api/v1")
 APP_BASE = os.getenv("WORKDRIVE_APP_BASE")
 ORG_ID = os.getenv("WORKDRIVE_ORG_ID")
+RATE_LIMIT = float(os.getenv("WORKDRIVE_RATE_LIMIT", "10"))  # starting requests/second, 0 = unlimited
+RATE_LIMIT_MIN = float(os.getenv("WORKDRIVE_RATE_LIMIT_MIN", "0.5"))
+RATE_LIMIT_MAX = float(os.getenv("WORKDRIVE_RATE_LIMIT_MAX", "20"))
+RATE_LIMIT_INCREASE = float(os.getenv("WORKDRIVE_RATE_LIMIT_INCREASE", "0.5"))
+# Longest a Retry-After or quota reset may pause every worker for.
+RATE_LIMIT_MAX_PAUSE = float(os.getenv("WORKDRIVE_RATE_LIMIT_MAX_PAUSE", "300"))
+# 429s are retried without backoff (the limiter waits them out) up to this
+# many times per call; other failures give up after RETRY_ATTEMPTS attempts.
+THROTTLE_MAX_RETRIES = int(os.getenv("WORKDRIVE_THROTTLE_MAX_RETRIES", "50"))
+RETRY_ATTEMPTS = int(os.getenv("WORKDRIVE_RETRY_ATTEMPTS", "5"))
+HTTP_POOL_SIZE = int(os.getenv("WORKDRIVE_HTTP_POOL_SIZE", "16"))
+# HTTP/2 multiplexes every in-flight request over a few connections where
+# the server supports it (negotiated over TLS; plain http stays on 1.1).
+HTTP2 = os.getenv("WORKDRIVE_HTTP2", "true").lower() in ("1", "true", "yes")
+DOWNLOAD_CHUNK_BYTES = int(os.getenv("WORKDRIVE_DOWNLOAD_CHUNK_BYTES", str(1024 * 1024)))
 
 if not APP_BASE:
     base = API_BASE.rstrip("/")
@@ -17,74 +46,380 @@ if not APP_BASE:
     APP_BASE = base
 
 
-def _headers() -> Dict[str, str]:
-    headers = {"Authorization": f"Zoho-oauthtoken {get_access_token()}"}
-    if ORG_ID:
-        headers["X-ZOHO-WORKDRIVE-ORGID"] = ORG_ID
-    return headers
+class RateLimiter:
+    # Process-wide request pacing shared by every worker thread, tuned AIMD
+    # style: each success nudges the rate up (about +increase req/s per
+    # second), each 429 halves it and pauses every worker for Retry-After.
+    def __init__(self, rate: float, min_rate: float = RATE_LIMIT_MIN, max_rate: float = RATE_LIMIT_MAX,
+                 increase: float = RATE_LIMIT_INCREASE, decrease: float = 0.5):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, rate)
+        self.increase = increase
+        self.decrease = decrease
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+        self._cooldown_until = 0.0
+        self._stats = {"requests": 0, "throttled": 0, "wait_seconds": 0.0, "paused_seconds": 0.0}
+
+    def reserve(self) -> float:
+        # Claims the next slot and returns how long the caller must wait for it.
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_at)
+            if self.rate > 0:
+                self._next_at = start + 1.0 / self.rate
+            delay = start - now
+            self._stats["requests"] += 1
+            self._stats["wait_seconds"] += delay
+        return delay
+
+    def acquire(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        # A 429 throttles the whole process, not just the worker that saw it.
+        with self._lock:
+            resume_at = time.monotonic() + seconds
+            if resume_at > self._next_at:
+                self._stats["paused_seconds"] += resume_at - max(self._next_at, time.monotonic())
+                self._next_at = resume_at
+
+    def on_success(self) -> None:
+        with self._lock:
+            if self.rate > 0:
+                self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttled(self, retry_after: float) -> None:
+        # Several workers usually hit the same 429 burst; only the first one
+        # in a cooldown window lowers the rate.
+        with self._lock:
+            now = time.monotonic()
+            self._stats["throttled"] += 1
+            if self.rate > 0 and now >= self._cooldown_until:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._cooldown_until = now + max(retry_after, 1.0)
+        self.pause(retry_after)
+
+    def observe(self, response: httpx.Response) -> None:
+        increment(f"api.status.{response.status_code}")
+        if response.status_code == 429:
+            self.on_throttled(_retry_after(response))
+            return
+        self.on_success()
+        # Honour advertised quotas before they turn into 429s.
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        if remaining is not None and remaining.strip() == "0":
+            self.pause(_retry_after(response, header="X-RateLimit-Reset"))
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {**self._stats, "rate": round(self.rate, 3)}
+
+
+limiter = RateLimiter(RATE_LIMIT)
+
+
+def _retry_after(response: httpx.Response, default: float = 1.0, header: str = "Retry-After") -> float:
+    # Seconds to wait, at most RATE_LIMIT_MAX_PAUSE; accepts delta-seconds,
+    # an epoch timestamp (as some X-RateLimit-Reset headers send) or an
+    # HTTP date.
+    value = response.headers.get(header)
+    if not value:
+        return default
+    try:
+        seconds = float(value)
+        if seconds > time.time() - 1e9:
+            seconds -= time.time()
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return default
+    return min(max(seconds, 0.0), RATE_LIMIT_MAX_PAUSE)
+
+
+class DownloadTooLarge(RuntimeError):
+    pass
+
+
+class RetryableError(RuntimeError):
+    pass
+
+
+class Throttled(RetryableError):
+    pass
+
+
+def _check_retryable(response: httpx.Response) -> None:
+    if response.status_code == 401:
+        # Token revoked or expired early: drop the cached one and retry.
+        invalidate_access_token()
+    if response.status_code == 429:
+        raise Throttled(f"Retryable: 429 {response.text[:200]}")
+    if response.status_code in (401, 500, 502, 503, 504):
+        raise RetryableError(f"Retryable: {response.status_code} {response.text[:200]}")
+
+
+# A 429 has already paused the shared limiter for Retry-After, so it is
+# retried at once and kept apart from the attempt cap; 5xx/connection
+# failures back off exponentially (1s..10s). Other 4xx are not retried.
+def _failures(retry_state) -> Tuple[int, int]:
+    # (throttled, other) failed attempts so far, recorded once per attempt.
+    outcomes = retry_state.__dict__.setdefault("throttled_attempts", {})
+    outcomes[retry_state.attempt_number] = isinstance(retry_state.outcome.exception(), Throttled)
+    throttled = sum(outcomes.values())
+    return throttled, len(outcomes) - throttled
+
+
+def _wait(retry_state) -> float:
+    throttled, other = _failures(retry_state)
+    if isinstance(retry_state.outcome.exception(), Throttled):
+        return 0.0
+    return min(10.0, 2.0 ** (other - 1))
+
+
+def _stop(retry_state) -> bool:
+    throttled, other = _failures(retry_state)
+    return other >= RETRY_ATTEMPTS or throttled > THROTTLE_MAX_RETRIES
+
+
+def _count_retry(retry_state) -> None:
+    increment("api.retries")
+
+
+_retry = retry(
+    retry=retry_if_exception_type((RetryableError, httpx.TransportError)),
+    wait=_wait,
+    stop=_stop,
+    before_sleep=_count_retry,
+    reraise=True,
+)
+
+
+class AsyncWorkDriveClient:
+    # One pooled keep-alive (HTTP/2 where available) client per event loop.
+    # Requests wait on the shared rate limiter without holding a thread, so
+    # hundreds can be in flight at once.
+    def __init__(self, api_base: str = API_BASE, org_id: str | None = ORG_ID,
+                 pool_size: int = HTTP_POOL_SIZE, rate_limiter: RateLimiter = limiter, http2: bool = HTTP2):
+        self.api_base = api_base
+        self.org_id = org_id
+        self.limiter = rate_limiter
+        self.client = httpx.AsyncClient(
+            http2=http2 and h2 is not None,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            # Requests queue for a connection as long as they need to.
+            timeout=httpx.Timeout(60, pool=None),
+            follow_redirects=True,
+            headers={"Accept-Encoding": "gzip, deflate"},
+        )
+
+    async def _headers(self) -> Dict[str, str]:
+        # A token refresh is blocking I/O, so it runs off the event loop.
+        token = cached_access_token() or await asyncio.to_thread(get_access_token)
+        headers = {"Authorization": f"Zoho-oauthtoken {token}"}
+        if self.org_id:
+            headers["X-ZOHO-WORKDRIVE-ORGID"] = self.org_id
+        return headers
+
+    async def _pace(self) -> None:
+        delay = self.limiter.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _request(self, method: str, path: str, **kwargs) -> Dict[str, Any]:
+        await self._pace()
+        # Latency excludes the time spent waiting on the rate limiter.
+        with timed(f"api.{method.lower()}") as sample:
+            response = await self.client.request(
+                method,
+                f"{self.api_base}{path}",
+                headers=await self._headers(),
+                **kwargs,
+            )
+            sample["bytes"] = len(response.content)
+            self.limiter.observe(response)
+            _check_retryable(response)
+            response.raise_for_status()
+            return response.json()
+
+    @_retry
+    async def get(self, path: str, params: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        return await self._request("GET", path, params=params or {})
+
+    @_retry
+    async def post(self, path: str, json: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        return await self._request("POST", path, json=json)
+
+    @_retry
+    async def patch(self, path: str, json: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        return await self._request("PATCH", path, json=json)
+
+    @_retry
+    async def _open_download(self, file_id: str) -> Tuple[httpx.Response, float]:
+        # The download API can differ across deployments; try the newer download
+        # endpoint first but fall back to the legacy content endpoint if needed.
+        # The response is streamed; the caller must close it. Also returns when
+        # the request was sent, after the rate limiter's wait, so download
+        # latency excludes limiter waits and retry backoff; a failed attempt
+        # is recorded as an error here.
+        endpoints = (
+            f"{self.api_base}/download/{file_id}",
+            f"{self.api_base}/files/{file_id}/content",
+        )
+        errors: list[str] = []
+        started = time.perf_counter()
+        try:
+            for url in endpoints:
+                await self._pace()
+                started = time.perf_counter()
+                request = self.client.build_request("GET", url, headers=await self._headers(), timeout=120)
+                response = await self.client.send(request, stream=True)
+                self.limiter.observe(response)
+                if response.status_code == 429:
+                    await response.aclose()
+                    raise Throttled(f"Retryable: 429 downloading {file_id}")
+                if response.is_success:
+                    return response, started
+                await response.aread()
+                try:
+                    detail = response.json()
+                except ValueError:
+                    detail = response.text[:200]
+                await response.aclose()
+                errors.append(f"{url}: {response.status_code} {detail}")
+                # Only attempt the fallback when it makes sense; keep trying on known
+                # mismatches (400/404/422) and bail early on hard failures.
+                if response.status_code >= 500:
+                    break
+            raise RuntimeError(f"Failed to download file {file_id}: {'; '.join(errors)}")
+        except BaseException:
+            observe("api.download", time.perf_counter() - started, error=True)
+            raise
+
+    async def download_file_bytes(self, file_id: str) -> bytes:
+        response, started = await self._open_download(file_id)
+        with timed("api.download", started) as sample:
+            try:
+                content = await response.aread()
+            finally:
+                await response.aclose()
+            sample["bytes"] = len(content)
+            return content
+
+    async def download_to_file(self, file_id: str, dest: BinaryIO, max_bytes: int = 0) -> str:
+        # Streams the file into dest in fixed-size chunks and returns its sha256,
+        # so memory stays flat regardless of file size. Raises DownloadTooLarge
+        # as soon as more than max_bytes (when > 0) have arrived.
+        digest = hashlib.sha256()
+        response, started = await self._open_download(file_id)
+        with timed("api.download", started) as sample:
+            try:
+                declared = int(response.headers.get("Content-Length") or 0)
+                if max_bytes and declared > max_bytes:
+                    raise DownloadTooLarge(f"{file_id}: {declared} bytes exceeds cap of {max_bytes}")
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_BYTES):
+                    sample["bytes"] += len(chunk)
+                    if max_bytes and sample["bytes"] > max_bytes:
+                        raise DownloadTooLarge(f"{file_id}: more than {max_bytes} bytes")
+                    digest.update(chunk)
+                    dest.write(chunk)
+            finally:
+                await response.aclose()
+        return digest.hexdigest()
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+# An httpx client belongs to the loop it first ran on, so each loop gets its own.
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncWorkDriveClient]" = weakref.WeakKeyDictionary()
+
+
+def get_async_client() -> AsyncWorkDriveClient:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncWorkDriveClient()
+    return client
+
+
+async def aget(path: str, params: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    return await get_async_client().get(path, params)
+
+
+async def apost(path: str, json: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    return await get_async_client().post(path, json)
+
+
+async def apatch(path: str, json: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    return await get_async_client().patch(path, json)
+
+
+async def adownload_file_bytes(file_id: str) -> bytes:
+    return await get_async_client().download_file_bytes(file_id)
+
+
+async def adownload_to_file(file_id: str, dest: BinaryIO, max_bytes: int = 0) -> str:
+    return await get_async_client().download_to_file(file_id, dest, max_bytes)
+
+
+# Blocking callers (the CLI, worker threads) share one event loop running on
+# a daemon thread: submit() schedules a coroutine there and returns a
+# concurrent.futures.Future, run() waits for its result.
+T = TypeVar("T")
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def _shared_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="workdrive-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def submit(coro: Awaitable[T]) -> "concurrent.futures.Future[T]":
+    return asyncio.run_coroutine_threadsafe(coro, _shared_loop())
+
+
+def run(coro: Awaitable[T]) -> T:
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is not None and running is _loop:
+        coro.close()
+        raise RuntimeError("blocking WorkDrive call on the shared event loop; await the async version")
+    return submit(coro).result()
 
 
-@retry(wait=wait_exponential(min=1, max=10), stop=stop_after_attempt(5))
 def get(path: str, params: Dict[str, Any] | None = None) -> Dict[str, Any]:
-    response = requests.get(
-        f"{API_BASE}{path}",
-        headers=_headers(),
-        params=params or {},
-        timeout=60,
-    )
-    if response.status_code in (429, 500, 502, 503, 504):
-        raise RuntimeError(f"Retryable: {response.status_code} {response.text[:200]}")
-    response.raise_for_status()
-    return response.json()
-
-
-@retry(wait=wait_exponential(min=1, max=10), stop=stop_after_attempt(5))
+    return run(aget(path, params))
+
+
 def post(path: str, json: Dict[str, Any] | None = None) -> Dict[str, Any]:
-    response = requests.post(
-        f"{API_BASE}{path}",
-        headers={**_headers(), "Content-Type": "application/json"},
-        json=json,
-        timeout=60,
-    )
-    if response.status_code in (429, 500, 502, 503, 504):
-        raise RuntimeError(f"Retryable: {response.status_code} {response.text[:200]}")
-    response.raise_for_status()
-    return response.json()
-
-
-@retry(wait=wait_exponential(min=1, max=10), stop=stop_after_attempt(5))
+    return run(apost(path, json))
+
+
 def patch(path: str, json: Dict[str, Any] | None = None) -> Dict[str, Any]:
-    response = requests.patch(
-        f"{API_BASE}{path}",
-        headers={**_headers(), "Content-Type": "application/json"},
-        json=json,
-        timeout=60,
-    )
-    if response.status_code in (429, 500, 502, 503, 504):
-        raise RuntimeError(f"Retryable: {response.status_code} {response.text[:200]}")
-    response.raise_for_status()
-    return response.json()
+    return run(apatch(path, json))
 
 
 def download_file_bytes(file_id: str) -> bytes:
-    # The download API can differ across deployments; try the newer download
-    # endpoint first but fall back to the legacy content endpoint if needed.
-    endpoints = (
-        f"{API_BASE}/download/{file_id}",
-        f"{API_BASE}/files/{file_id}/content",
-    )
-    errors: list[str] = []
-    for url in endpoints:
-        response = requests.get(url, headers=_headers(), timeout=120)
-        if response.ok:
-            return response.content
-        try:
-            detail = response.json()
-        except ValueError:
-            detail = response.text[:200]
-        errors.append(f"{url}: {response.status_code} {detail}")
-        # Only attempt the fallback when it makes sense; keep trying on known
-        # mismatches (400/404/422) and bail early on hard failures.
-        if response.status_code >= 500:
-            break
-    raise RuntimeError(f"Failed to download file {file_id}: {'; '.join(errors)}")
+    return run(adownload_file_bytes(file_id))
+
+
+def download_to_file(file_id: str, dest: BinaryIO, max_bytes: int = 0) -> str:
+    return run(adownload_to_file(file_id, dest, max_bytes))
+
+
+def rate_limit_stats() -> Dict[str, float]:
+    return limiter.stats()
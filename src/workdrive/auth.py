@@ -1,5 +1,6 @@
 import json
 import os
+import threading
 import time
 from pathlib import Path
 
@@ -15,6 +16,11 @@ REFRESH_TOKEN = os.getenv("ZOHO_REFRESH_TOKEN")
 SCOPES = os.getenv("ZOHO_SCOPES", "")
 TOKEN_CACHE = Path(os.getenv("TOKEN_CACHE", "token.json"))
 
+# In-process copy of the token so requests don't re-read token.json; the
+# lock makes concurrent workers share a single refresh.
+_token: dict = {}
+_token_lock = threading.Lock()
+
 
 def _save(token: dict) -> None:
     TOKEN_CACHE.write_text(json.dumps(token, indent=2))
@@ -45,11 +51,36 @@ def _refresh() -> dict:
     return token
 
 
+def _valid(token: dict) -> bool:
+    return bool(token) and time.time() < token.get("expires_at", 0)
+
+
+def cached_access_token() -> str | None:
+    # The in-process token if still valid, without touching disk or network.
+    token = _token
+    return token["access_token"] if _valid(token) else None
+
+
 def get_access_token() -> str:
-    token = _load()
-    if not token or time.time() >= token.get("expires_at", 0):
-        token = _refresh()
-    return token["access_token"]
+    global _token
+    token = _token
+    if _valid(token):
+        return token["access_token"]
+    with _token_lock:
+        if not _valid(_token):
+            cached = _load()
+            _token = cached if _valid(cached) else _refresh()
+        return _token["access_token"]
+
+
+def invalidate_access_token() -> None:
+    # Forces the next get_access_token() to refresh instead of reusing a
+    # token the server rejected.
+    global _token
+    with _token_lock:
+        _token = {}
+        if TOKEN_CACHE.exists():
+            _save({})
 
 
 def token_status() -> dict:
@@ -1,23 +1,87 @@
-from typing import Dict
+import os
+from typing import Dict, List, Tuple
 
-from .api import get, patch, post
+import httpx
 
+from .api import apatch, apost, run
 
-def create_template_if_missing(name: str, description: str, fields: list) -> Dict:
-    payload = {"name": name, "description": description, "fields": fields}
-    return post("/data/templates", json=payload)
+# WorkDrive has no documented bulk data-template update, but some deployments
+# (and gateways in front of it) offer one: set its path, e.g.
+# /data/templates/{template_id}/values. It takes a PATCH of
+# {"data": [{"id": file_id, "fields": [...]}, ...]} and answers with a status
+# per file. Unset, or answered with 404/405/501, values go one PATCH per file.
+BULK_UPDATE_PATH = os.getenv("WORKDRIVE_BULK_UPDATE_PATH", "")
+BULK_UPDATE_SIZE = int(os.getenv("WORKDRIVE_BULK_UPDATE_SIZE", "50"))
 
 
-def attach_template(file_id: str, template_id: str):
-    return post(f"/files/{file_id}/data/templates", json={"template_id": template_id})
+class BulkUnsupported(RuntimeError):
+    pass
 
 
-def update_values(file_id: str, template_id: str, values: Dict[str, str]):
-    fields = [
+def _fields(values: Dict[str, str]) -> List[Dict[str, str]]:
+    return [
         {"label": label, "value": value}
         for label, value in values.items()
         if value is not None and value != ""
     ]
+
+
+def create_template_if_missing(name: str, description: str, fields: list) -> Dict:
+    return run(acreate_template_if_missing(name, description, fields))
+
+
+def attach_template(file_id: str, template_id: str):
+    return run(aattach_template(file_id, template_id))
+
+
+def update_values(file_id: str, template_id: str, values: Dict[str, str]):
+    return run(aupdate_values(file_id, template_id, values))
+
+
+async def acreate_template_if_missing(name: str, description: str, fields: list) -> Dict:
+    payload = {"name": name, "description": description, "fields": fields}
+    return await apost("/data/templates", json=payload)
+
+
+async def aattach_template(file_id: str, template_id: str):
+    try:
+        return await apost(f"/files/{file_id}/data/templates", json={"template_id": template_id})
+    except httpx.HTTPStatusError as exc:
+        # 409: the template is already on the file.
+        if exc.response.status_code != 409:
+            raise
+
+
+async def aupdate_values(file_id: str, template_id: str, values: Dict[str, str]):
+    fields = _fields(values)
     if not fields:
         return
-    return patch(f"/files/{file_id}/data/templates/{template_id}", json={"fields": fields})
+    return await apatch(f"/files/{file_id}/data/templates/{template_id}", json={"fields": fields})
+
+
+async def abulk_update_values(template_id: str, updates: List[Tuple[str, Dict[str, str]]]) -> Dict[str, str | None]:
+    # One request for many files: file_id -> None when updated, else the
+    # server's error for that file. Raises BulkUnsupported when there is no
+    # bulk endpoint.
+    results: Dict[str, str | None] = {file_id: None for file_id, _ in updates}
+    data = [{"id": file_id, "fields": fields} for file_id, values in updates if (fields := _fields(values))]
+    if not data:
+        return results
+    if not BULK_UPDATE_PATH:
+        raise BulkUnsupported("WORKDRIVE_BULK_UPDATE_PATH is not set")
+    try:
+        response = await apatch(BULK_UPDATE_PATH.format(template_id=template_id), json={"data": data})
+    except httpx.HTTPStatusError as exc:
+        if exc.response.status_code in (404, 405, 501):
+            raise BulkUnsupported(f"bulk update answered {exc.response.status_code}") from exc
+        raise
+    for item in response.get("data", []):
+        if item.get("id") in results and item.get("status", "ok") != "ok":
+            results[item["id"]] = str(item.get("message") or item.get("status"))
+    return results
+
+
+def update_calls(values: List[Dict[str, str]], bulk: bool) -> int:
+    # Requests needed to push these value sets (empty ones are never sent).
+    count = sum(1 for item in values if _fields(item))
+    return -(-count // max(BULK_UPDATE_SIZE, 1)) if bulk else count
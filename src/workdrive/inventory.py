@@ -1,26 +1,47 @@
 import os
-from typing import Dict, Generator, Iterator, Tuple
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, NamedTuple, Tuple
 from urllib.parse import urljoin
 
 from tqdm import tqdm
 
-from .api import get, API_BASE, APP_BASE
-from src.db import mark_seen, upsert_document
+from .api import aget, get, run, submit, API_BASE, APP_BASE
+from src.db import begin_crawl, finish_crawl, get_folder_states, has_crawl_checkpoint, record_crawl_page
 
 TEAMFOLDER_ID = os.getenv("TEAMFOLDER_ID")
 ROOT_FOLDER_ID = os.getenv("WORKDRIVE_ROOT_FOLDER_ID")
 CRAWL_PAGE_LIMIT = int(os.getenv("WORKDRIVE_CRAWL_PAGE_LIMIT", "50"))
+# Listings in flight at once. They are coroutines on the shared event loop,
+# not threads, so this can be set in the hundreds; the rate limiter still
+# paces the requests.
+CRAWL_WORKERS = int(os.getenv("WORKDRIVE_CRAWL_WORKERS", "8"))
+# Pages of one folder requested ahead of the page currently being read.
+CRAWL_PREFETCH_PAGES = int(os.getenv("WORKDRIVE_CRAWL_PREFETCH_PAGES", "2"))
+# A folder's marker only reflects its direct children, so a change further
+# down (a nested file deleted, renamed or resized) leaves every ancestor
+# looking unchanged. Folders listed longer ago than this are relisted anyway;
+# 0 relists every folder on every crawl.
+CRAWL_RELIST_HOURS = float(os.getenv("WORKDRIVE_CRAWL_RELIST_HOURS", "168"))
 
+Seed = Tuple[str, str, str]
 
-def _list_items(container_id: str, container_kind: str, limit: int = CRAWL_PAGE_LIMIT) -> Iterator[Dict]:
+
+async def _alist_page(container_id: str, container_kind: str, offset: int,
+                      limit: int = CRAWL_PAGE_LIMIT) -> List[Dict]:
     path_prefix = "teamfolders" if container_kind == "teamfolder" else "files"
+    data = await aget(
+        f"/{path_prefix}/{container_id}/files",
+        params={"page[limit]": limit, "page[offset]": offset, "filter[type]": "all"},
+    )
+    return data.get("data", [])
+
+
+async def _alist_items(container_id: str, container_kind: str, limit: int = CRAWL_PAGE_LIMIT) -> AsyncIterator[Dict]:
     offset = 0
     while True:
-        data = get(
-            f"/{path_prefix}/{container_id}/files",
-            params={"page[limit]": limit, "page[offset]": offset, "filter[type]": "all"},
-        )
-        items = data.get("data", [])
+        items = await _alist_page(container_id, container_kind, offset, limit)
         if not items:
             break
         for item in items:
@@ -30,36 +51,144 @@ def _list_items(container_id: str, container_kind: str, limit: int = CRAWL_PAGE_
         offset += limit
 
 
-def _recurse(container_id: str, container_kind: str, prefix: str = "") -> Generator[Dict, None, None]:
-    for item in _list_items(container_id, container_kind):
-        attributes = item.get("attributes", {})
-        item_id = item.get("id")
-        name = attributes.get("name")
-        item_type = attributes.get("type")
-        full_path = f"{prefix}/{name}" if prefix else name
-        if item_type == "folder":
-            yield from _recurse(item_id, "folder", full_path)
-        else:
-            permalink = attributes.get("permalink") or attributes.get("permalink_url") or attributes.get("web_url")
-            if permalink and not permalink.startswith("http"):
-                permalink = urljoin(APP_BASE.rstrip("/") + "/", permalink.lstrip("/"))
-            if not permalink:
-                permalink = f"{APP_BASE.rstrip('/')}/file/{item_id}"
-            download_url = attributes.get("download_url") or f"{API_BASE}/download/{item_id}"
-            yield {
-                "file_id": item_id,
-                "name": name,
-                "path": full_path,
-                "size": attributes.get("content_size"),
-                "created_time": attributes.get("created_at"),
-                "modified_time": attributes.get("modified_at"),
-                "permalink": permalink,
-                "download_url": download_url,
-            }
-
-
-def crawl_incremental() -> None:
-    seeds: Tuple[Tuple[str, str, str], ...]
+def _list_page(container_id: str, container_kind: str, offset: int, limit: int = CRAWL_PAGE_LIMIT) -> List[Dict]:
+    return run(_alist_page(container_id, container_kind, offset, limit))
+
+
+def _list_items(container_id: str, container_kind: str, limit: int = CRAWL_PAGE_LIMIT) -> Iterator[Dict]:
+    items = _alist_items(container_id, container_kind, limit)
+    while True:
+        try:
+            yield run(items.__anext__())
+        except StopAsyncIteration:
+            return
+
+
+def _document_row(item: Dict, full_path: str) -> Dict:
+    attributes = item.get("attributes", {})
+    item_id = item.get("id")
+    permalink = attributes.get("permalink") or attributes.get("permalink_url") or attributes.get("web_url")
+    if permalink and not permalink.startswith("http"):
+        permalink = urljoin(APP_BASE.rstrip("/") + "/", permalink.lstrip("/"))
+    if not permalink:
+        permalink = f"{APP_BASE.rstrip('/')}/file/{item_id}"
+    download_url = attributes.get("download_url") or f"{API_BASE}/download/{item_id}"
+    return {
+        "file_id": item_id,
+        "name": attributes.get("name"),
+        "path": full_path,
+        "size": attributes.get("content_size"),
+        "created_time": attributes.get("created_at"),
+        "modified_time": attributes.get("modified_at"),
+        "permalink": permalink,
+        "download_url": download_url,
+    }
+
+
+class PageTask(NamedTuple):
+    container_id: str
+    container_kind: str
+    prefix: str
+    offset: int
+    limit: int
+    stride: int
+
+
+def _next_pages(task: PageTask, item_count: int, prefetch: int) -> List[PageTask]:
+    # Page 0 opens a window of `prefetch` pages; every later full page
+    # schedules the page one window ahead of it. The stride travels with the
+    # task so a resumed crawl keeps the same page layout.
+    if item_count < task.limit:
+        return []
+    if task.offset == 0:
+        return [task._replace(offset=page * task.limit, stride=prefetch) for page in range(1, prefetch + 1)]
+    return [task._replace(offset=task.offset + task.stride * task.limit)]
+
+
+def _folder_marker(attributes: Dict) -> Tuple[str | None, int | None]:
+    storage = attributes.get("storage_info") or {}
+    counts = [storage.get(key) for key in ("files_count", "folders_count")]
+    child_count = sum(int(c) for c in counts if c is not None) if any(c is not None for c in counts) else None
+    return attributes.get("modified_at"), child_count
+
+
+def _crawl(tasks: Iterable[PageTask], handle_page: Callable[[PageTask, List[Dict]], List[PageTask]],
+           workers: int = CRAWL_WORKERS, stop: threading.Event | None = None) -> bool:
+    # Work-queue crawl: every folder page is an independent task, so sibling
+    # folders and the pages of one large folder are listed concurrently, at
+    # most `workers` at a time, on the shared event loop. handle_page runs on
+    # the calling thread (the single DB writer) as each page arrives and
+    # returns the follow-up tasks to schedule. Returns False when stopped
+    # early; unhandled pages stay in the frontier for a resume.
+    workers = max(workers, 1)
+    queued = list(tasks)
+    pending: Dict[Future, PageTask] = {}
+
+    def fill() -> None:
+        while queued and len(pending) < workers:
+            task = queued.pop()
+            pending[submit(_alist_page(task.container_id, task.container_kind, task.offset, task.limit))] = task
+
+    try:
+        fill()
+        while pending:
+            if stop is not None and stop.is_set():
+                return False
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = pending.pop(future)
+                queued.extend(handle_page(task, future.result()))
+            fill()
+        return True
+    finally:
+        for future in pending:
+            future.cancel()
+        wait(pending)
+
+
+def _relist_cutoff(max_age_hours: float) -> str:
+    # last_listed values older than this (same format as SQLite's 'now')
+    # are due for a relist.
+    return (datetime.now(timezone.utc) - timedelta(hours=max_age_hours)).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+def _page_handler(prefetch: int, skip_unchanged: bool, progress,
+                  relist_hours: float) -> Callable[[PageTask, List[Dict]], List[PageTask]]:
+    cutoff = _relist_cutoff(relist_hours)
+
+    def handle_page(task: PageTask, items: List[Dict]) -> List[PageTask]:
+        new_tasks = _next_pages(task, len(items), prefetch)
+        documents: List[Dict] = []
+        folders: List[Tuple] = []
+        unchanged: List[str] = []
+        folder_ids = [item.get("id") for item in items if item.get("attributes", {}).get("type") == "folder"]
+        states = get_folder_states(folder_ids) if skip_unchanged else {}
+        for item in items:
+            attributes = item.get("attributes", {})
+            item_id = item.get("id")
+            name = attributes.get("name")
+            full_path = f"{task.prefix}/{name}" if task.prefix else name
+            if attributes.get("type") == "folder":
+                modified_at, child_count = _folder_marker(attributes)
+                folders.append((item_id, task.container_id, full_path, modified_at, child_count))
+                state = states.get(item_id)
+                if (state and modified_at and state[3] and state[3] >= cutoff
+                        and state[:3] == (full_path, modified_at, child_count)):
+                    unchanged.append(item_id)
+                else:
+                    new_tasks.append(PageTask(item_id, "folder", full_path, 0, task.limit, prefetch))
+            else:
+                row = _document_row(item, full_path)
+                row["parent_id"] = task.container_id
+                documents.append(row)
+        record_crawl_page(task, documents, folders, new_tasks, unchanged)
+        progress.update(len(documents))
+        return new_tasks
+
+    return handle_page
+
+
+def _seeds() -> Tuple[Seed, ...]:
     if ROOT_FOLDER_ID:
         try:
             folder_meta = get(f"/files/{ROOT_FOLDER_ID}")
@@ -67,12 +196,24 @@ def crawl_incremental() -> None:
             root_name = attributes.get("name", ROOT_FOLDER_ID)
         except Exception:
             root_name = ROOT_FOLDER_ID
-        seeds = ((ROOT_FOLDER_ID, "folder", root_name),)
-    else:
-        assert TEAMFOLDER_ID, "TEAMFOLDER_ID not set"
-        seeds = ((TEAMFOLDER_ID, "teamfolder", ""),)
-
-    for container_id, container_kind, prefix in seeds:
-        for row in tqdm(_recurse(container_id, container_kind, prefix), desc="Crawling"):
-            upsert_document(row)
-            mark_seen(row["file_id"])
+        return ((ROOT_FOLDER_ID, "folder", root_name),)
+    assert TEAMFOLDER_ID, "TEAMFOLDER_ID not set"
+    return ((TEAMFOLDER_ID, "teamfolder", ""),)
+
+
+def crawl_incremental(workers: int | None = None, full: bool = False, stop: threading.Event | None = None) -> int:
+    # full=True relists every folder and discards any saved checkpoint;
+    # otherwise unchanged folders listed within CRAWL_RELIST_HOURS are skipped
+    # and an interrupted crawl resumes.
+    # Setting stop ends the crawl early, leaving the checkpoint for a resume.
+    prefetch = max(CRAWL_PREFETCH_PAGES, 1)
+    seeds: List[PageTask] = []
+    if full or not has_crawl_checkpoint():
+        seeds = [PageTask(cid, kind, prefix, 0, CRAWL_PAGE_LIMIT, prefetch) for cid, kind, prefix in _seeds()]
+    run_started, tasks = begin_crawl(seeds, restart=full)
+    with tqdm(desc="Crawling", unit="file") as progress:
+        handler = _page_handler(prefetch, skip_unchanged=not full, progress=progress, relist_hours=CRAWL_RELIST_HOURS)
+        completed = _crawl([PageTask(*task) for task in tasks], handler, workers=workers or CRAWL_WORKERS, stop=stop)
+    if not completed:
+        return 0
+    return finish_crawl(run_started)
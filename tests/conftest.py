@@ -0,0 +1,111 @@
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Pipeline modules read their settings from the environment at import time,
+# so the mock server's address and a scratch directory are fixed here,
+# before any test imports them (as bench.run does).
+PORT = _free_port()
+SCRATCH = Path(tempfile.mkdtemp(prefix="workdrive-tests-"))
+(SCRATCH / "token.json").write_text(json.dumps({"access_token": "test", "expires_at": time.time() + 86400}))
+os.environ.update({
+    "WORKDRIVE_API_BASE": f"http://127.0.0.1:{PORT}/api/v1",
+    "WORKDRIVE_APP_BASE": f"http://127.0.0.1:{PORT}",
+    "TEAMFOLDER_ID": "teamfolder",
+    "WORKDRIVE_ROOT_FOLDER_ID": "",
+    "WORKDRIVE_RATE_LIMIT": "0",
+    "WORKDRIVE_CRAWL_PAGE_LIMIT": "5",
+    "DB_PATH": str(SCRATCH / "unused.db"),
+    "TOKEN_CACHE": str(SCRATCH / "token.json"),
+    "WORKDRIVE_TEMPLATE_META": str(SCRATCH / "template.json"),
+    "EXTRACT_SPOOL_DIR": str(SCRATCH),
+    "EXTRACT_BLOB_CACHE_DIR": str(SCRATCH / "blobs"),
+    "ENABLE_LLM": "false",
+    "WORKDRIVE_BULK_UPDATE_PATH": "/data/templates/{template_id}/values",
+    "WORKDRIVE_BULK_UPDATE_SIZE": "10",
+})
+
+from bench.corpus import generate_corpus, load_manifest  # noqa: E402
+from bench.mock_server import MockWorkDrive  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def corpus_dir() -> str:
+    path = SCRATCH / "corpus"
+    generate_corpus(str(path), files=40, depth=2, fanout=2, duplicate_ratio=0.1, seed=7)
+    return str(path)
+
+
+@pytest.fixture(scope="session")
+def _server(corpus_dir):
+    server = MockWorkDrive(corpus_dir, port=PORT)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def workdrive(_server, corpus_dir):
+    # The session's mock server, with the corpus and its state as generated.
+    manifest = load_manifest(corpus_dir)
+    with _server.lock:
+        _server.files = manifest["files"]
+        _server.folders = manifest["folders"]
+        _server.children = {}
+        for item_id, item in [*_server.folders.items(), *_server.files.items()]:
+            _server.children.setdefault(item["parent"], []).append(item_id)
+        _server.attached = {}
+        _server.template_values = {}
+        _server.stats = {"requests": 0, "throttled": 0}
+        _server.throttle_rate = 0.0
+        _server.latency = 0.0
+        _server.retry_after = 1.0
+        _server.rng = random.Random(7)
+        _server.bulk = True
+    return _server
+
+
+@pytest.fixture
+def remove_file(workdrive):
+    # Deletes a file from the mock WorkDrive; returns its manifest entry.
+    def remove(file_id: str) -> dict:
+        with workdrive.lock:
+            document = workdrive.files.pop(file_id)
+            workdrive.children[document["parent"]].remove(file_id)
+        return document
+
+    return remove
+
+
+@pytest.fixture(autouse=True)
+def db(tmp_path, monkeypatch):
+    # A fresh database (and template id file) per test, with the repo's
+    # config/ as the working directory.
+    from src import db as database
+    from src import utils
+
+    database.close_conn()
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.setattr(database, "_MIGRATED", False)
+    monkeypatch.setattr(utils, "TEMPLATE_META", str(tmp_path / "template.json"))
+    monkeypatch.chdir(REPO_ROOT)
+    yield database
+    database.close_conn()
@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from src.workdrive import api
+
+
+class RecordingLimiter(api.RateLimiter):
+    def __init__(self, rate: float = 0.0):
+        super().__init__(rate)
+        self.pauses = []
+
+    def pause(self, seconds: float) -> None:
+        self.pauses.append(seconds)
+        super().pause(seconds)
+
+
+def _response(status: int, **headers) -> httpx.Response:
+    return httpx.Response(status, headers=headers)
+
+
+def test_throttling_halves_the_rate_once_per_burst():
+    limiter = RecordingLimiter(rate=8)
+    for _ in range(3):
+        limiter.observe(_response(429, **{"Retry-After": "0.2"}))
+    assert limiter.rate == 4
+    assert limiter.pauses == [0.2, 0.2, 0.2]
+    assert limiter.stats()["throttled"] == 3
+    # A paused limiter hands out its next slot after Retry-After.
+    assert 0.1 < limiter.reserve() <= 0.2
+
+
+def test_successes_raise_the_rate_additively_up_to_the_ceiling():
+    limiter = api.RateLimiter(rate=2, max_rate=3, increase=0.5)
+    limiter.on_success()
+    assert limiter.rate == 2.25
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.rate == 3
+    limiter.on_throttled(0)
+    assert limiter.rate == 1.5
+
+
+def test_exhausted_quota_pauses_until_reset():
+    limiter = RecordingLimiter()
+    limiter.observe(_response(200, **{"X-RateLimit-Remaining": "5", "X-RateLimit-Reset": "30"}))
+    limiter.observe(_response(200, **{"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "30"}))
+    assert limiter.pauses == [30.0]
+
+
+@pytest.mark.parametrize("value, low, high", [
+    ("12", 12, 12),
+    (str(int(time.time()) + 20), 18, 20),      # epoch timestamp
+    (str(int(time.time()) - 20), 0, 0),        # epoch already past
+    ("99999999", api.RATE_LIMIT_MAX_PAUSE, api.RATE_LIMIT_MAX_PAUSE),
+    ("Wed, 21 Oct 2015 07:28:00 GMT", 0, 0),
+    ("soon", 1, 1),
+])
+def test_reset_headers_are_read_as_seconds_from_now(value, low, high):
+    seconds = api._retry_after(_response(200, **{"X-RateLimit-Reset": value}), header="X-RateLimit-Reset")
+    assert low <= seconds <= high
+
+
+async def _list_root(limiter: api.RateLimiter, calls: int) -> list:
+    client = api.AsyncWorkDriveClient(rate_limiter=limiter, http2=False)
+    try:
+        return [await client.get("/teamfolders/teamfolder/files") for _ in range(calls)]
+    finally:
+        await client.aclose()
+
+
+def test_throttled_calls_wait_retry_after_without_backoff(workdrive):
+    workdrive.throttle_rate = 0.8
+    workdrive.retry_after = 0.02
+    limiter = RecordingLimiter()
+    started = time.monotonic()
+    results = asyncio.run(_list_root(limiter, 10))
+    elapsed = time.monotonic() - started
+    assert len(results) == 10
+    throttled = workdrive.stats["throttled"]
+    # Enough 429s in a row that a 5-attempt cap would have given up.
+    assert throttled > 2 * api.RETRY_ATTEMPTS
+    assert limiter.pauses == [0.02] * throttled
+    # Exponential backoff would add at least a second per 429.
+    assert elapsed < 1.0 + throttled * 0.02
+
+
+def test_throttled_calls_give_up_after_their_own_cap(workdrive, monkeypatch):
+    monkeypatch.setattr(api, "THROTTLE_MAX_RETRIES", 3)
+    workdrive.throttle_rate = 1.0
+    workdrive.retry_after = 0.0
+    with pytest.raises(api.Throttled):
+        asyncio.run(_list_root(RecordingLimiter(), 1))
+    assert workdrive.stats["throttled"] == 4
@@ -0,0 +1,76 @@
+import pytest
+
+from src.workdrive import inventory
+
+
+def _nested_file(server) -> str:
+    # A file two folder levels below the team folder.
+    for file_id, document in sorted(server.files.items()):
+        parent = server.folders.get(document["parent"])
+        if parent and parent["parent"] != server.root:
+            return file_id
+    raise AssertionError("corpus has no nested file")
+
+
+def _live(db) -> set:
+    return {row[0] for row in db._conn().execute("SELECT file_id FROM documents WHERE deleted_at IS NULL")}
+
+
+def test_full_crawl_records_every_file(workdrive, db):
+    assert inventory.crawl_incremental(full=True) == 0
+    assert _live(db) == set(workdrive.files)
+
+
+def test_incremental_crawl_skips_unchanged_folders(workdrive, db):
+    inventory.crawl_incremental(full=True)
+    listed = workdrive.stats["list"]
+    assert inventory.crawl_incremental() == 0
+    # Only the team folder itself is relisted.
+    assert workdrive.stats["list"] - listed < listed
+    assert _live(db) == set(workdrive.files)
+
+
+def test_direct_child_deletion_is_tombstoned(workdrive, db, remove_file):
+    inventory.crawl_incremental(full=True)
+    # Its folder's child count, seen in the team folder listing, changes.
+    file_id = next(file_id for file_id, document in sorted(workdrive.files.items())
+                   if workdrive.folders.get(document["parent"], {}).get("parent") == workdrive.root)
+    remove_file(file_id)
+    assert inventory.crawl_incremental() == 1
+    assert _live(db) == set(workdrive.files)
+
+
+def test_nested_deletion_is_found_once_folders_are_due(workdrive, db, remove_file, monkeypatch):
+    # A nested change leaves its ancestors' markers alone; folders older
+    # than CRAWL_RELIST_HOURS are relisted anyway.
+    inventory.crawl_incremental(full=True)
+    file_id = _nested_file(workdrive)
+    remove_file(file_id)
+    assert inventory.crawl_incremental() == 0
+    monkeypatch.setattr(inventory, "CRAWL_RELIST_HOURS", 0)
+    assert inventory.crawl_incremental() == 1
+    assert file_id not in _live(db)
+    assert _live(db) == set(workdrive.files)
+
+
+def test_crawl_within_one_second_tombstones(workdrive, db, remove_file):
+    # Timestamps are kept to the millisecond, so back-to-back runs still
+    # tell seen rows from stale ones.
+    inventory.crawl_incremental(full=True)
+    file_id = sorted(workdrive.files)[0]
+    remove_file(file_id)
+    assert inventory.crawl_incremental(full=True) == 1
+    assert db._conn().execute("SELECT deleted_at IS NOT NULL FROM documents WHERE file_id=?", (file_id,)).fetchone()[0]
+
+
+@pytest.mark.parametrize("full", [True, False])
+def test_recrawl_revives_restored_file(workdrive, db, remove_file, full, monkeypatch):
+    monkeypatch.setattr(inventory, "CRAWL_RELIST_HOURS", 0)
+    inventory.crawl_incremental(full=True)
+    file_id = _nested_file(workdrive)
+    document = remove_file(file_id)
+    assert inventory.crawl_incremental(full=full) == 1
+    workdrive.files[file_id] = document
+    workdrive.children[document["parent"]].append(file_id)
+    inventory.crawl_incremental(full=full)
+    assert file_id in _live(db)
@@ -0,0 +1,63 @@
+import csv
+
+import pytest
+
+from src.db import upsert_labels_many
+from src.utils import import_corrected_csv, write_csv
+from src.workdrive.inventory import crawl_incremental
+
+
+@pytest.fixture
+def labeled(workdrive, db):
+    crawl_incremental(full=True)
+    file_ids = sorted(workdrive.files)[:3]
+    upsert_labels_many((file_id, {"doc_type": "SOP", "model_type": "S50"}, "heuristic", 0.9, 1)
+                       for file_id in file_ids)
+    return file_ids
+
+
+def _write(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["file_id", "doc_type", "model_type"])
+        writer.writeheader()
+        writer.writerows(rows)
+    return str(path)
+
+
+def _label(db, file_id):
+    return db._conn().execute(
+        "SELECT doc_type, model_type, source, needs_review FROM labels WHERE file_id=?", (file_id,)
+    ).fetchone()
+
+
+def test_rows_outside_the_picklists_are_rejected(tmp_path, db, labeled):
+    good, typo, blank = labeled
+    path = _write(tmp_path / "corrections.csv", [
+        {"file_id": good, "doc_type": "PCN", "model_type": "V40"},
+        {"file_id": typo, "doc_type": "Sop", "model_type": "S50"},
+        {"file_id": "", "doc_type": "PCN", "model_type": "V40"},
+        {"file_id": blank, "doc_type": "", "model_type": ""},
+    ])
+    stats = import_corrected_csv(path)
+    assert (stats["rows"], stats["updated"], stats["rejected"]) == (2, 2, 2)
+    assert stats["errors"] == ["line 3: doc_type='Sop' not in candidate values", "line 4: missing file_id"]
+    assert _label(db, good) == ("PCN", "V40", "human", 0)
+    assert _label(db, typo) == ("SOP", "S50", "heuristic", 1)
+    assert _label(db, blank) == ("", "", "human", 0)
+    assert db._conn().execute("SELECT COUNT(*) FROM audit WHERE file_id=?", (typo,)).fetchone()[0] == 0
+
+
+def test_unknown_files_are_counted_missing(tmp_path, db, labeled):
+    path = _write(tmp_path / "corrections.csv", [{"file_id": "no-such-file", "doc_type": "PCN", "model_type": ""}])
+    stats = import_corrected_csv(path)
+    assert (stats["rows"], stats["missing"], stats["rejected"]) == (1, 1, 0)
+
+
+def test_exported_csv_round_trips_unchanged(tmp_path, db, labeled):
+    path = str(tmp_path / "labels.csv.gz")
+    exported = write_csv(path)
+    stats = import_corrected_csv(path)
+    # Unlabeled documents are exported too and have no label row to correct.
+    assert (stats["rejected"], stats["updated"], stats["missing"]) == (0, len(labeled), exported - len(labeled))
+    # Importing marks everything human-reviewed once; a second import is a no-op.
+    assert import_corrected_csv(path)["updated"] == 0
@@ -0,0 +1,71 @@
+import sqlite3
+
+# The documents and labels tables as the first schema.sql created them,
+# before migrations were versioned.
+BASELINE_SCHEMA = """
+CREATE TABLE documents (
+  file_id TEXT PRIMARY KEY,
+  name TEXT,
+  path TEXT,
+  size INTEGER,
+  created_time TEXT,
+  modified_time TEXT,
+  suffix TEXT,
+  permalink TEXT,
+  download_url TEXT,
+  sha256 TEXT,
+  excerpt TEXT,
+  last_seen TEXT DEFAULT (datetime('now'))
+);
+CREATE TABLE labels (
+  file_id TEXT PRIMARY KEY,
+  doc_type TEXT,
+  model_type TEXT,
+  subsystem TEXT,
+  language TEXT,
+  source TEXT,
+  confidence REAL,
+  needs_review INTEGER DEFAULT 1
+);
+"""
+
+
+def _baseline_db(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany(
+        "INSERT INTO documents(file_id, name, path, size, modified_time, suffix, excerpt) VALUES (?,?,?,?,?,?,?)",
+        [
+            ("f1", "Pump Manual.pdf", "/Service/Pump Manual.pdf", 10, "2024-01-01", ".pdf", "priming the coolant pump"),
+            ("f2", "Notes.txt", "/Service/Notes.txt", 5, "2024-01-01", ".txt", None),
+        ],
+    )
+    conn.execute("INSERT INTO labels(file_id, doc_type, source, confidence) VALUES ('f1', 'Manual', 'human', 1.0)")
+    conn.commit()
+    conn.close()
+
+
+def test_fresh_database_applies_every_migration_once(db):
+    assert db.init_db() == [version for version, _, _ in db._MIGRATIONS]
+    assert db.init_db() == []
+    assert [row[0] for row in db.schema_versions()] == [version for version, _, _ in db._MIGRATIONS]
+
+
+def test_baseline_schema_is_migrated(db):
+    _baseline_db(db.DB_PATH)
+    assert db.init_db() == [1, 2, 3]
+    conn = db._conn()
+    assert "excerpt" not in db._columns(conn, "documents")
+    assert {"parent_id", "deleted_at", "excerpt_chars"} <= set(db._columns(conn, "documents"))
+    assert {"priority", "rules_version"} <= set(db._columns(conn, "labels"))
+    assert conn.execute("SELECT file_id, excerpt FROM excerpts").fetchall() == [("f1", "priming the coolant pump")]
+    assert conn.execute("SELECT file_id, excerpt_chars FROM documents ORDER BY file_id").fetchall() == [
+        ("f1", len("priming the coolant pump")), ("f2", None)]
+    assert conn.execute("SELECT doc_type, source FROM labels WHERE file_id='f1'").fetchone() == ("Manual", "human")
+    # The search index is rebuilt over the moved excerpts.
+    assert [row["file_id"] for row in db.search_documents("coolant")] == ["f1"]
+    assert [row["file_id"] for row in db.search_documents("notes")] == ["f2"]
+
+    db.close_conn()
+    db._MIGRATED = False
+    assert db.init_db() == []
@@ -0,0 +1,78 @@
+import re
+
+import pytest
+import yaml
+
+from src.classify import heuristic
+from src.db import apply_label_corrections, store_excerpts
+from src.workdrive.inventory import crawl_incremental
+
+
+def _labels(db) -> dict:
+    return {
+        row[0]: row[1:]
+        for row in db._conn().execute("SELECT file_id, subsystem, source, needs_review, rules_version FROM labels")
+    }
+
+
+def _write_rules(path, rename=None):
+    config = yaml.safe_load(open("config/regex.yml"))
+    if rename:
+        old, new = rename
+        config["subsystem"] = {new if label == old else label: rule for label, rule in config["subsystem"].items()}
+    path.write_text(yaml.safe_dump(config, allow_unicode=True, sort_keys=False))
+
+
+def test_stale_relabel_leaves_human_labels_alone(tmp_path, monkeypatch, workdrive, db):
+    rules = tmp_path / "regex.yml"
+    _write_rules(rules)
+    monkeypatch.setattr(heuristic, "REGEX_PATH", str(rules))
+    crawl_incremental(full=True)
+    store_excerpts((file_id, "", None, "skipped") for file_id in workdrive.files)
+    assert heuristic.run_heuristics() == len(workdrive.files)
+
+    pumps = sorted(file_id for file_id, row in _labels(db).items() if row[0] == "Pump")
+    assert len(pumps) >= 2
+    reviewed = pumps[::2]
+    apply_label_corrections(({"file_id": file_id} for file_id in reviewed), actor="reviewer:test")
+    before = _labels(db)
+
+    _write_rules(rules, rename=("Pump", "Coolant Pump"))
+    stats = heuristic.run_stale_heuristics()
+    after = _labels(db)
+    assert stats["checked"] == len(workdrive.files) - len(reviewed)
+    assert stats["changed"] == len(pumps) - len(reviewed)
+    assert stats["transitions"] == {("subsystem", "Pump", "Coolant Pump"): len(pumps) - len(reviewed)}
+    for file_id in reviewed:
+        assert after[file_id] == before[file_id]
+    for file_id in set(pumps) - set(reviewed):
+        assert after[file_id][:3] == ("Coolant Pump", "heuristic", 1)
+        assert after[file_id][3] == stats["version"] != before[file_id][3]
+    audit = db._conn().execute("SELECT file_id, field, old_value, new_value FROM audit WHERE actor='pipeline:stale'")
+    assert sorted(audit) == [(file_id, "subsystem", "Pump", "Coolant Pump") for file_id in sorted(set(pumps) - set(reviewed))]
+
+    assert heuristic.run_stale_heuristics()["checked"] == 0
+
+
+@pytest.mark.parametrize("patterns, problem", [
+    ({"A": "foo", "B": "(?i)bar"}, "global inline flag"),
+    ({"A": "(a)\\1", "B": "x"}, "numbered backreference"),
+    ({"A": "x", "B": "(a)\\1"}, "numbered backreference"),
+    ({"A": "x", "B": "(a)?(?(1)b|c)"}, "numbered backreference"),
+    ({"A": "(?P<model>S50)", "B": "(?P<model>V40)"}, "'model' is also used by A"),
+    ({"A": "(?P<_h1>x)"}, "reserved"),
+    ({"A": "x", "B": "(unclosed"}, "Invalid pattern for doc_type/B"),
+])
+def test_patterns_that_break_the_alternation_are_rejected(patterns, problem):
+    with pytest.raises(ValueError, match=re.escape(problem)):
+        heuristic.compile_rules({"doc_type": patterns})
+
+
+def test_named_references_and_scoped_flags_keep_their_meaning():
+    matchers = heuristic.compile_rules({"doc_type": {"A": "x", "B": "(?P<twice>a)(?P=twice)", "C": "(?-i:SOP)"},
+                                        "model_type": {"S50": "\\\\S50"}})
+    assert heuristic._score_field(matchers["doc_type"], "aa", 0)[0] == "B"
+    assert heuristic._score_field(matchers["doc_type"], "sop", 0)[0] == ""
+    assert heuristic._score_field(matchers["doc_type"], "SOP", 0)[0] == "C"
+    assert heuristic._score_field(matchers["model_type"], "\\S50", 0)[0] == "S50"
+    assert heuristic.compile_rules(yaml.safe_load(open("config/regex.yml")))
@@ -0,0 +1,33 @@
+import threading
+
+from src import pipeline
+
+
+def test_each_pass_closes_its_cursor_before_the_next_poll(monkeypatch):
+    monkeypatch.setattr(pipeline, "PIPELINE_POLL_SECONDS", 0.01)
+    upstream = threading.Event()
+    open_sources = []
+    taken = []
+
+    def rows():
+        open_sources.append(True)
+        try:
+            for index in range(3):
+                yield {"file_id": f"f{index}"}
+        finally:
+            open_sources.pop()
+
+    def fetch():
+        # Stands in for an iter_* query: a generator over an open cursor.
+        assert not open_sources, "previous pass's cursor is still open"
+        upstream.set()
+        return rows()
+
+    def run_pass(documents):
+        # Stops after one document, leaving the rest of the cursor unread.
+        taken.append(next(iter(documents))["file_id"])
+
+    stats = pipeline._passes(fetch, run_pass, upstream, threading.Event())
+    assert not open_sources
+    assert taken == ["f0", "f1", "f2"]
+    assert stats == {"documents": 3, "passes": 3}
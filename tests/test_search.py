@@ -0,0 +1,80 @@
+import sqlite3
+
+import pytest
+
+from src.db import rebuild_search_index, search_documents, store_excerpts, upsert_documents
+
+
+def _document(**changes) -> dict:
+    row = {"file_id": "f1", "name": "Pump Manual.pdf", "path": "/Service/Pump Manual.pdf", "size": 100,
+           "created_time": "2025-01-01", "modified_time": "2025-01-01", "parent_id": "fo1"}
+    return {**row, **changes}
+
+
+def _found(text: str) -> list:
+    return [row["file_id"] for row in search_documents(text)]
+
+
+def _check_index(db) -> None:
+    # Raises if the index disagrees with itself or with documents_search.
+    conn = db._conn()
+    conn.execute("INSERT INTO documents_fts(documents_fts) VALUES ('integrity-check')")
+    conn.execute("INSERT INTO documents_fts(documents_fts, rank) VALUES ('integrity-check', 1)")
+
+
+def test_index_follows_documents_and_excerpts(db):
+    upsert_documents([_document(), _document(file_id="f2", name="Notes.txt", path="/Service/Notes.txt")])
+    assert _found("pump") == ["f1"]
+    assert _found("coolant") == []
+    _check_index(db)
+
+    store_excerpts([("f1", "priming the coolant pump", "sha-1", "pdfium")])
+    assert _found("coolant") == ["f1"]
+    _check_index(db)
+
+    store_excerpts([("f1", "bleeding the hydraulic lines", "sha-1", "pdfium")])
+    assert _found("coolant") == []
+    assert _found("hydraulic") == ["f1"]
+    _check_index(db)
+
+    # A crawl that sees the same content keeps the excerpt; a rename reindexes the name.
+    upsert_documents([_document(name="Hydraulics Guide.pdf", path="/Service/Hydraulics Guide.pdf")])
+    assert _found("pump") == []
+    assert _found("guide hydraulic") == ["f1"]
+    _check_index(db)
+
+    # Changed content drops the excerpt until it is extracted again.
+    upsert_documents([_document(name="Hydraulics Guide.pdf", path="/Service/Hydraulics Guide.pdf",
+                                modified_time="2025-02-01", size=120)])
+    assert _found("hydraulic lines") == []
+    assert _found("guide") == ["f1"]
+    _check_index(db)
+    store_excerpts([("f1", "replacing the drive wheel", "sha-2", "pdfium")])
+    assert _found("wheel") == ["f1"]
+    assert _found("notes") == ["f2"]
+    _check_index(db)
+
+    assert rebuild_search_index() == 2
+    assert _found("wheel") == ["f1"]
+    _check_index(db)
+
+
+def test_deleted_documents_leave_the_index(db):
+    upsert_documents([_document()])
+    store_excerpts([("f1", "priming the coolant pump", "sha-1", "pdfium")])
+    with db._conn() as conn:
+        conn.execute("DELETE FROM documents WHERE file_id='f1'")
+    assert _found("coolant") == []
+    assert db._conn().execute("SELECT COUNT(*) FROM excerpts").fetchone()[0] == 0
+    _check_index(db)
+
+
+def test_integrity_check_catches_a_stale_index(db):
+    # The check above would notice a trigger that indexed the wrong text.
+    upsert_documents([_document()])
+    with db._conn() as conn:
+        conn.execute("INSERT INTO excerpts(file_id, excerpt) VALUES ('f1', 'priming the coolant pump')")
+        conn.execute("DROP TRIGGER excerpts_fts_update")
+        conn.execute("UPDATE excerpts SET excerpt='bleeding the lines' WHERE file_id='f1'")
+    with pytest.raises(sqlite3.DatabaseError, match="malformed|corrupt"):
+        _check_index(db)
@@ -0,0 +1,113 @@
+import pytest
+
+from src.db import apply_label_corrections, upsert_labels_many
+from src.sync import sync_templates
+from src.sync.sync_templates import plan_sync, push_to_workdrive
+from src.workdrive.inventory import crawl_incremental
+
+
+@pytest.fixture
+def approved(workdrive, db):
+    # Every file crawled, labeled and approved, so sync pushes all of them.
+    crawl_incremental(full=True)
+    file_ids = sorted(workdrive.files)
+    upsert_labels_many((file_id, {"doc_type": "SOP", "model_type": "S50"}, "heuristic", 0.9, 1)
+                       for file_id in file_ids)
+    apply_label_corrections(({"file_id": file_id} for file_id in file_ids), actor="reviewer:test")
+    return file_ids
+
+
+def _synced(db) -> set:
+    return {row[0] for row in db._conn().execute("SELECT file_id FROM sync_state WHERE payload_hash IS NOT NULL")}
+
+
+def test_sync_pushes_once_then_is_a_no_op(workdrive, db, approved):
+    plan = plan_sync()
+    assert plan["changed"] == len(approved) and plan["attach_calls"] == len(approved)
+    stats = push_to_workdrive(workers=4)
+    assert stats["pushed"] == stats["attached"] == len(approved) and stats["failed"] == 0
+    assert set(workdrive.template_values) == set(approved)
+    assert workdrive.template_values[approved[0]]["Document Type"] == "SOP"
+    assert workdrive.stats["bulk_update"] == plan["update_calls"]
+
+    requests = workdrive.stats["requests"]
+    assert plan_sync()["calls"] == 0
+    assert push_to_workdrive(workers=4) == {"checked": len(approved), "unchanged": len(approved),
+                                            "pushed": 0, "failed": 0, "attached": 0}
+    assert workdrive.stats["requests"] == requests
+
+
+def test_changed_label_is_pushed_without_reattaching(workdrive, db, approved):
+    push_to_workdrive(workers=4)
+    apply_label_corrections([{"file_id": approved[0], "doc_type": "PCN"}], actor="reviewer:test")
+    stats = push_to_workdrive(workers=4)
+    assert (stats["pushed"], stats["attached"], stats["unchanged"]) == (1, 0, len(approved) - 1)
+    assert workdrive.template_values[approved[0]]["Document Type"] == "PCN"
+    assert workdrive.stats["attach"] == len(approved)
+
+
+def test_falls_back_to_per_file_updates(workdrive, db, approved):
+    workdrive.bulk = False
+    stats = push_to_workdrive(workers=4)
+    assert stats["failed"] == 0 and stats["pushed"] == len(approved)
+    assert set(workdrive.template_values) == set(approved) == _synced(db)
+
+
+@pytest.mark.parametrize("bulk", [True, False])
+def test_requests_in_flight_stay_within_workers(workdrive, db, approved, monkeypatch, bulk):
+    workdrive.bulk = bulk
+    workdrive.latency = 0.01
+    in_flight = {"now": 0, "peak": 0}
+
+    def counted(request):
+        async def wrapper(*args, **kwargs):
+            in_flight["now"] += 1
+            in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+            try:
+                return await request(*args, **kwargs)
+            finally:
+                in_flight["now"] -= 1
+        return wrapper
+
+    for name in ("aattach_template", "abulk_update_values", "aupdate_values"):
+        monkeypatch.setattr(sync_templates, name, counted(getattr(sync_templates, name)))
+    stats = push_to_workdrive(workers=3)
+    assert stats["pushed"] == len(approved)
+    assert in_flight["peak"] == 3
+
+
+def test_failed_rows_are_retried(workdrive, db, approved, remove_file):
+    missing = approved[0]
+    document = remove_file(missing)
+    stats = push_to_workdrive(workers=4)
+    assert stats["failed"] == 1 and stats["pushed"] == len(approved) - 1
+    failures = db._conn().execute("SELECT failures, last_error FROM sync_state WHERE file_id=?", (missing,)).fetchone()
+    assert failures[0] == 1 and failures[1]
+    assert missing not in _synced(db)
+
+    workdrive.files[missing] = document
+    stats = push_to_workdrive(workers=4)
+    assert (stats["pushed"], stats["failed"]) == (1, 0)
+    assert _synced(db) == set(approved)
+
+
+def test_interrupted_sync_records_requests_already_sent(workdrive, db, approved, monkeypatch):
+    changed_rows = sync_templates._changed_rows
+
+    def interrupted(rows, template_id, stats):
+        for count, change in enumerate(changed_rows(rows, template_id, stats)):
+            if count == 25:
+                raise KeyboardInterrupt
+            yield change
+
+    monkeypatch.setattr(sync_templates, "_changed_rows", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        push_to_workdrive(workers=2)
+    # Whatever reached WorkDrive is recorded, so the next run skips it.
+    assert workdrive.template_values
+    recorded = _synced(db)
+    assert recorded == set(workdrive.template_values)
+    monkeypatch.setattr(sync_templates, "_changed_rows", changed_rows)
+    stats = push_to_workdrive(workers=2)
+    assert stats["pushed"] == len(approved) - len(recorded)
+    assert _synced(db) == set(approved)